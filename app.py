@@ -3,11 +3,18 @@
 # atk pdf fill function
 
 # ------------------------------------------------------------------------------
+import atexit
 import base64
 import json
 import io
-from typing import Any, Dict
-from flask import Flask, request, Response, jsonify
+import os
+import re
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+from flask import Flask, request, Response, jsonify, g, has_request_context
 
 app = Flask(__name__)
 
@@ -22,60 +29,3009 @@ def pxJson(obj: Any, key: str, default: Any = None) -> Any:
 		return default
 
 
+def _pxRequestOptions(src, result: Dict[str, Any]) -> None:
+	"""Copy the non-file options of a multipart form or query string (fields, images, records, return, ...) into result."""
+	template_id = src.get('template_id')
+	if template_id:
+		result['template_id'] = template_id.strip()
+	fields_raw = src.get('fields')
+	fields: Dict[str, Any] = {}
+	if fields_raw:
+		try:
+			fields = json.loads(fields_raw)
+		except Exception:
+			fields = {}
+	result['data'] = fields
+	images_raw = src.get('images')
+	if images_raw:
+		try:
+			images = json.loads(images_raw)
+			if isinstance(images, dict):
+				result['images'] = images
+		except Exception:
+			pass
+	records_raw = src.get('records')
+	if records_raw:
+		try:
+			result['records'] = json.loads(records_raw)
+		except Exception:
+			pass
+	if src.get('return'):
+		result['return'] = src.get('return')
+	if src.get('optimize'):
+		result['return'] = {'mode': result.get('return'), 'optimize': src.get('optimize')}
+	if src.get('profile'):
+		result['profile'] = src.get('profile')
+	readonly = src.get('readonly')
+	flatten = src.get('flatten')
+	form = {}
+	if readonly is not None:
+		form['readonly'] = str(readonly).lower() in ['1', 'true', 'on', 'yes']
+	if flatten is not None:
+		form['flatten'] = str(flatten).lower() in ['1', 'true', 'on', 'yes']
+	flatten_pages = src.get('flatten_pages')
+	if flatten_pages:
+		form['flatten'] = [p.strip() for p in str(flatten_pages).split(',') if p.strip()]
+	if form:
+		result['form'] = form
+
+
 def pxConvertRequest() -> Dict[str, Any]:
 	"""Convert current Flask request to expected object format for atkFillPdfFromData.
-	Supports multipart/form-data with 'pdf' file and 'fields'/'images' (JSON) or application/json body.
+	Supports multipart/form-data with 'pdf' file and 'fields'/'images' (JSON), an application/pdf raw body
+	with the same options in the query string, or an application/json body.
+	Uploaded PDFs are passed on as raw bytes, or as an AtkSpooledFile above ATKPDF_SPOOL_MB; base64 is only
+	decoded for JSON bodies. Multipart file parts
+	named images.<field> become images.<field>.source. A multipart 'optimize' field becomes return.optimize.
 	"""
+	with atkMetrics.time('parse'):
+		return _pxConvertRequest()
+
+
+def _pxConvertRequest() -> Dict[str, Any]:
 	result: Dict[str, Any] = {}
 	ct = (request.content_type or '').lower()
 	try:
 		if 'multipart/form-data' in ct:
 			pdf_file = request.files.get('pdf')
 			if pdf_file:
-				pdf_bytes = pdf_file.read()
-				result['pdf'] = base64.b64encode(pdf_bytes).decode('ascii')
-			fields_raw = request.form.get('fields')
-			fields: Dict[str, Any] = {}
-			if fields_raw:
+				result['pdf'] = pxSpoolUpload(pdf_file.stream)
+			_pxRequestOptions(request.form, result)
+			for part, upload in request.files.items():
+				if part.startswith('images.') and len(part) > 7:
+					images = result.setdefault('images', {})
+					cfg = images.get(part[7:])
+					images[part[7:]] = {**(cfg if isinstance(cfg, dict) else {}), 'source': upload.read()}
+		elif 'application/pdf' in ct:
+			result['pdf'] = pxSpoolUpload(request.stream)
+			_pxRequestOptions(request.args, result)
+		elif 'application/json' in ct:
+			payload = request.get_json(silent=True) or {}
+			if isinstance(payload, dict):
+				result = payload
+		else:
+			# Try to read raw body as JSON
+			payload = request.get_json(silent=True) or {}
+			if isinstance(payload, dict):
+				result = payload
+	except Exception:
+		pass
+	return result
+
+
+def pxEnvInt(name: str, default: int) -> int:
+	"""Read an integer setting from the environment; returns default if missing or invalid."""
+	try:
+		return int(os.environ.get(name, '') or default)
+	except Exception:
+		return default
+
+
+def pxServerThreads() -> int:
+	"""Request threads per worker as given to gunicorn with --threads (command line or GUNICORN_CMD_ARGS); 1 if unset."""
+	import sys
+	args = sys.argv[1:] + os.environ.get('GUNICORN_CMD_ARGS', '').split()
+	value = None
+	for i, arg in enumerate(args):
+		if arg == '--threads' and i + 1 < len(args):
+			value = args[i + 1]
+		elif arg.startswith('--threads='):
+			value = arg.split('=', 1)[1]
+	try:
+		return max(1, int(value or 1))
+	except ValueError:
+		return 1
+
+
+def pxHasModule(name: str) -> bool:
+	"""Whether an optional dependency is installed, without importing it."""
+	import importlib.util
+	return importlib.util.find_spec(name) is not None
+
+
+def pxDecodeB64Bytes(s: Any) -> Optional[bytes]:
+	"""Safe base64 decoder (data URLs, whitespace, missing padding, urlsafe fallback); None on failure."""
+	if not isinstance(s, str): return None
+	val = s.strip()
+	if val.startswith('data:'):
+		parts = val.split(',', 1)
+		if len(parts) == 2: val = parts[1]
+	# well-formed input decodes in one pass, without the cleanup copies below
+	try: return base64.b64decode(val, validate=True)
+	except Exception: pass
+	val = ''.join(val.split())
+	pad = len(val) % 4
+	if pad: val += '=' * (4 - pad)
+	try: return base64.b64decode(val)
+	except Exception:
+		try: return base64.urlsafe_b64decode(val)
+		except Exception: return None
+
+
+def pxStreamFile(path: str, mimetype: str, headers: Optional[Dict[str, str]] = None, remove: bool = False,
+		chunk_size: int = 65536) -> Response:
+	"""Stream a file to the client in chunks; optionally delete it once fully sent (or the client goes away)."""
+	def _gen():
+		try:
+			with open(path, 'rb') as f:
+				while True:
+					block = f.read(chunk_size)
+					if not block:
+						break
+					yield block
+		finally:
+			if remove:
+				try:
+					os.remove(path)
+				except OSError:
+					pass
+	h = {"Content-Length": str(os.path.getsize(path))}
+	h.update(headers or {})
+	return Response(_gen(), mimetype=mimetype, headers=h)
+
+
+# ----------------------------- Spooling -----------------------------
+# Large uploads and all rendered outputs live in temporary files (ATKPDF_SPOOL_DIR, default the system temp
+# dir) instead of request memory: uploads above ATKPDF_SPOOL_MB (default 8) are written to disk in chunks
+# and opened by filename, outputs are saved to a file and streamed (pxStreamFile).
+
+def pxSpoolPath(prefix: str = 'atkout-', suffix: str = '.pdf') -> str:
+	"""Create an empty temporary file in the spool directory and return its path."""
+	import tempfile
+	fd, path = tempfile.mkstemp(prefix=prefix, suffix=suffix, dir=os.environ.get('ATKPDF_SPOOL_DIR') or None)
+	os.close(fd)
+	return path
+
+
+def pxRemoveQuiet(path: Optional[str]) -> None:
+	if path:
+		try:
+			os.remove(path)
+		except OSError:
+			pass
+
+
+class AtkSpooledFile:
+	"""An upload spooled to a temporary file: path, sha256 of the content (the template key) and size."""
+
+	def __init__(self, path: str, key: str, size: int):
+		self.path = path
+		self.key = key
+		self.size = size
+
+	def __len__(self) -> int:
+		return self.size
+
+	def read(self) -> bytes:
+		with open(self.path, 'rb') as f:
+			return f.read()
+
+	def remove(self) -> None:
+		pxRemoveQuiet(self.path)
+
+
+def pxSpoolUpload(stream, threshold: Optional[int] = None, chunk_size: int = 1 << 20):
+	"""Read an upload stream: bodies up to the threshold (ATKPDF_SPOOL_MB) are returned as bytes, larger ones
+	are copied to a temporary file in chunks and returned as an AtkSpooledFile. Inside a request the file is
+	removed when the request ends; otherwise the caller removes it.
+	"""
+	if threshold is None:
+		threshold = pxEnvInt('ATKPDF_SPOOL_MB', 8) * 1024 * 1024
+	head = stream.read(threshold + 1)
+	if len(head) <= threshold:
+		return head
+	path = pxSpoolPath('atkupload-')
+	digest = hashlib.sha256(head)
+	size = len(head)
+	try:
+		with open(path, 'wb') as f:
+			f.write(head)
+			del head
+			while True:
+				block = stream.read(chunk_size)
+				if not block:
+					break
+				digest.update(block)
+				f.write(block)
+				size += len(block)
+	except Exception:
+		pxRemoveQuiet(path)
+		raise
+	spooled = AtkSpooledFile(path, digest.hexdigest(), size)
+	if has_request_context():
+		g.setdefault('atk_spooled', []).append(spooled)
+	return spooled
+
+
+def pxRss() -> Optional[int]:
+	"""Resident set size of this process in bytes (Linux /proc); None where unavailable."""
+	try:
+		with open('/proc/self/statm') as f:
+			return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+	except Exception:
+		return None
+
+
+class AtkMemoryProbe:
+	"""Tracks the peak RSS of this process while active by sampling every ATKPDF_MEMORY_SAMPLE_MS
+	(default 5; 0 disables). The process is shared by concurrent requests, so the numbers are an upper
+	bound for one request in a threaded worker and exact for a render running in an engine process.
+	"""
+
+	def __init__(self, interval_ms: Optional[int] = None):
+		self.interval = (pxEnvInt('ATKPDF_MEMORY_SAMPLE_MS', 5) if interval_ms is None else interval_ms) / 1000.0
+		self.start = None
+		self.end = None
+		self.peak = None
+		self._stop = threading.Event()
+		self._thread = None
+
+	def _sample(self) -> None:
+		rss = pxRss()
+		if rss is not None and (self.peak is None or rss > self.peak):
+			self.peak = rss
+
+	def _run(self) -> None:
+		while not self._stop.wait(self.interval):
+			self._sample()
+
+	def __enter__(self):
+		if self.interval > 0:
+			self.start = pxRss()
+			if self.start is not None:
+				self.peak = self.start
+				self._thread = threading.Thread(target=self._run, name='atk-memory-probe', daemon=True)
+				self._thread.start()
+		return self
+
+	def __exit__(self, *exc) -> None:
+		if self._thread is not None:
+			self._stop.set()
+			self._thread.join()
+			self._sample()
+			self.end = pxRss()
+
+	def stats(self) -> Optional[Dict[str, Any]]:
+		if self.start is None:
+			return None
+		return {"rssStart": self.start, "rssEnd": self.end, "rssPeak": self.peak, "peakDelta": self.peak - self.start}
+
+
+# ----------------------------- Metrics -----------------------------
+# Prometheus text metrics served by GET /metrics. Every process keeps its own counters, gauges and
+# histograms and writes a snapshot (at most once a second while they change) to ATKPDF_METRICS_DIR,
+# by default a directory under the system temp dir named after the parent (gunicorn master) pid;
+# /metrics sums the snapshots of all live workers. A worker removes its snapshot when it exits; snapshots of
+# workers that died without doing so, or that belong to another master (an earlier run sharing the directory),
+# are removed by the next /metrics. Totals therefore drop when a worker is recycled, which Prometheus reads as
+# a counter reset.
+
+ATK_METRIC_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+class AtkMetrics:
+	"""Process-local metric registry with a file snapshot per process for cross-worker aggregation."""
+
+	def __init__(self):
+		self._meta: Dict[str, Tuple[str, str]] = {}  # name -> (type, help)
+		self._values: Dict[str, Dict[str, Any]] = {}  # name -> {label json: value or [buckets..., sum, count]}
+		self._lock = threading.Lock()
+		self._dirty = False
+		self._retired = False
+		self._pid = None
+		# set in engine processes: values go back to the worker with each result (drain()) instead of to a snapshot
+		self.forward = False
+
+	def describe(self, name: str, kind: str, help_text: str) -> None:
+		self._meta[name] = (kind, help_text)
+		self._values.setdefault(name, {})
+
+	@staticmethod
+	def _labels(labels: Dict[str, Any]) -> str:
+		return json.dumps(sorted((k, str(v)) for k, v in labels.items()))
+
+	def _changed(self) -> None:
+		self._dirty = True
+		if self._pid != os.getpid() and not self.forward:
+			self._pid = os.getpid()
+			threading.Thread(target=self._flush_loop, name='atk-metrics', daemon=True).start()
+
+	def inc(self, name: str, value: float = 1, **labels) -> None:
+		key = self._labels(labels)
+		with self._lock:
+			series = self._values[name]
+			series[key] = series.get(key, 0) + value
+			self._changed()
+
+	def observe(self, name: str, value: float, **labels) -> None:
+		key = self._labels(labels)
+		with self._lock:
+			series = self._values[name]
+			hist = series.get(key)
+			if hist is None:
+				hist = series[key] = [0] * (len(ATK_METRIC_BUCKETS) + 2)
+			for n, bound in enumerate(ATK_METRIC_BUCKETS):
+				if value <= bound:
+					hist[n] += 1
+			hist[-2] += value
+			hist[-1] += 1
+			self._changed()
+
+	def stage(self, stage: str, seconds: float) -> None:
+		"""Record a stage duration in atkpdf_stage_seconds and in the current request's Server-Timing."""
+		self.observe('atkpdf_stage_seconds', seconds, stage=stage)
+		self.timing(stage, seconds)
+
+	def timing(self, stage: str, seconds: float) -> None:
+		"""Add a stage duration to the current request's Server-Timing only."""
+		if has_request_context():
+			timings = g.setdefault('atk_stages', {})
+			timings[stage] = timings.get(stage, 0.0) + seconds
+
+	def time(self, stage: str):
+		"""Context manager recording the duration of a stage (see stage())."""
+		metrics = self
+
+		class _Timer:
+			def __enter__(self):
+				self.start = time.perf_counter()
+				return self
+
+			def __exit__(self, *exc):
+				metrics.stage(stage, time.perf_counter() - self.start)
+
+		return _Timer()
+
+	def metrics_dir(self) -> str:
+		import tempfile
+		return os.environ.get('ATKPDF_METRICS_DIR') or os.path.join(tempfile.gettempdir(), f'atkpdf-metrics-{os.getppid()}')
+
+	def snapshot(self) -> Dict[str, Any]:
+		with self._lock:
+			return {"pid": os.getpid(), "parent": os.getppid(), "values": json.loads(json.dumps(self._values))}
+
+	def flush(self) -> None:
+		"""Write this process' snapshot for the other workers' /metrics."""
+		self._dirty = False
+		if self._retired or self.forward:
+			return
+		try:
+			os.makedirs(self.metrics_dir(), exist_ok=True)
+			_atkWriteAtomic(os.path.join(self.metrics_dir(), f'{os.getpid()}.json'), json.dumps(self.snapshot()).encode('utf-8'))
+		except OSError:
+			pass
+
+	def _flush_loop(self) -> None:
+		while True:
+			time.sleep(1.0)
+			if self._dirty:
+				self.flush()
+
+	def drain(self) -> Dict[str, Dict[str, Any]]:
+		"""Take this process' values and start again from zero (an engine process, see Render Engine)."""
+		with self._lock:
+			values, self._values = self._values, {name: {} for name in self._meta}
+			self._dirty = False
+			return values
+
+	def merge(self, values: Dict[str, Dict[str, Any]]) -> None:
+		"""Add values drained from an engine process; its gauges are left out."""
+		with self._lock:
+			self._add(self._values, {name: series for name, series in values.items()
+				if self._meta.get(name, ('gauge',))[0] != 'gauge'})
+			self._changed()
+
+	def retire(self) -> None:
+		"""Remove this process' snapshot (at exit), so its values leave the totals of the remaining workers."""
+		self._retired = True
+		pxRemoveQuiet(os.path.join(self.metrics_dir(), f'{os.getpid()}.json'))
+
+	def collect(self) -> Dict[str, Dict[str, Any]]:
+		"""Sum of all process snapshots (this process live)."""
+		snapshots = [self.snapshot()]
+		try:
+			names = [n for n in os.listdir(self.metrics_dir()) if n.endswith('.json') and n != f'{os.getpid()}.json']
+		except OSError:
+			names = []
+		for name in names:
+			path = os.path.join(self.metrics_dir(), name)
+			try:
+				with open(path, 'rb') as f:
+					snap = json.loads(f.read().decode('utf-8'))
+			except (OSError, ValueError):
+				continue
+			if snap.get("parent") != os.getppid() or not AtkJobManager._alive(snap.get("pid", 0)):
+				# a worker that died without retire(), or one of another master
+				pxRemoveQuiet(path)
+				continue
+			snapshots.append(snap)
+		total: Dict[str, Dict[str, Any]] = {name: {} for name in self._meta}
+		for snap in snapshots:
+			self._add(total, snap["values"])
+		return total
+
+	@staticmethod
+	def _add(total: Dict[str, Dict[str, Any]], values: Dict[str, Dict[str, Any]]) -> None:
+		for name, series in values.items():
+			if name not in total:
+				continue
+			for key, value in series.items():
+				cur = total[name].get(key)
+				if isinstance(value, list):
+					total[name][key] = [a + b for a, b in zip(cur, value)] if cur else list(value)
+				else:
+					total[name][key] = (cur or 0) + value
+
+	def render(self) -> str:
+		"""Prometheus text exposition format (0.0.4) of the aggregated metrics."""
+		def fmt(labels, extra=()):
+			items = list(labels) + list(extra)
+			if not items:
+				return ''
+			return '{' + ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in items) + '}'
+
+		lines = []
+		for name, series in self.collect().items():
+			kind, help_text = self._meta[name]
+			lines.append(f'# HELP {name} {help_text}')
+			lines.append(f'# TYPE {name} {kind}')
+			for key, value in sorted(series.items()):
+				labels = json.loads(key)
+				if kind == 'histogram':
+					for bound, count in zip(ATK_METRIC_BUCKETS, value):
+						lines.append(f'{name}_bucket{fmt(labels, [("le", repr(bound))])} {count}')
+					lines.append(f'{name}_bucket{fmt(labels, [("le", "+Inf")])} {value[-1]}')
+					lines.append(f'{name}_sum{fmt(labels)} {value[-2]}')
+					lines.append(f'{name}_count{fmt(labels)} {value[-1]}')
+				else:
+					lines.append(f'{name}{fmt(labels)} {value}')
+		return '\n'.join(lines) + '\n'
+
+
+atkMetrics = AtkMetrics()
+atexit.register(atkMetrics.retire)
+atkMetrics.describe('atkpdf_requests_total', 'counter', 'HTTP requests by endpoint and status.')
+atkMetrics.describe('atkpdf_request_seconds', 'histogram', 'HTTP request latency by endpoint.')
+atkMetrics.describe('atkpdf_inflight_requests', 'gauge', 'HTTP requests currently being handled.')
+atkMetrics.describe('atkpdf_errors_total', 'counter', 'Error responses by ATKPDF error code.')
+atkMetrics.describe('atkpdf_stage_seconds', 'histogram', 'Time spent per fill stage.')
+atkMetrics.describe('atkpdf_bytes_in_total', 'counter', 'Request body bytes by endpoint.')
+atkMetrics.describe('atkpdf_bytes_out_total', 'counter', 'Response body bytes by endpoint.')
+atkMetrics.describe('atkpdf_image_fetches_total', 'counter', 'Image URL lookups by result (hit, revalidated, fetched, failed, stale).')
+atkMetrics.describe('atkpdf_image_fetch_seconds', 'histogram', 'Image download latency, cache hits excluded.')
+atkMetrics.describe('atkpdf_admission_wait_seconds', 'histogram', 'Time admitted fills waited in the admission queue (see AtkAdmission).')
+atkMetrics.describe('atkpdf_admission_rejected_total', 'counter', 'Fills rejected by admission control by reason (queue_full, timeout).')
+atkMetrics.describe('atkpdf_admission_waiting', 'gauge', 'Fills waiting for admission.')
+atkMetrics.describe('atkpdf_admission_memory_bytes', 'gauge', 'Estimated peak memory of the admitted fills.')
+
+
+# ----------------------------- Template Cache -----------------------------
+
+class AtkTemplate:
+	"""Parsed form template: PDF bytes (or a file path) ready for a cheap re-open, the widget layout per page
+	and a field index. File-backed templates keep only the layout in memory."""
+
+	def __init__(self, key: str, pdf_bytes: Optional[bytes], page_count: int, layout: list, path: Optional[str] = None,
+			xref_count: int = 0):
+		self.key = key
+		self.pdf_bytes = pdf_bytes
+		self.path = None if pdf_bytes is not None else path
+		self.page_count = page_count
+		# layout[page_num] = [{"name", "page", "xref", "type", "rect", "flags"[, "options"][, "onState"][, "ap", "font"]}, ...]
+		self.layout = layout
+		# objects below this number exist in every copy opened from the template (see AtkAppearanceCache)
+		self.xref_count = xref_count
+		self.widgets = {w["xref"]: w for widgets in layout for w in widgets}
+		# field index: name -> the same widget entries in document order
+		self.fields: Dict[str, list] = {}
+		for widgets in layout:
+			for w in widgets:
+				if w["name"]:
+					self.fields.setdefault(w["name"], []).append(w)
+		self.nbytes = len(pdf_bytes or b'') + 256 * sum(len(p) for p in layout)
+
+	def open(self):
+		"""Open a fresh, independent document from the cached bytes or file (no repair, no widget scan)."""
+		import fitz
+		if self.path:
+			return fitz.open(self.path, filetype='pdf')
+		return fitz.open(stream=self.pdf_bytes, filetype='pdf')
+
+
+class AtkTemplateCache:
+	"""In-process LRU of parsed templates keyed by the sha256 of the template bytes, bounded by bytes."""
+
+	def __init__(self, max_bytes: int):
+		self.max_bytes = max_bytes
+		self.bytes = 0
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self._items: "OrderedDict[str, AtkTemplate]" = OrderedDict()
+		self._lock = threading.Lock()
+
+	def get(self, key: str) -> Optional[AtkTemplate]:
+		with self._lock:
+			tpl = self._items.get(key)
+			if tpl is None:
+				self.misses += 1
+				return None
+			self._items.move_to_end(key)
+			self.hits += 1
+			return tpl
+
+	def put(self, tpl: AtkTemplate) -> None:
+		if tpl.nbytes > self.max_bytes:
+			return
+		with self._lock:
+			old = self._items.pop(tpl.key, None)
+			if old is not None:
+				self.bytes -= old.nbytes
+			self._items[tpl.key] = tpl
+			self.bytes += tpl.nbytes
+			while self.bytes > self.max_bytes and self._items:
+				_, evicted = self._items.popitem(last=False)
+				self.bytes -= evicted.nbytes
+				self.evictions += 1
+
+	def discard(self, key: str) -> None:
+		with self._lock:
+			old = self._items.pop(key, None)
+			if old is not None:
+				self.bytes -= old.nbytes
+
+	def stats(self) -> Dict[str, Any]:
+		with self._lock:
+			lookups = self.hits + self.misses
+			return {
+				"entries": len(self._items),
+				"bytes": self.bytes,
+				"maxBytes": self.max_bytes,
+				"hits": self.hits,
+				"misses": self.misses,
+				"evictions": self.evictions,
+				"hitRatio": round(self.hits / lookups, 4) if lookups else None,
+			}
+
+
+atkTemplateCache = AtkTemplateCache(pxEnvInt('ATKPDF_TEMPLATE_CACHE_MB', 256) * 1024 * 1024)
+
+
+def atkTemplateKey(pdf_bytes: bytes) -> str:
+	"""Content hash used as the template cache key."""
+	return hashlib.sha256(pdf_bytes).hexdigest()
+
+
+def _atkParseTemplate(key: str, pdf_bytes: Optional[bytes] = None, path: Optional[str] = None) -> AtkTemplate:
+	"""Scan the widgets of a template given as bytes or as a file; file-backed templates stay file-backed."""
+	import fitz
+	doc = fitz.open(path, filetype='pdf') if path else fitz.open(stream=pdf_bytes, filetype='pdf')
+	try:
+		# a damaged file is repaired on every open; keep the repaired version so later opens are cheap
+		if doc.is_repaired and not doc.needs_pass:
+			pdf_bytes = doc.tobytes()
+		layout = []
+		faces = {}
+		for page_num, page in enumerate(doc):
+			widgets = []
+			for w in list(page.widgets() or []):
+				entry = {
+					"name": w.field_name,
+					"page": page_num,
+					"xref": w.xref,
+					"type": w.field_type,
+					"rect": tuple(w.rect),
+					"flags": w.field_flags or 0,
+				}
+				if w.field_type in (fitz.PDF_WIDGET_TYPE_TEXT, fitz.PDF_WIDGET_TYPE_COMBOBOX, fitz.PDF_WIDGET_TYPE_LISTBOX):
+					entry["ap"] = atkAppearanceKey(doc, w.xref, w.rect)
+					entry["font"] = atkWidgetFont(doc, w, faces)
+				if w.field_type in (fitz.PDF_WIDGET_TYPE_COMBOBOX, fitz.PDF_WIDGET_TYPE_LISTBOX):
+					entry["options"] = list(w.choice_values or [])
+				elif w.field_type in (fitz.PDF_WIDGET_TYPE_CHECKBOX, fitz.PDF_WIDGET_TYPE_RADIOBUTTON):
+					try:
+						entry["onState"] = w.on_state()
+					except Exception:
+						pass
+				widgets.append(entry)
+			layout.append(widgets)
+		return AtkTemplate(key, pdf_bytes, doc.page_count, layout, path, doc.xref_length())
+	finally:
+		doc.close()
+
+
+def atkLoadTemplate(pdf_bytes, key: Optional[str] = None) -> Tuple[AtkTemplate, bool]:
+	"""Return (template, cache_hit) for the given PDF bytes, parsing and caching on a miss.
+	A spooled upload (AtkSpooledFile) is parsed from its file and not cached, since the file is temporary.
+	"""
+	spooled = isinstance(pdf_bytes, AtkSpooledFile)
+	key = key or (pdf_bytes.key if spooled else atkTemplateKey(pdf_bytes))
+	tpl = atkTemplateCache.get(key)
+	if tpl is not None:
+		return tpl, True
+	if spooled:
+		return _atkParseTemplate(key, path=pdf_bytes.path), False
+	tpl = _atkParseTemplate(key, pdf_bytes)
+	atkTemplateCache.put(tpl)
+	return tpl, False
+
+
+# ----------------------------- Field Index -----------------------------
+# GET/POST /api/fields describe the fields of a template. The description only depends on the template bytes,
+# so it is keyed by their sha256 and served with that key as ETag (If-None-Match answers 304 before any work
+# beyond, for a template_id, a stat of the registry file).
+# Registered templates keep it next to the PDF (<template_id>.fields.json) and are answered without opening
+# the PDF; uploads go through the template cache. Bump ATK_FIELD_INDEX_VERSION when the entries change shape.
+
+ATK_FIELD_INDEX_VERSION = 2
+ATK_FIELD_FLAGS = {"readonly": 1, "required": 2, "noExport": 4}
+
+
+def atkFieldIndex(template: AtkTemplate) -> Dict[str, Any]:
+	"""Fields of a template, unique by name in document order, with every widget's page and rect."""
+	fields = []
+	for name, locs in template.fields.items():
+		w = locs[0]
+		flags = int(w.get("flags") or 0)
+		entry = {
+			"name": name,
+			"type": int(w["type"]) if isinstance(w["type"], int) else None,
+			"page": w["page"],
+			"rect": [round(v, 2) for v in w["rect"]],
+			"flags": flags,
+			**{flag: bool(flags & bit) for flag, bit in ATK_FIELD_FLAGS.items()},
+		}
+		if "options" in w:
+			entry["options"] = w["options"]
+		on_states = [l["onState"] for l in locs if l.get("onState")]
+		if on_states:
+			entry["onStates"] = list(dict.fromkeys(on_states))
+		if len(locs) > 1:
+			entry["widgets"] = [{"page": l["page"], "rect": [round(v, 2) for v in l["rect"]]} for l in locs]
+		fields.append(entry)
+	return {"template": template.key, "version": ATK_FIELD_INDEX_VERSION, "pages": template.page_count, "fields": fields}
+
+
+def atkFieldIndexEtag(key: str) -> str:
+	return f"{key}.v{ATK_FIELD_INDEX_VERSION}"
+
+
+# ----------------------------- Template Registry -----------------------------
+# Registered templates live on local disk as <template_id>.pdf + <template_id>.json, where the id is the
+# sha256 of the uploaded bytes (the template cache key). Fills referencing a template_id stat the registry file,
+# so a DELETE handled by another worker is seen, and only parse it when the template is not already in the
+# in-process cache; cached registered templates are file-backed, so they cost the widget index rather than the
+# PDF size in memory.
+
+def atkTemplateDir() -> str:
+	return os.environ.get('ATKPDF_TEMPLATE_DIR') or os.path.join(os.getcwd(), 'templates')
+
+
+def _atkTemplatePaths(template_id: str) -> Optional[Tuple[str, str]]:
+	tid = str(template_id or '').strip().lower()
+	if len(tid) != 64 or any(c not in '0123456789abcdef' for c in tid):
+		return None
+	base = os.path.join(atkTemplateDir(), tid)
+	return base + '.pdf', base + '.json'
+
+
+def _atkFieldIndexPath(template_id: str) -> Optional[str]:
+	paths = _atkTemplatePaths(template_id)
+	return paths[0][:-4] + '.fields.json' if paths else None
+
+
+def _atkWriteAtomic(path: str, data) -> None:
+	tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+	if isinstance(data, AtkSpooledFile):
+		import shutil
+		shutil.copyfile(data.path, tmp)
+	else:
+		with open(tmp, 'wb') as f:
+			f.write(data)
+	os.replace(tmp, path)
+
+
+def atkRegisterTemplate(pdf_bytes, name: Optional[str] = None) -> Dict[str, Any]:
+	"""Store a template (bytes or AtkSpooledFile) on disk (idempotent per content) and return its metadata."""
+	if not pdf_bytes:
+		return {"report": "error", "message": "PDF 'pdf' or 'file' key required.", "code": "ATKPDF-01"}
+	if not pxHasModule('fitz'):
+		return {"report": "error", "message": "PyMuPDF (fitz) is required. Please install it.", "code": "ATKPDF-02"}
+	try:
+		template, _ = atkLoadTemplate(pdf_bytes)
+	except Exception as e:
+		return {"report": "error", "message": f"PDF processing failed: {e}", "code": "ATKPDF-04"}
+	pdf_path, meta_path = _atkTemplatePaths(template.key)
+	meta = {
+		"template_id": template.key,
+		"name": name or 'template.pdf',
+		"bytes": len(pdf_bytes),
+		"pages": template.page_count,
+		"fields": len({w["name"] for page in template.layout for w in page if w["name"]}),
+		"created": int(time.time()),
+	}
+	try:
+		os.makedirs(atkTemplateDir(), exist_ok=True)
+		if not os.path.exists(pdf_path):
+			_atkWriteAtomic(pdf_path, pdf_bytes)
+		_atkWriteAtomic(_atkFieldIndexPath(template.key), json.dumps(atkFieldIndex(template)).encode('utf-8'))
+		_atkWriteAtomic(meta_path, json.dumps(meta).encode('utf-8'))
+	except Exception as e:
+		return {"report": "error", "message": f"Failed to save file: {e}", "code": "ATKPDF-06"}
+	return {"report": "success", "message": "Template registered", **meta}
+
+
+def atkGetTemplateMeta(template_id: str) -> Optional[Dict[str, Any]]:
+	paths = _atkTemplatePaths(template_id)
+	if not paths or not os.path.exists(paths[0]):
+		return None
+	try:
+		with open(paths[1], 'r', encoding='utf-8') as f:
+			return json.load(f)
+	except Exception:
+		return {"template_id": str(template_id).lower(), "bytes": os.path.getsize(paths[0])}
+
+
+def atkListTemplates() -> list:
+	try:
+		names = sorted(os.listdir(atkTemplateDir()))
+	except FileNotFoundError:
+		return []
+	result = []
+	for fn in names:
+		if fn.endswith('.pdf'):
+			meta = atkGetTemplateMeta(fn[:-4])
+			if meta:
+				result.append(meta)
+	return result
+
+
+def atkDeleteTemplate(template_id: str) -> bool:
+	paths = _atkTemplatePaths(template_id)
+	if not paths or not os.path.exists(paths[0]):
+		return False
+	for p in paths + (_atkFieldIndexPath(template_id),):
+		try:
+			os.remove(p)
+		except FileNotFoundError:
+			pass
+	atkTemplateCache.discard(str(template_id).lower())
+	return True
+
+
+def atkLoadRegisteredTemplate(template_id: str) -> Optional[Tuple[AtkTemplate, bool]]:
+	"""Resolve a registered template: the registry file is checked first, since another worker may have deleted
+	it, then the cache; the file is only parsed on a miss. None if the id is unknown."""
+	paths = _atkTemplatePaths(template_id)
+	if not paths:
+		return None
+	key = str(template_id).strip().lower()
+	if not os.path.exists(paths[0]):
+		atkTemplateCache.discard(key)
+		return None
+	tpl = atkTemplateCache.get(key)
+	if tpl is not None:
+		return tpl, True
+	tpl = _atkParseTemplate(key, path=paths[0])
+	atkTemplateCache.put(tpl)
+	return tpl, False
+
+
+def atkRegisteredFieldIndex(template_id: str) -> Optional[Dict[str, Any]]:
+	"""Field index of a registered template from its stored index; templates registered before the index
+	existed (or with an older version) are parsed once and their index written. None if the id is unknown."""
+	path = _atkFieldIndexPath(template_id)
+	if not path or not os.path.exists(path[:-len('.fields.json')] + '.pdf'):
+		return None
+	try:
+		with open(path, 'r', encoding='utf-8') as f:
+			index = json.load(f)
+		if index.get("version") == ATK_FIELD_INDEX_VERSION:
+			return index
+	except (OSError, ValueError):
+		pass
+	loaded = atkLoadRegisteredTemplate(template_id)
+	if loaded is None:
+		return None
+	index = atkFieldIndex(loaded[0])
+	try:
+		_atkWriteAtomic(path, json.dumps(index).encode('utf-8'))
+	except OSError:
+		pass
+	return index
+
+
+# ----------------------------- Image Cache -----------------------------
+# Logos and signatures are referenced by URL on almost every request. Downloaded images are kept in a
+# process-wide LRU keyed by the normalized URL (ATKPDF_IMAGE_CACHE_MB, default 64; 0 disables), with an
+# optional disk tier shared by all workers (ATKPDF_IMAGE_CACHE_DIR, bounded by ATKPDF_IMAGE_CACHE_DISK_MB).
+# Entries are fresh for their Cache-Control max-age or ATKPDF_IMAGE_CACHE_TTL seconds (default 300);
+# stale entries are revalidated with If-None-Match / If-Modified-Since. If revalidation fails (network error or
+# a 5xx answer) the stale body is served; 4xx answers and rejected bodies drop the image as before.
+
+def pxNormalizeUrl(src: str) -> str:
+	"""Normalize an image URL: bare www.* becomes https://, scheme/host are lowercased, fragment dropped."""
+	from urllib.parse import urlsplit, urlunsplit
+	url = src.strip()
+	if url.startswith('www.'):
+		url = 'https://' + url
+	try:
+		parts = urlsplit(url)
+		return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path or '/', parts.query, ''))
+	except Exception:
+		return url
+
+
+class AtkImageCache:
+	"""LRU of downloaded image bodies with validators, bounded by bytes, plus an optional disk tier."""
+
+	def __init__(self, max_bytes: int, ttl: int, disk_dir: Optional[str] = None, disk_max_bytes: int = 0):
+		self.max_bytes = max_bytes
+		self.ttl = ttl
+		self.disk_dir = disk_dir
+		self.disk_max_bytes = disk_max_bytes
+		self.bytes = 0
+		self.hits = 0
+		self.misses = 0
+		self.disk_hits = 0
+		self.revalidated = 0
+		self.refreshed = 0
+		self.stale_served = 0
+		self.evictions = 0
+		self._items: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+		self._lock = threading.Lock()
+		self._inflight: Dict[str, list] = {}  # url -> [lock, holders and waiters]
+		self._disk_checked = 0.0
+
+	def _disk_paths(self, url: str) -> Tuple[str, str]:
+		base = os.path.join(self.disk_dir, hashlib.sha256(url.encode('utf-8')).hexdigest())
+		return base + '.bin', base + '.json'
+
+	def url_lock(self, url: str):
+		"""Context manager holding a per-URL lock so concurrent misses for the same image download it once.
+		The lock is dropped when its last user leaves, so distinct URLs do not accumulate."""
+		cache = self
+
+		class _UrlLock:
+			def __enter__(self):
+				with cache._lock:
+					self.slot = cache._inflight.setdefault(url, [threading.Lock(), 0])
+					self.slot[1] += 1
+				self.slot[0].acquire()
+				return self
+
+			def __exit__(self, *exc):
+				self.slot[0].release()
+				with cache._lock:
+					self.slot[1] -= 1
+					if not self.slot[1]:
+						cache._inflight.pop(url, None)
+
+		return _UrlLock()
+
+	def get(self, url: str) -> Optional[Dict[str, Any]]:
+		with self._lock:
+			entry = self._items.get(url)
+			if entry is not None:
+				self._items.move_to_end(url)
+				return entry
+		if not self.disk_dir:
+			return None
+		bin_path, meta_path = self._disk_paths(url)
+		try:
+			with open(meta_path, 'r', encoding='utf-8') as f:
+				entry = json.load(f)
+			with open(bin_path, 'rb') as f:
+				entry['body'] = f.read()
+		except Exception:
+			return None
+		with self._lock:
+			self.disk_hits += 1
+		self._put_memory(url, entry)
+		return entry
+
+	def is_fresh(self, entry: Dict[str, Any]) -> bool:
+		return time.time() - entry.get('fetched', 0) < entry.get('ttl', self.ttl)
+
+	def put(self, url: str, body: bytes, etag: Optional[str], last_modified: Optional[str], ttl: Optional[int]) -> None:
+		entry = {
+			"url": url,
+			"body": body,
+			"etag": etag,
+			"lastModified": last_modified,
+			"fetched": time.time(),
+			"ttl": self.ttl if ttl is None else ttl,
+		}
+		self._put_memory(url, entry)
+		if self.disk_dir:
+			self._put_disk(url, entry)
+
+	def touch(self, url: str, entry: Dict[str, Any], ttl: Optional[int]) -> None:
+		"""Record a successful revalidation (304): the cached body is fresh again."""
+		entry['fetched'] = time.time()
+		if ttl is not None:
+			entry['ttl'] = ttl
+		if self.disk_dir:
+			self._put_disk(url, entry, meta_only=True)
+
+	def _put_memory(self, url: str, entry: Dict[str, Any]) -> None:
+		size = len(entry['body'])
+		if size > self.max_bytes:
+			return
+		with self._lock:
+			old = self._items.pop(url, None)
+			if old is not None:
+				self.bytes -= len(old['body'])
+			self._items[url] = entry
+			self.bytes += size
+			while self.bytes > self.max_bytes and self._items:
+				_, evicted = self._items.popitem(last=False)
+				self.bytes -= len(evicted['body'])
+				self.evictions += 1
+
+	def _put_disk(self, url: str, entry: Dict[str, Any], meta_only: bool = False) -> None:
+		try:
+			os.makedirs(self.disk_dir, exist_ok=True)
+			bin_path, meta_path = self._disk_paths(url)
+			if not meta_only:
+				_atkWriteAtomic(bin_path, entry['body'])
+			meta = {k: v for k, v in entry.items() if k != 'body'}
+			_atkWriteAtomic(meta_path, json.dumps(meta).encode('utf-8'))
+			self._trim_disk()
+		except Exception:
+			pass
+
+	def _trim_disk(self) -> None:
+		# directory scans are throttled; the budget is a soft limit
+		now = time.time()
+		if not self.disk_max_bytes or now - self._disk_checked < 30:
+			return
+		self._disk_checked = now
+		files = []
+		for fn in os.listdir(self.disk_dir):
+			if fn.endswith('.bin'):
+				path = os.path.join(self.disk_dir, fn)
 				try:
-					fields = json.loads(fields_raw)
+					st = os.stat(path)
+				except FileNotFoundError:
+					continue
+				files.append((st.st_mtime, st.st_size, path))
+		total = sum(f[1] for f in files)
+		for _, size, path in sorted(files):
+			if total <= self.disk_max_bytes:
+				break
+			for p in (path, path[:-4] + '.json'):
+				try:
+					os.remove(p)
+				except FileNotFoundError:
+					pass
+			total -= size
+
+	def stats(self) -> Dict[str, Any]:
+		with self._lock:
+			lookups = self.hits + self.misses
+			return {
+				"entries": len(self._items),
+				"bytes": self.bytes,
+				"maxBytes": self.max_bytes,
+				"hits": self.hits,
+				"misses": self.misses,
+				"diskHits": self.disk_hits,
+				"revalidated": self.revalidated,
+				"refreshed": self.refreshed,
+				"staleServed": self.stale_served,
+				"evictions": self.evictions,
+				"hitRatio": round(self.hits / lookups, 4) if lookups else None,
+				"disk": self.disk_dir,
+			}
+
+
+atkImageCache = AtkImageCache(
+	pxEnvInt('ATKPDF_IMAGE_CACHE_MB', 64) * 1024 * 1024,
+	pxEnvInt('ATKPDF_IMAGE_CACHE_TTL', 300),
+	os.environ.get('ATKPDF_IMAGE_CACHE_DIR') or None,
+	pxEnvInt('ATKPDF_IMAGE_CACHE_DISK_MB', 512) * 1024 * 1024,
+)
+
+
+def _atkCacheTtl(headers) -> Tuple[bool, Optional[int]]:
+	"""(storable, ttl) from Cache-Control: no-store is not cached, max-age overrides the default TTL."""
+	cc = (headers.get('Cache-Control') or '').lower()
+	if 'no-store' in cc:
+		return False, None
+	for part in cc.split(','):
+		part = part.strip()
+		if part.startswith('max-age='):
+			try:
+				return True, max(0, int(part[8:]))
+			except ValueError:
+				pass
+	return True, None
+
+
+# ----------------------------- Image Downloader -----------------------------
+
+_ATK_IMAGE_MAGIC = (
+	b'\x89PNG\r\n\x1a\n',  # PNG
+	b'\xff\xd8\xff',  # JPEG
+	b'GIF87a', b'GIF89a',
+	b'BM',  # BMP
+	b'II*\x00', b'MM\x00*',  # TIFF
+	b'\x00\x00\x00\x0cjP  ', b'\xff\x4f\xff\x51',  # JPEG 2000
+)
+
+
+def pxSniffImage(head: bytes) -> bool:
+	"""True if the first bytes look like an image format fitz can insert."""
+	if head.startswith(_ATK_IMAGE_MAGIC):
+		return True
+	if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+		return True
+	text = head[:256].lstrip().lower()
+	return text.startswith(b'<svg') or (text.startswith(b'<?xml') and b'<svg' in head[:1024].lower())
+
+
+class AtkImageDownloader:
+	"""Pooled, streaming image downloader.
+
+	One requests.Session keeps keep-alive connections per host (ATKPDF_HTTP_POOL_SIZE per host). Bodies are
+	streamed and abandoned as soon as Content-Length or the running byte count exceeds max_bytes, the whole
+	read exceeds the deadline (ATKPDF_IMAGE_DEADLINE seconds, default 10, however slowly the body trickles in)
+	or the content is not an image.
+	"""
+
+	def __init__(self, pool_size: int, deadline: float, chunk_size: int = 65536):
+		self.pool_size = pool_size
+		self.deadline = deadline
+		self.chunk_size = chunk_size
+		self.requests = 0
+		self.bytes = 0
+		self.too_large = 0
+		self.timeouts = 0
+		self.rejected = 0
+		self.errors = 0
+		self._session = None
+		self._lock = threading.Lock()
+
+	def session(self):
+		with self._lock:
+			if self._session is None:
+				import requests
+				from requests.adapters import HTTPAdapter
+				sess = requests.Session()
+				adapter = HTTPAdapter(pool_connections=32, pool_maxsize=self.pool_size)
+				sess.mount('http://', adapter)
+				sess.mount('https://', adapter)
+				self._session = sess
+			return self._session
+
+	def fetch(self, url: str, max_bytes: int, headers: Optional[Dict[str, str]] = None):
+		"""Return (status, body, response headers); body is None for 304 and for rejected downloads."""
+		self.requests += 1
+		start = time.monotonic()
+		try:
+			resp = self.session().get(url, headers=headers or {}, stream=True, timeout=(5, self.deadline))
+		except Exception:
+			self.errors += 1
+			return None, None, {}
+		with resp:
+			if resp.status_code == 304 or not resp.ok:
+				return resp.status_code, None, resp.headers
+			ctype = (resp.headers.get('Content-Type') or '').lower()
+			if ctype.startswith('text/html') or ctype.startswith('application/json'):
+				self.rejected += 1
+				return resp.status_code, None, resp.headers
+			try:
+				if int(resp.headers.get('Content-Length') or 0) > max_bytes:
+					self.too_large += 1
+					return resp.status_code, None, resp.headers
+			except ValueError:
+				pass
+			from urllib3.exceptions import ReadTimeoutError
+			buf = bytearray()
+			# read1 returns whatever has arrived, and each socket read may only wait for the rest of the
+			# deadline, so a body trickling in below the chunk size cannot outlast it
+			sock = getattr(resp.raw.connection, 'sock', None)
+			try:
+				while True:
+					remaining = self.deadline - (time.monotonic() - start)
+					if remaining <= 0:
+						self.timeouts += 1
+						return resp.status_code, None, resp.headers
+					if sock is not None:
+						sock.settimeout(remaining)
+					block = resp.raw.read1(self.chunk_size, decode_content=True)
+					if not block:
+						break
+					buf += block
+					if len(buf) > max_bytes:
+						self.too_large += 1
+						return resp.status_code, None, resp.headers
+			except ReadTimeoutError:
+				self.timeouts += 1
+				return resp.status_code, None, resp.headers
+			except Exception:
+				self.errors += 1
+				return resp.status_code, None, resp.headers
+			if not pxSniffImage(bytes(buf[:1024])):
+				self.rejected += 1
+				return resp.status_code, None, resp.headers
+			self.bytes += len(buf)
+			return resp.status_code, bytes(buf), resp.headers
+
+	def stats(self) -> Dict[str, Any]:
+		return {
+			"requests": self.requests,
+			"bytes": self.bytes,
+			"tooLarge": self.too_large,
+			"timeouts": self.timeouts,
+			"rejected": self.rejected,
+			"errors": self.errors,
+		}
+
+
+atkDownloader = AtkImageDownloader(pxEnvInt('ATKPDF_HTTP_POOL_SIZE', 8), float(pxEnvInt('ATKPDF_IMAGE_DEADLINE', 10)))
+
+
+def _atkDownload(url: str, max_bytes: int, headers: Optional[Dict[str, str]] = None):
+	"""atkDownloader.fetch with fetch metrics."""
+	start = time.perf_counter()
+	status, body, resp_headers = atkDownloader.fetch(url, max_bytes, headers)
+	atkMetrics.observe('atkpdf_image_fetch_seconds', time.perf_counter() - start)
+	result = 'revalidated' if status == 304 and headers else 'fetched' if body is not None else 'failed'
+	atkMetrics.inc('atkpdf_image_fetches_total', result=result)
+	return status, body, resp_headers
+
+
+def atkFetchImage(url: str, max_bytes: int) -> Optional[bytes]:
+	"""Download an image through the shared cache; None if it cannot be fetched, is not an image or exceeds max_bytes."""
+	url = pxNormalizeUrl(url)
+	cache = atkImageCache
+	if not cache.max_bytes and not cache.disk_dir:
+		return _atkDownload(url, max_bytes)[1]
+	with cache.url_lock(url):
+		entry = cache.get(url)
+		if entry is not None and cache.is_fresh(entry):
+			with cache._lock:
+				cache.hits += 1
+			atkMetrics.inc('atkpdf_image_fetches_total', result='hit')
+			return entry['body'] if len(entry['body']) <= max_bytes else None
+		with cache._lock:
+			cache.misses += 1
+		headers = {}
+		if entry is not None:
+			if entry.get('etag'):
+				headers['If-None-Match'] = entry['etag']
+			if entry.get('lastModified'):
+				headers['If-Modified-Since'] = entry['lastModified']
+		status, body, resp_headers = _atkDownload(url, max_bytes, headers)
+		storable, ttl = _atkCacheTtl(resp_headers)
+		if entry is not None and status == 304:
+			cache.revalidated += 1
+			cache.touch(url, entry, ttl)
+			return entry['body'] if len(entry['body']) <= max_bytes else None
+		if body is None:
+			if entry is not None and (status is None or status >= 500):
+				# the origin is unreachable or failing: keep serving what we have rather than drop the image
+				with cache._lock:
+					cache.stale_served += 1
+				atkMetrics.inc('atkpdf_image_fetches_total', result='stale')
+				return entry['body'] if len(entry['body']) <= max_bytes else None
+			return None
+		if entry is not None:
+			cache.refreshed += 1
+		if storable:
+			cache.put(url, body, resp_headers.get('ETag'), resp_headers.get('Last-Modified'), ttl)
+		return body
+
+
+# ----------------------------- Image Resampling -----------------------------
+# Phone photos are often placed into boxes a few centimetres wide. Before insertion an image is scaled down
+# so its effective resolution in the target rect is at most ATKPDF_IMAGE_MAX_DPI (default 150; 0 disables),
+# then re-encoded: JPEG (ATKPDF_IMAGE_JPEG_QUALITY, default 85) for opaque photographic images, PNG for
+# line art and images with transparency. Results are cached per (source hash, target box) in a process-wide
+# LRU bounded by ATKPDF_IMAGE_RESAMPLE_CACHE_MB (default 32). Images already within the limit, and results
+# that would not be smaller than the source, are inserted unchanged.
+
+class AtkImageResampler:
+	"""Downsamples image bytes to a maximum DPI for a target rect, with an LRU of processed results."""
+
+	def __init__(self, max_dpi: int, jpeg_quality: int, max_bytes: int):
+		self.max_dpi = max_dpi
+		self.jpeg_quality = max(1, min(100, jpeg_quality))
+		self.max_bytes = max_bytes
+		self.bytes = 0
+		self.hits = 0
+		self.misses = 0
+		self.resampled = 0
+		self.unchanged = 0
+		self.failed = 0
+		self.bytes_in = 0
+		self.bytes_out = 0
+		self.seconds = 0.0
+		# (source sha256, box) -> processed bytes, or None when the source is used unchanged
+		self._items: "OrderedDict[Tuple, Optional[bytes]]" = OrderedDict()
+		self._lock = threading.Lock()
+
+	@staticmethod
+	def target_box(rect, max_dpi: int, keep_proportion: bool) -> Tuple[int, int, bool]:
+		"""Pixel box that holds the rect at max_dpi."""
+		scale = max_dpi / 72.0
+		return max(1, int(abs(rect.width) * scale + 0.5)), max(1, int(abs(rect.height) * scale + 0.5)), keep_proportion
+
+	def _get(self, key):
+		with self._lock:
+			if key not in self._items:
+				self.misses += 1
+				return False, None
+			self._items.move_to_end(key)
+			self.hits += 1
+			return True, self._items[key]
+
+	@staticmethod
+	def _size(key, data: Optional[bytes]) -> int:
+		# entries are charged for their key too, so "unchanged" entries (None) count towards max_bytes
+		return len(key[0]) + 64 + (len(data) if data else 0)
+
+	def _put(self, key, data: Optional[bytes]) -> None:
+		size = self._size(key, data)
+		if size > self.max_bytes:
+			return
+		with self._lock:
+			if key in self._items:
+				self.bytes -= self._size(key, self._items.pop(key))
+			self._items[key] = data
+			self.bytes += size
+			while self.bytes > self.max_bytes and self._items:
+				evicted_key, evicted = self._items.popitem(last=False)
+				self.bytes -= self._size(evicted_key, evicted)
+
+	def _resample(self, img_bytes: bytes, box: Tuple[int, int, bool]) -> Optional[bytes]:
+		import fitz
+		pix = fitz.Pixmap(img_bytes)
+		width, height = pix.width, pix.height
+		box_w, box_h, keep_proportion = box
+		if keep_proportion:
+			factor = min(box_w / width, box_h / height)
+			new_w, new_h = width * factor, height * factor
+		else:
+			new_w, new_h = min(width, box_w), min(height, box_h)
+		if new_w >= width and new_h >= height:
+			return None
+		if pix.colorspace is None:
+			return None
+		if pix.colorspace.n not in (1, 3):
+			pix = fitz.Pixmap(fitz.csRGB, pix)
+		pix = fitz.Pixmap(pix, max(1.0, new_w), max(1.0, new_h), None)
+		if not pix.alpha and (img_bytes.startswith(b'\xff\xd8\xff') or pix.color_count() > 256):
+			out = pix.tobytes('jpeg', jpg_quality=self.jpeg_quality)
+		else:
+			out = pix.tobytes('png')
+		return out if len(out) < len(img_bytes) else None
+
+	def prepare(self, img_bytes: bytes, rect, keep_proportion: bool = True, max_dpi: Optional[int] = None) -> Tuple[str, bytes, bool]:
+		"""(key, bytes, resampled) for inserting img_bytes into rect; key identifies the bytes for xref reuse."""
+		digest = hashlib.sha256(img_bytes).hexdigest()
+		max_dpi = self.max_dpi if max_dpi is None else max_dpi
+		if max_dpi <= 0:
+			return digest, img_bytes, False
+		box = self.target_box(rect, max_dpi, keep_proportion)
+		key = (digest, box)
+		found, data = self._get(key)
+		if not found:
+			start = time.perf_counter()
+			try:
+				data = self._resample(img_bytes, box)
+				if data is None:
+					self.unchanged += 1
+			except Exception:  # fitz cannot decode it: insert the source as is
+				self.failed += 1
+				data = None
+			self.seconds += time.perf_counter() - start
+			if data is not None:
+				self.resampled += 1
+				self.bytes_in += len(img_bytes)
+				self.bytes_out += len(data)
+			self._put(key, data)
+		if data is None:
+			return digest, img_bytes, False
+		return '%s:%dx%d:%d' % (digest, box[0], box[1], box[2]), data, True
+
+	def stats(self) -> Dict[str, Any]:
+		with self._lock:
+			return {
+				"maxDpi": self.max_dpi,
+				"jpegQuality": self.jpeg_quality,
+				"entries": len(self._items),
+				"bytes": self.bytes,
+				"maxBytes": self.max_bytes,
+				"hits": self.hits,
+				"misses": self.misses,
+				"resampled": self.resampled,
+				"unchanged": self.unchanged,
+				"failed": self.failed,
+				"bytesIn": self.bytes_in,
+				"bytesOut": self.bytes_out,
+				"ms": round(self.seconds * 1000, 3),
+			}
+
+
+atkResampler = AtkImageResampler(
+	pxEnvInt('ATKPDF_IMAGE_MAX_DPI', 150),
+	pxEnvInt('ATKPDF_IMAGE_JPEG_QUALITY', 85),
+	pxEnvInt('ATKPDF_IMAGE_RESAMPLE_CACHE_MB', 32) * 1024 * 1024,
+)
+
+
+# ----------------------------- Fonts -----------------------------
+# mupdf writes text widget appearances with a base-14 font only, whatever /DA names, so a value outside WinAnsi
+# (Turkish ğ ş İ, Arabic, Cyrillic, ...) comes out as '·'. AtkWidgetFiller writes those values itself: glyphs come
+# from the /DA font (its embedded /DR font file, otherwise its base-14 face) and, for characters it lacks, from
+# the fonts mupdf falls back to per script (Noto, Droid Sans Fallback). Arabic is shaped to its presentation forms
+# and right-to-left runs are put in visual order (a reduced bidi algorithm; no ligatures beyond lam-alef). Each glyph
+# maps back to its source characters in /ToUnicode, so text extraction gives the value in logical order.
+#
+# /DA is resolved once per template (layout entry "font"). Parsed fonts and their glyph lookups live in a
+# process-wide LRU (ATKPDF_FONT_CACHE_MB, default 32; mupdf's fallback fonts are held by mupdf itself). Each output
+# embeds every font it wrote with once, as a Type0 font subset to exactly the glyphs of that document, made when the
+# document is finished, its /W and /ToUnicode limited to those glyphs. Subsets are cached in the same LRU per (font,
+# glyph set), so fills writing the same characters copy a ready one and no output carries another fill's glyphs.
+
+ATK_BASE14 = {
+	'Helv': 'Helvetica', 'HeBo': 'Helvetica-Bold', 'HeOb': 'Helvetica-Oblique', 'HeBO': 'Helvetica-BoldOblique',
+	'Cour': 'Courier', 'CoBo': 'Courier-Bold', 'CoOb': 'Courier-Oblique', 'CoBO': 'Courier-BoldOblique',
+	'TiRo': 'Times-Roman', 'TiBo': 'Times-Bold', 'TiIt': 'Times-Italic', 'TiBI': 'Times-BoldItalic',
+	'Symb': 'Symbol', 'ZaDb': 'ZapfDingbats',
+}
+ATK_MIRRORED = dict(zip('()[]{}<>«»', ')(][}{><»«'))
+ATK_LINE_HEIGHT = 1.116  # mupdf's line spacing for text widgets, in font sizes
+
+
+def atkBase14(name: str) -> str:
+	"""Base-14 face for a /DA resource name or a non-embedded /BaseFont (Helvetica unless it says otherwise)."""
+	if name in ATK_BASE14:
+		return ATK_BASE14[name]
+	lower = name.lower()
+	family = 'Courier' if 'cour' in lower else 'Times' if 'times' in lower else 'Helvetica'
+	if 'symbol' in lower:
+		return 'Symbol'
+	if 'dingbat' in lower or 'zapf' in lower:
+		return 'ZapfDingbats'
+	bold, italic = 'bold' in lower, 'italic' in lower or 'oblique' in lower
+	if family == 'Times':
+		return {(False, False): 'Times-Roman', (True, False): 'Times-Bold', (False, True): 'Times-Italic'}.get((bold, italic), 'Times-BoldItalic')
+	slant = 'Oblique'
+	return family + ('-Bold' + slant if bold and italic else '-Bold' if bold else '-' + slant if italic else '')
+
+
+def atkWidgetFont(doc, widget, faces: Dict[str, Tuple]) -> Tuple:
+	"""Layout entry "font" of a text or choice widget: (resource name, size, colour operators, face).
+	face is ('embedded', font file xref, base-14 stand-in) when /DR embeds the /DA font, else ('base14', name);
+	faces memoizes per resource name for one template."""
+	name = widget.text_font or 'Helv'
+	color = [round(float(c), 4) for c in (widget.text_color or [])]
+	ops = {1: 'g', 3: 'rg', 4: 'k'}.get(len(color))
+	color_ops = ' '.join('%g' % c for c in color) + ' ' + ops if ops else '0 g'
+	face = faces.get(name)
+	if face is None:
+		face = faces[name] = _atkResolveFace(doc, name)
+	return (name, float(widget.text_fontsize or 0), color_ops, face)
+
+
+def _atkResolveFace(doc, name: str) -> Tuple:
+	def ref(value: str) -> int:
+		parts = value.strip('[] ').split()
+		return int(parts[0]) if len(parts) >= 3 and parts[2] == 'R' else 0
+
+	try:
+		kind, value = doc.xref_get_key(doc.pdf_catalog(), "AcroForm/DR/Font/" + name)
+		font = ref(value) if kind == 'xref' else 0
+		if font:
+			descriptor = font
+			if doc.xref_get_key(font, "Subtype")[1] == '/Type0':
+				descriptor = ref(doc.xref_get_key(font, "DescendantFonts")[1])
+			base = atkBase14(doc.xref_get_key(font, "BaseFont")[1].lstrip('/') or name)
+			for key in ("FontFile2", "FontFile3", "FontFile"):
+				kind, value = doc.xref_get_key(descriptor, "FontDescriptor/" + key) if descriptor else ('null', '')
+				if kind == 'xref':
+					return ('embedded', ref(value), base)
+			return ('base14', base)
+	except Exception:
+		pass
+	return ('base14', atkBase14(name))
+
+
+class AtkFont:
+	"""A parsed font with memoized glyph lookups. glyph(cp) -> (font, gid, advance in em), where font is this font
+	or, for a character it lacks, `fallback` (the base-14 stand-in of an embedded font) or mupdf's fallback."""
+
+	def __init__(self, key: str, font, nbytes: int = 0, fallback: Optional['AtkFont'] = None):
+		import fitz
+		self.mu = fitz.mupdf
+		self.key = key
+		self.font = font
+		self.nbytes = nbytes
+		self.fallback = fallback
+		self._glyphs: Dict[int, Tuple['AtkFont', int, float]] = {}
+
+	def glyph(self, cp: int) -> Tuple['AtkFont', int, float]:
+		hit = self._glyphs.get(cp)
+		if hit is None:
+			mu = self.mu
+			if self.fallback is not None and not mu.fz_encode_character(self.font, cp):
+				hit = self.fallback.glyph(cp)
+			else:
+				gid, font = mu.fz_encode_character_with_fallback(self.font, cp, 0, 0)
+				owner = self
+				if font.m_internal_value() != self.font.m_internal_value():
+					owner = atkFonts.get('fallback:' + mu.fz_font_name(font), lambda: AtkFont('', font))
+				hit = (owner, gid, mu.fz_advance_glyph(font, gid, 0))
+			self._glyphs[cp] = hit
+		return hit
+
+	def advance(self, gid: int) -> float:
+		return self.mu.fz_advance_glyph(self.font, gid, 0)
+
+
+class AtkFontCache:
+	"""Process-wide LRU of AtkFont by key: 'base14:<name>', '<template key>:<font file xref>' or 'fallback:<name>',
+	and of the embeddable subsets made from them, by (font key, glyph set). Bounded by the bytes of font files copied
+	out of templates plus the saved subsets; subsets are evicted first."""
+
+	def __init__(self, max_bytes: int):
+		self.max_bytes = max_bytes
+		self.bytes = 0
+		self.hits = 0
+		self.misses = 0
+		self.subset_hits = 0
+		self.subset_misses = 0
+		self._items: "OrderedDict[str, AtkFont]" = OrderedDict()
+		self._subsets: "OrderedDict[Tuple, Tuple[Dict[int, Tuple], int]]" = OrderedDict()
+		self._lock = threading.Lock()
+
+	def _evict(self) -> None:
+		while self.bytes > self.max_bytes and self._subsets:
+			_, (_objects, nbytes) = self._subsets.popitem(last=False)
+			self.bytes -= nbytes
+		while self.bytes > self.max_bytes and len(self._items) > 1:
+			_, evicted = self._items.popitem(last=False)
+			self.bytes -= evicted.nbytes
+
+	def get(self, key: str, loader) -> AtkFont:
+		with self._lock:
+			font = self._items.get(key)
+			if font is not None:
+				self._items.move_to_end(key)
+				self.hits += 1
+				return font
+			self.misses += 1
+		font = loader()
+		font.key = font.key or key
+		with self._lock:
+			if key in self._items:
+				return self._items[key]
+			self._items[key] = font
+			self.bytes += font.nbytes
+			self._evict()
+		return font
+
+	def subset(self, font: AtkFont, glyphs: Dict[int, str]) -> Dict[int, Tuple[str, Optional[bytes]]]:
+		"""The objects of font subset to glyphs (gid -> source text), from _atkFontSubset."""
+		key = (font.key, frozenset(glyphs.items()))
+		with self._lock:
+			entry = self._subsets.get(key)
+			if entry is not None:
+				self._subsets.move_to_end(key)
+				self.subset_hits += 1
+				return entry[0]
+			self.subset_misses += 1
+		objects = _atkFontSubset(font, glyphs)
+		nbytes = sum(len(text) + len(stream or b'') for text, stream in objects.values())
+		with self._lock:
+			if key not in self._subsets and nbytes <= self.max_bytes:
+				self._subsets[key] = (objects, nbytes)
+				self.bytes += nbytes
+				self._evict()
+		return objects
+
+	def face(self, doc, template_key: str, face: Tuple) -> AtkFont:
+		"""The AtkFont for a layout face; an embedded one is read from doc (an open copy of its template)."""
+		import fitz
+		mu = fitz.mupdf
+		if face[0] == 'embedded':
+			base = self.face(doc, template_key, ('base14', face[2]))
+
+			def load():
+				data = doc.xref_stream(face[1])
+				try:
+					return AtkFont('', mu.fz_new_font_from_buffer(None, mu.fz_new_buffer_from_copied_data(data), 0, 0), len(data), base)
 				except Exception:
-					fields = {}
-			result['data'] = fields
-			images_raw = request.form.get('images')
-			if images_raw:
+					# a font file FreeType cannot read: the base-14 stand-in writes everything
+					return base
+			return self.get('%s:%d' % (template_key, face[1]), load)
+		return self.get('base14:' + face[1], lambda: AtkFont('', mu.fz_new_base14_font(face[1])))
+
+	def stats(self) -> Dict[str, Any]:
+		with self._lock:
+			lookups = self.hits + self.misses
+			return {
+				"entries": len(self._items),
+				"bytes": self.bytes,
+				"maxBytes": self.max_bytes,
+				"hits": self.hits,
+				"misses": self.misses,
+				"hitRatio": round(self.hits / lookups, 4) if lookups else None,
+				"subsets": len(self._subsets),
+				"subsetHits": self.subset_hits,
+				"subsetMisses": self.subset_misses,
+			}
+
+
+atkFonts = AtkFontCache(pxEnvInt('ATKPDF_FONT_CACHE_MB', 32) * 1024 * 1024)
+_atkArabicTable: Dict[str, Tuple] = {}
+
+
+def atkWinAnsi(text: str) -> bool:
+	"""Whether mupdf's own appearance writer can show text (WinAnsi, i.e. cp1252)."""
+	try:
+		text.encode('cp1252')
+		return True
+	except UnicodeEncodeError:
+		return False
+
+
+def _atkArabicForms() -> Dict[str, Tuple]:
+	"""letter -> (isolated, final, initial, medial) presentation forms (None where the letter has none);
+	alef variants also map ('lam-alef', isolated, final) under the key 'ل' + alef."""
+	if not _atkArabicTable:
+		import unicodedata
+
+		def form(name: str) -> Optional[str]:
+			try:
+				return unicodedata.lookup(name)
+			except KeyError:
+				return None
+
+		table = {}
+		for cp in range(0x0620, 0x06D4):
+			name = unicodedata.name(chr(cp), '')
+			if name.startswith('ARABIC LETTER '):
+				forms = tuple(form('%s %s FORM' % (name, f)) for f in ('ISOLATED', 'FINAL', 'INITIAL', 'MEDIAL'))
+				if any(forms):
+					table[chr(cp)] = forms
+		for alef in ('ALEF', 'ALEF WITH MADDA ABOVE', 'ALEF WITH HAMZA ABOVE', 'ALEF WITH HAMZA BELOW'):
+			lig = 'ARABIC LIGATURE LAM WITH ' + alef
+			table['ل' + unicodedata.lookup('ARABIC LETTER ' + alef)] = (form(lig + ' ISOLATED FORM'), form(lig + ' FINAL FORM'))
+		_atkArabicTable.update(table)
+	return _atkArabicTable
+
+
+def atkShapeArabic(text: str) -> list:
+	"""[(character to draw, source text)]: Arabic letters replaced by their contextual presentation forms."""
+	import unicodedata
+	forms = _atkArabicForms()
+
+	def joining(ch):
+		if unicodedata.category(ch) == 'Mn':
+			return 'T'
+		f = forms.get(ch)
+		return None if not f or len(f) < 4 else 'D' if f[2] else 'R'
+
+	kinds = [joining(ch) for ch in text]
+	out = []
+	i = 0
+	while i < len(text):
+		ch, kind = text[i], kinds[i]
+		if kind in (None, 'T'):
+			out.append((ch, ch))
+			i += 1
+			continue
+		prev = next((kinds[j] for j in range(i - 1, -1, -1) if kinds[j] != 'T'), None)
+		after = next((j for j in range(i + 1, len(text)) if kinds[j] != 'T'), None)
+		joins_prev = prev == 'D'
+		lig = forms.get(ch + text[after]) if after is not None and ch == 'ل' else None
+		if lig and lig[0]:
+			out.append((lig[1] if joins_prev and lig[1] else lig[0], text[i:after + 1]))
+			i = after + 1
+			continue
+		joins_next = kind == 'D' and after is not None and kinds[after] in ('D', 'R')
+		iso, fin, ini, med = forms[ch]
+		shaped = (med if joins_prev and joins_next else fin if joins_prev else ini if joins_next else iso) or ch
+		out.append((shaped, ch))
+		i += 1
+	return out
+
+
+def atkVisualOrder(glyphs: list) -> list:
+	"""Reorder [(character, source)] of one line from logical to visual order (reduced Unicode bidi: strong
+	types, numbers, neutrals between equal directions, and mirrored brackets in right-to-left runs)."""
+	import unicodedata
+	types = [unicodedata.bidirectional(ch[0]) for ch in glyphs]
+	if not any(t in ('R', 'AL') for t in types):
+		return glyphs
+	dirs = [('R' if t in ('R', 'AL') else 'L' if t == 'L' else 'N' if t in ('EN', 'AN') else None) for t in types]
+	base = 1 if next((d for d in dirs if d in ('R', 'L')), 'L') == 'R' else 0
+	levels, last = [], 'R' if base else 'L'
+	for i, d in enumerate(dirs):
+		if d in ('R', 'L'):
+			last = d
+		elif d == 'N':
+			# numbers go left-to-right inside right-to-left text and count as right-to-left around them
+			d = dirs[i] = 'R' if base or last == 'R' else 'L'
+			levels.append(2 if d == 'R' else 0)
+			continue
+		levels.append(None if d is None else 1 if d == 'R' else 2 if base else 0)
+	for i, level in enumerate(levels):
+		if level is None:
+			before = next((dirs[j] for j in range(i - 1, -1, -1) if dirs[j]), 'R' if base else 'L')
+			after = next((dirs[j] for j in range(i + 1, len(dirs)) if dirs[j]), 'R' if base else 'L')
+			levels[i] = base if before != after else 1 if before == 'R' else 2 if base else 0
+	out = list(glyphs)
+	for level in range(max(levels), 0, -1):
+		i = 0
+		while i < len(out):
+			if levels[i] >= level:
+				j = i
+				while j < len(out) and levels[j] >= level:
+					j += 1
+				out[i:j] = out[i:j][::-1]
+				levels[i:j] = levels[i:j][::-1]
+				i = j
+			else:
+				i += 1
+	# a mirrored glyph maps to the bracket it shows, so one glyph never stands for both brackets in /ToUnicode
+	return [(ATK_MIRRORED[ch],) * 2 if level % 2 and ch in ATK_MIRRORED else (ch, src) for (ch, src), level in zip(out, levels)]
+
+
+def _atkFontSubset(font: AtkFont, glyphs: Dict[int, str]) -> Dict[int, Tuple[str, Optional[bytes]]]:
+	"""The objects of font as a compressed Type0 font subset to glyphs (gid -> source text): scratch object number ->
+	(object text, raw stream or None), the font dictionary first. mupdf subsets fonts by what page content uses,
+	so the subset is drawn on a scratch page."""
+	import fitz
+	mu = fitz.mupdf
+
+	def ref(value: str) -> int:
+		return int(value.strip('[] ').split()[0])
+
+	scratch = fitz.open()
+	try:
+		scratch.new_page()
+		spdf = fitz._as_pdf_document(scratch)
+		num = mu.pdf_to_num(mu.pdf_add_cid_font(spdf, font.font))
+		descendant = ref(scratch.xref_get_key(num, "DescendantFonts")[1])
+		page_xref = scratch.page_xref(0)
+		scratch.xref_set_key(page_xref, "Resources", '<</Font<</F0 %d 0 R>>>>' % num)
+		contents = scratch.get_new_xref()
+		scratch.update_object(contents, '<<>>')
+		scratch.update_stream(contents, ('BT /F0 1 Tf <%s> Tj ET' % ''.join('%04x' % g for g in sorted(glyphs))).encode())
+		scratch.xref_set_key(page_xref, "Contents", '%d 0 R' % contents)
+		# the base-14 faces are name-keyed CFF files that mupdf embeds as CIDFontType0C; subset as that, it keeps
+		# only the glyphs of the standard encoding, so it is labelled Type1C for the subset and relabelled after
+		kind, value = scratch.xref_get_key(descendant, "FontDescriptor/FontFile3")
+		cff = ref(value) if kind == 'xref' and scratch.xref_get_key(ref(value), "Subtype")[1] == '/CIDFontType0C' else 0
+		if cff:
+			scratch.xref_set_key(cff, "Subtype", "/Type1C")
+		mu.pdf_subset_fonts2(spdf, [0])
+		if cff:
+			scratch.xref_set_key(cff, "Subtype", "/CIDFontType0C")
+		# the whole font's widths and cmap came along; keep the used glyphs only
+		widths = '[%s]' % ' '.join('%d [%d]' % (g, round(font.advance(g) * 1000)) for g in sorted(glyphs))
+		kind, value = scratch.xref_get_key(descendant, "W")
+		if kind == 'xref':
+			scratch.update_object(ref(value), widths)
+		else:
+			scratch.xref_set_key(descendant, "W", widths)
+		entries = ['<%04x> <%s>' % (g, text.encode('utf-16-be').hex()) for g, text in sorted(glyphs.items()) if text]
+		cmap = ['/CIDInit /ProcSet findresource begin', '12 dict begin', 'begincmap',
+			'/CIDSystemInfo << /Registry (Adobe) /Ordering (UCS) /Supplement 0 >> def',
+			'/CMapName /Adobe-Identity-UCS def', '/CMapType 2 def',
+			'1 begincodespacerange', '<0000> <ffff>', 'endcodespacerange']
+		for i in range(0, len(entries), 100):
+			cmap += ['%d beginbfchar' % len(entries[i:i + 100])] + entries[i:i + 100] + ['endbfchar']
+		cmap += ['endcmap', 'CMapName currentdict /CMap defineresource pop', 'end', 'end']
+		kind, value = scratch.xref_get_key(num, "ToUnicode")
+		if kind == 'xref':
+			scratch.update_stream(ref(value), '\n'.join(cmap).encode())
+		for key in ("FontFile2", "FontFile3", "FontFile"):
+			kind, value = scratch.xref_get_key(descendant, "FontDescriptor/" + key)
+			if kind == 'xref' and scratch.xref_get_key(ref(value), "Filter")[0] == 'null':
+				scratch.update_stream(ref(value), scratch.xref_stream_raw(ref(value)))
+		objects: Dict[int, Tuple[str, Optional[bytes]]] = {}
+		pending = [num]
+		while pending:
+			n = pending.pop()
+			if n not in objects:
+				text = scratch.xref_object(n, compressed=True)
+				objects[n] = (text, scratch.xref_stream_raw(n) if scratch.xref_is_stream(n) else None)
+				pending += [int(m) for m in re.findall(r'\b(\d+) 0 R\b', text)]
+		return objects
+	finally:
+		scratch.close()
+
+
+def atkEmbedFont(doc, num: int, font: AtkFont, glyphs: Dict[int, str]) -> None:
+	"""Write font into object num of doc as a Type0 font subset to glyphs (gid -> source text). Subsets are cached
+	per glyph set in atkFonts, so fills drawing on the same characters copy a ready one."""
+	import fitz
+	mu = fitz.mupdf
+	objects = atkFonts.subset(font, glyphs)
+	first = next(iter(objects))
+	mapping = {n: num if n == first else doc.get_new_xref() for n in objects}
+	pdf = fitz._as_pdf_document(doc)
+	for n, (text, stream) in objects.items():
+		doc.update_object(mapping[n], re.sub(r'\b(\d+) 0 R\b', lambda m: '%d 0 R' % mapping[int(m.group(1))], text))
+		if stream is not None:
+			# raw, so the stream keeps its /Filter
+			mu.pdf_update_stream(pdf, mu.pdf_new_indirect(pdf, mapping[n], 0), mu.fz_new_buffer_from_copied_data(stream), 1)
+
+
+# ----------------------------- Widget Appearances -----------------------------
+# Filling a text or choice field means setting /V and regenerating its appearance stream. Going through fitz.Widget
+# costs ~290us per field, most of it reading and writing back every widget property; the fill path below sets
+# the value and regenerates the appearance once with the mupdf calls directly (~45us), and sets checkboxes by
+# switching /AS and /V to the on-state recorded in the layout (no regeneration needed).
+# The output matches Widget.update(): a zero or missing /BS /W is written as 1 (fitz reads it that way) before
+# the appearance is generated, so text is inset by the border and auto-sized fonts are 4 border widths below
+# the rect height. Checkbox appearances are kept from the template rather than regenerated.
+#
+# Such an appearance only depends on the widget's own dictionary (DA, Q, MaxLen, Ff, MK, BS, Opt, parent field),
+# its rect size and the value, so generated streams are cached per (template, appearance key, value) in a
+# process-wide LRU (ATKPDF_APPEARANCE_CACHE_MB, default 16; 0 disables) and rebuilt from the cache in later
+# fills of the same template (~20us). Within one document, widgets with the same key and value share one stream.
+# Only streams whose resources are template objects or self-contained new objects (the base-14 fonts mupdf
+# adds) are cached.
+
+ATK_APPEARANCE_STREAM_KEYS = frozenset(('Type', 'Subtype', 'BBox', 'Matrix', 'Resources', 'Length', 'Filter'))
+ATK_APPEARANCE_KEYS = ('FT', 'DA', 'Q', 'MaxLen', 'Ff', 'MK', 'BS', 'Border', 'Opt', 'TI', 'Parent')
+
+
+def atkAppearanceKey(doc, xref: int, rect) -> str:
+	"""Digest of everything besides the value that shapes a text or choice widget's appearance (readonly bit excluded)."""
+	parts = []
+	for name in ATK_APPEARANCE_KEYS:
+		kind, value = doc.xref_get_key(xref, name)
+		if name == 'Ff' and kind == 'int':
+			value = str(int(value) & ~1)
+		parts.append(value)
+	parts.append('%.2fx%.2f' % (abs(rect.width), abs(rect.height)))
+	return hashlib.sha1('\x00'.join(parts).encode('utf-8')).hexdigest()[:20]
+
+
+class AtkAppearanceCache:
+	"""LRU of generated text widget appearance streams: key -> (bbox, matrix, fonts, content).
+	fonts is [(resource name, object number or the text of a self-contained font object)]."""
+
+	def __init__(self, max_bytes: int):
+		self.max_bytes = max_bytes
+		self.bytes = 0
+		self.hits = 0
+		self.misses = 0
+		self.generated = 0
+		self.shared = 0
+		self._items: "OrderedDict[Tuple, Tuple]" = OrderedDict()
+		self._lock = threading.Lock()
+
+	def get(self, key: Tuple) -> Optional[Tuple]:
+		if self.max_bytes <= 0:
+			return None
+		with self._lock:
+			entry = self._items.get(key)
+			if entry is None:
+				self.misses += 1
+				return None
+			self._items.move_to_end(key)
+			self.hits += 1
+			return entry
+
+	def put(self, key: Tuple, entry: Tuple) -> None:
+		size = len(entry[3]) + 256
+		if size > self.max_bytes:
+			return
+		with self._lock:
+			if key in self._items:
+				return
+			self._items[key] = entry
+			self.bytes += size
+			while self.bytes > self.max_bytes and self._items:
+				_, evicted = self._items.popitem(last=False)
+				self.bytes -= len(evicted[3]) + 256
+
+	def stats(self) -> Dict[str, Any]:
+		with self._lock:
+			lookups = self.hits + self.misses
+			return {
+				"entries": len(self._items),
+				"bytes": self.bytes,
+				"maxBytes": self.max_bytes,
+				"hits": self.hits,
+				"misses": self.misses,
+				"hitRatio": round(self.hits / lookups, 4) if lookups else None,
+				"generated": self.generated,
+				"shared": self.shared,
+			}
+
+
+atkAppearances = AtkAppearanceCache(pxEnvInt('ATKPDF_APPEARANCE_CACHE_MB', 16) * 1024 * 1024)
+
+
+class AtkWidgetFiller:
+	"""Fills text, choice and checkbox widgets of one document with the mupdf calls directly (see Widget Appearances).
+	fill() returns False for widgets it does not handle; those go through fitz.Widget."""
+
+	def __init__(self, doc, template: AtkTemplate, cache: AtkAppearanceCache = None):
+		import fitz
+		self.mu = fitz.mupdf
+		self.pdf = fitz._as_pdf_document(doc)
+		self.doc = doc
+		self.template = template
+		self.cache = atkAppearances if cache is None else cache
+		self.streams: Dict[Tuple, int] = {}  # (appearance key, value) -> stream object in this document
+		self.fonts: Dict[str, int] = {}  # cached font object text -> object number in this document
+		self._created: Dict[int, Optional[str]] = {}  # new object number -> its text if it can be cached
+		self._annots: Dict[int, Dict[int, Any]] = {}  # page number -> {xref: pdf_annot}
+		self._empty: Dict[str, Optional[Tuple]] = {}  # appearance key -> cache entry of the empty value
+		self._written: Dict[str, list] = {}  # font key -> [resource name, object number, AtkFont, {gid: text}]
+
+	def _owner(self, obj):
+		"""The field dictionary holding /V: the widget itself, or its parent when the widget has no /T."""
+		mu = self.mu
+		if not mu.pdf_is_string(mu.pdf_dict_get(obj, mu.PDF_ENUM_NAME_T)):
+			parent = mu.pdf_dict_get(obj, mu.PDF_ENUM_NAME_Parent)
+			if mu.pdf_is_dict(parent):
+				return parent
+		return obj
+
+	def _set_value(self, obj, text: str, choice: bool) -> None:
+		mu = self.mu
+		owner = self._owner(obj)
+		mu.pdf_dict_put_text_string(owner, mu.PDF_ENUM_NAME_V, text)
+		# a stale rich-text value or choice selection index would contradict /V
+		mu.pdf_dict_dels(owner, 'I' if choice else 'RV')
+
+	def _set_border(self, obj) -> None:
+		"""Write /BS as Widget.update() does: a zero or missing width becomes 1, a missing style solid."""
+		mu = self.mu
+		bs = mu.pdf_dict_get(obj, mu.PDF_ENUM_NAME_BS)
+		if not mu.pdf_is_dict(bs):
+			bs = mu.pdf_dict_put_dict(obj, mu.PDF_ENUM_NAME_BS, 2)
+		if not mu.pdf_is_name(mu.pdf_dict_get(bs, mu.PDF_ENUM_NAME_S)):
+			mu.pdf_dict_put(bs, mu.PDF_ENUM_NAME_S, mu.PDF_ENUM_NAME_S)
+		if mu.pdf_to_real(mu.pdf_dict_get(bs, mu.PDF_ENUM_NAME_W)) == 0:
+			mu.pdf_dict_put_int(bs, mu.PDF_ENUM_NAME_W, 1)
+
+	def _annot(self, page, xref: int):
+		annots = self._annots.get(page.number)
+		if annots is None:
+			import fitz
+			mu = self.mu
+			annots = self._annots[page.number] = {}
+			annot = mu.pdf_first_widget(fitz._as_pdf_page(page))
+			while annot.m_internal:
+				annots[mu.pdf_to_num(mu.pdf_annot_obj(annot))] = annot
+				annot = mu.pdf_next_widget(annot)
+		return annots.get(xref)
+
+	def fill(self, page, xref: int, value: Any) -> bool:
+		import fitz
+		w = self.template.widgets.get(xref)
+		if w is None:
+			return False
+		if w["type"] == fitz.PDF_WIDGET_TYPE_CHECKBOX and w.get("onState"):
+			mu = self.mu
+			state = w["onState"] if str(value).lower() in ['true', '1', 'yes', 'on', 'x'] else 'Off'
+			obj = mu.pdf_load_object(self.pdf, xref)
+			self._set_border(obj)
+			mu.pdf_dict_put_name(self._owner(obj), mu.PDF_ENUM_NAME_V, state)
+			mu.pdf_dict_put_name(obj, mu.PDF_ENUM_NAME_AS, state)
+			return True
+		text = str(value)
+		if not w.get("ap") or not text:
+			return False
+		self._set_border(self.mu.pdf_load_object(self.pdf, xref))
+		choice = w["type"] != fitz.PDF_WIDGET_TYPE_TEXT
+		if w.get("font") and w["type"] != fitz.PDF_WIDGET_TYPE_LISTBOX and not atkWinAnsi(text):
+			return self._fill_unicode(page, xref, w, text, choice)
+		return self._fill_text(page, xref, w["ap"], text, choice)
+
+	def _fill_text(self, page, xref: int, ap_key: str, text: str, choice: bool = False) -> bool:
+		mu = self.mu
+		obj = mu.pdf_load_object(self.pdf, xref)
+		key = (ap_key, text)
+		stream = self.streams.get(key)
+		if stream is not None:
+			self.cache.shared += 1
+		else:
+			cached = self.cache.get((self.template.key,) + key)
+			if cached is not None:
+				stream = self.streams[key] = self._build(cached)
+		if stream is not None:
+			self._set_value(obj, text, choice)
+			ap = mu.pdf_dict_put_dict(obj, mu.PDF_ENUM_NAME_AP, 1)
+			mu.pdf_dict_put(ap, mu.PDF_ENUM_NAME_N, mu.pdf_new_indirect(self.pdf, stream, 0))
+			return True
+		annot = self._annot(page, xref)
+		if annot is None:
+			return False
+		self._set_value(obj, text, choice)
+		# a resynthesis request makes mupdf write the new stream into the document rather than a local copy
+		mu.pdf_annot_request_resynthesis(annot)
+		mu.pdf_update_annot(annot)
+		self.cache.generated += 1
+		normal = mu.pdf_dict_getl(obj, mu.PDF_ENUM_NAME_AP, mu.PDF_ENUM_NAME_N)
+		if mu.pdf_is_indirect(normal) and mu.pdf_is_stream(normal):
+			self.streams[key] = mu.pdf_to_num(normal)
+			entry = self._capture(normal)
+			if entry is not None:
+				self.cache.put((self.template.key,) + key, entry)
+		return True
+
+	def _fill_unicode(self, page, xref: int, w: Dict[str, Any], text: str, choice: bool) -> bool:
+		"""Write a value mupdf cannot show (see Fonts) into mupdf's appearance of the empty value, so the
+		background and border stay mupdf's."""
+		mu = self.mu
+		key = (w["ap"], text)
+		stream = self.streams.get(key)
+		if stream is None:
+			if w["ap"] not in self._empty:
+				ok = (w["ap"], '') in self.streams or self._fill_text(page, xref, w["ap"], '', choice)
+				empty = self.streams.get((w["ap"], '')) if ok else None
+				self._empty[w["ap"]] = self._capture(mu.pdf_new_indirect(self.pdf, empty, 0)) if empty is not None else None
+			entry = self._empty[w["ap"]]
+			if entry is None:
+				return False
+			bbox, matrix, fonts, content = entry
+			start, end = content.rfind(b'BT'), content.rfind(b'ET')
+			if start < 0 or end < start:
+				return False
+			obj = mu.pdf_load_object(self.pdf, xref)
+			quadding = mu.pdf_to_int(mu.pdf_dict_get_inheritable(obj, mu.PDF_ENUM_NAME_Q))
+			ops, used = self._layout(w, text, bbox, content[:start], quadding)
+			stream = self.streams[key] = self._build((bbox, matrix, fonts + used, content[:start] + ops + content[end + 2:]))
+		else:
+			self.cache.shared += 1
+		obj = mu.pdf_load_object(self.pdf, xref)
+		self._set_value(obj, text, choice)
+		ap = mu.pdf_dict_put_dict(obj, mu.PDF_ENUM_NAME_AP, 1)
+		mu.pdf_dict_put(ap, mu.PDF_ENUM_NAME_N, mu.pdf_new_indirect(self.pdf, stream, 0))
+		return True
+
+	def _layout(self, w: Dict[str, Any], text: str, bbox: Tuple, prologue: bytes, quadding: int) -> Tuple[bytes, list]:
+		"""Text operators (BT ... ET) for text in a widget of size bbox, laid out the way mupdf does it, and the
+		font resources they use. prologue is mupdf's appearance of the empty value up to BT; its clip rect is inset
+		by the border, and mupdf pads text by twice that."""
+		name, size, color_ops, face = w["font"]
+		primary = atkFonts.face(self.doc, self.template.key, face)
+		width, height = bbox[2] - bbox[0], bbox[3] - bbox[1]
+		clip = re.search(rb'([\d.]+) [\d.]+ [\d.]+ [\d.]+ re\s+W', prologue)
+		pad = 2 * float(clip.group(1)) if clip else 2.0
+		multiline = int(w.get("flags") or 0) & 4096
+		lines = [atkShapeArabic(line) for line in (text.replace('\r\n', '\n').replace('\r', '\n').split('\n') if multiline else [text.replace('\n', ' ')])]
+
+		def measure(glyphs) -> float:
+			return sum(primary.glyph(ord(ch))[2] for ch, _ in glyphs)
+
+		avail = max(1.0, width - 2 * pad)
+		if size <= 0:
+			size = 12.0 if multiline else max(1.0, height - 2 * pad)
+			widest = max(measure(line) for line in lines)
+			if not multiline and widest * size > avail:
+				size = avail / widest
+		if multiline:
+			wrapped = []
+			for line in lines:
+				# greedy word wrap; trailing spaces may overflow
+				current, current_width, pos = [], 0.0, 0
+				for word in re.findall(r'\S+\s*|\s+', ''.join(ch for ch, _ in line)):
+					glyphs, pos = line[pos:pos + len(word)], pos + len(word)
+					if current and current_width + measure(g for g in glyphs if not g[0].isspace()) * size > avail:
+						wrapped.append(current)
+						current, current_width = [], 0.0
+					current += glyphs
+					current_width += measure(glyphs) * size
+				wrapped.append(current)
+			lines = wrapped
+		ops = ['BT', color_ops]
+		for i, line in enumerate(lines):
+			visual = atkVisualOrder(line)
+			text_width = measure(visual) * size
+			x = (width - text_width) / 2 if quadding == 1 else width - pad - text_width if quadding == 2 else pad
+			y = height - pad - size * ATK_LINE_HEIGHT * (i + 1) if multiline else (height - size) / 2 + size * 0.2
+			ops.append('1 0 0 1 %.2f %.2f Tm' % (x, y))
+			run_font, run = None, []
+			for ch, src in visual + [(None, None)]:
+				font, gid = (None, 0) if ch is None else primary.glyph(ord(ch))[:2]
+				if font is not run_font and run:
+					ops.append('/%s %.2f Tf <%s> Tj' % (self._font_resource(run_font)[0], size, ''.join('%04x' % g for g in run)))
+					run = []
+				if font is not None:
+					run_font = font
+					run.append(gid)
+					self._font_resource(font)[3].setdefault(gid, src)
+		ops.append('ET')
+		used = [(res, num) for res, num, _, _ in self._written.values()]
+		return '\n'.join(ops).encode(), used
+
+	def _font_resource(self, font: AtkFont) -> list:
+		"""[resource name, object number, font, {gid: text}] of a font written with in this document; the object
+		is filled in by finish()."""
+		written = self._written.get(font.key)
+		if written is None:
+			num = self.doc.get_new_xref()
+			self.doc.update_object(num, '<<>>')
+			written = self._written[font.key] = ['AtkF%d' % len(self._written), num, font, {}]
+		return written
+
+	def finish(self) -> None:
+		"""Embed the fonts the written appearances use, each subset to its glyphs (see Fonts)."""
+		for _, num, font, glyphs in self._written.values():
+			atkEmbedFont(self.doc, num, font, glyphs)
+
+	def _capture(self, stream) -> Optional[Tuple]:
+		"""Cache entry for a generated appearance stream, or None if it uses anything beyond fonts."""
+		mu = self.mu
+		for i in range(mu.pdf_dict_len(stream)):
+			if mu.pdf_to_name(mu.pdf_dict_get_key(stream, i)) not in ATK_APPEARANCE_STREAM_KEYS:
+				return None
+		resources = mu.pdf_dict_get(stream, mu.PDF_ENUM_NAME_Resources)
+		fonts = []
+		if resources.m_internal:
+			font_dict = mu.pdf_dict_get(resources, mu.PDF_ENUM_NAME_Font)
+			if mu.pdf_dict_len(resources) != (1 if font_dict.m_internal else 0):
+				return None
+			for i in range(mu.pdf_dict_len(font_dict)):
+				font = mu.pdf_dict_get_val(font_dict, i)
+				if not mu.pdf_is_indirect(font):
+					return None
+				num = mu.pdf_to_num(font)
+				if num >= self.template.xref_count:
+					# created during this fill: only self-contained font dictionaries can be recreated
+					if num not in self._created:
+						text = None if self.doc.xref_is_stream(num) else self.doc.xref_object(num, compressed=True)
+						self._created[num] = None if text is None or ' R' in text else text
+					num = self._created[num]
+					if num is None:
+						return None
+				fonts.append((mu.pdf_to_name(mu.pdf_dict_get_key(font_dict, i)), num))
+		bbox = mu.pdf_dict_get_rect(stream, mu.PDF_ENUM_NAME_BBox)
+		matrix = mu.pdf_dict_get_matrix(stream, mu.PDF_ENUM_NAME_Matrix)
+		# a copy: fz_buffer_extract would empty the buffer of a stream created in this document
+		content = mu.pdf_load_stream(stream).fz_buffer_extract_copy()
+		return ((bbox.x0, bbox.y0, bbox.x1, bbox.y1), (matrix.a, matrix.b, matrix.c, matrix.d, matrix.e, matrix.f), fonts, content)
+
+	def _build(self, entry: Tuple) -> int:
+		"""Create an appearance stream object in this document from a cache entry; returns its number."""
+		mu = self.mu
+		bbox, matrix, fonts, content = entry
+		stream = mu.pdf_new_dict(self.pdf, 5)
+		mu.pdf_dict_put(stream, mu.PDF_ENUM_NAME_Type, mu.PDF_ENUM_NAME_XObject)
+		mu.pdf_dict_put(stream, mu.PDF_ENUM_NAME_Subtype, mu.PDF_ENUM_NAME_Form)
+		mu.pdf_dict_put_rect(stream, mu.PDF_ENUM_NAME_BBox, mu.FzRect(*bbox))
+		mu.pdf_dict_put_matrix(stream, mu.PDF_ENUM_NAME_Matrix, mu.FzMatrix(*matrix))
+		if fonts:
+			font_dict = mu.pdf_dict_put_dict(mu.pdf_dict_put_dict(stream, mu.PDF_ENUM_NAME_Resources, 1), mu.PDF_ENUM_NAME_Font, len(fonts))
+			for name, num in fonts:
+				if isinstance(num, str):
+					created = self.fonts.get(num)
+					if created is None:
+						created = self.fonts[num] = self.doc.get_new_xref()
+						self.doc.update_object(created, num)
+					num = created
+				mu.pdf_dict_puts(font_dict, name, mu.pdf_new_indirect(self.pdf, num, 0))
+		obj = mu.pdf_add_stream(self.pdf, mu.fz_new_buffer_from_copied_data(content), stream, 0)
+		return mu.pdf_to_num(obj)
+
+
+# ----------------------------- Fill Engine -----------------------------
+
+def atkLoadImageBytes(cfg: Any) -> Optional[bytes]:
+	"""Resolve an image item's source (URL, www., data URL, base64 or bytes) to raw bytes; None on failure."""
+	src = pxJson(cfg, 'source') or pxJson(cfg, 'data') or pxJson(cfg, 'url')
+	if not src:
+		return None
+	img_bytes = None
+	if isinstance(src, (bytes, bytearray, memoryview)):
+		img_bytes = src if isinstance(src, bytes) else bytes(src)
+	elif isinstance(src, str):
+		src_clean = src.strip()
+		# bare www.* is normalized to https:// (pxNormalizeUrl)
+		if src_clean.startswith('http') or src_clean.startswith('www.'):
+			try:
+				max_bytes = int(pxJson(cfg, 'maxBytes') or 10485760)
+				img_bytes = atkFetchImage(src_clean, max_bytes)
+			except Exception:
+				img_bytes = None
+		else: # Assume base64 or data-url
+			img_bytes = pxDecodeB64Bytes(src_clean)
+			if not img_bytes and len(src_clean) > 10:
+				try:
+					mb = len(src_clean) % 4
+					img_bytes = base64.b64decode(src_clean + ('=' * (4 - mb) if mb else ''))
+				except Exception:
+					img_bytes = None
+	return img_bytes
+
+
+def _atkKeepProportion(cfg: Any) -> bool:
+	preserve = pxJson(cfg, 'preserveAspect')
+	if preserve is None:
+		preserve = pxJson(cfg, 'keepProportion')
+	return True if preserve is None else bool(preserve)
+
+
+def atkImageItems(field_values: Any, image_items: Any) -> Dict[str, Any]:
+	"""Merge the preferred images.* map with legacy image items found under data.* (images.* wins)."""
+	items = dict(image_items) if isinstance(image_items, dict) else {}
+	# Backward compatibility: find images in `data` if not in `images`
+	if isinstance(field_values, dict):
+		for k, v in field_values.items():
+			if k not in items and isinstance(v, dict) and 'source' in v:
+				items[k] = v
+	return items
+
+
+def atkResolveTemplate(pdf_input: Any, template_id: Any = None):
+	"""Resolve 'pdf'/'file' input or a registered template_id to (template, cache_hit); error dict on failure."""
+	registered = None
+	pdf_bytes = None
+	try:
+		if not pdf_input:
+			registered = atkLoadRegisteredTemplate(template_id)
+			if not registered:
+				return {"report": "error", "message": f"Template '{template_id}' not found.", "code": "ATKPDF-07"}
+		elif isinstance(pdf_input, str):
+			with atkMetrics.time('decode'):
+				pdf_bytes = pxDecodeB64Bytes(pdf_input)
+		elif isinstance(pdf_input, AtkSpooledFile):
+			pdf_bytes = pdf_input
+		elif isinstance(pdf_input, (bytes, bytearray, memoryview)):
+			pdf_bytes = pdf_input if isinstance(pdf_input, bytes) else bytes(pdf_input)
+		if not pdf_bytes and not registered: raise ValueError("PDF input could not be decoded to bytes.")
+	except Exception as e:
+		return {"report": "error", "message": f"PDF decoding failed: {e}", "code": "ATKPDF-03"}
+	if registered:
+		return registered
+	try:
+		with atkMetrics.time('template'):
+			return atkLoadTemplate(pdf_bytes)
+	except Exception as e:
+		return {"report": "error", "message": f"PDF processing failed: {e}", "code": "ATKPDF-04"}
+
+
+def atkPrefetchImages(image_items: Dict[Any, Any], concurrency: Optional[int] = None, load_image=atkLoadImageBytes) -> Dict[Any, Any]:
+	"""Resolve every image item's source to raw bytes up front and concurrently.
+
+	Identical sources (same source and maxBytes) are resolved once. Items that cannot be resolved are
+	dropped, as the page loop would skip them anyway. At most `concurrency` (ATKPDF_IMAGE_CONCURRENCY,
+	default 8) sources are in flight per call.
+	"""
+	pending = {}  # source key -> [item names]
+	cfgs = {}
+	resolved = {}
+	for name, cfg in (image_items or {}).items():
+		src = pxJson(cfg, 'source') or pxJson(cfg, 'data') or pxJson(cfg, 'url')
+		if not src:
+			continue
+		if isinstance(src, (bytes, bytearray)):
+			resolved[name] = cfg
+			continue
+		key = (src, pxJson(cfg, 'maxBytes')) if isinstance(src, str) else ('#', name)
+		try:
+			hash(key)
+		except TypeError:
+			key = ('#', name)
+		pending.setdefault(key, []).append(name)
+		cfgs[key] = cfg
+	if not pending:
+		return resolved
+
+	limit = max(1, concurrency or pxEnvInt('ATKPDF_IMAGE_CONCURRENCY', 8))
+	fetch_start = time.perf_counter()
+	if limit == 1 or len(pending) == 1:
+		fetched = {key: load_image(cfgs[key]) for key in pending}
+	else:
+		from concurrent.futures import ThreadPoolExecutor
+		with ThreadPoolExecutor(max_workers=min(limit, len(pending))) as pool:
+			futures = {key: pool.submit(load_image, cfgs[key]) for key in pending}
+			fetched = {}
+			for key, fut in futures.items():
+				try:
+					fetched[key] = fut.result()
+				except Exception:
+					fetched[key] = None
+	atkMetrics.stage('images_fetch', time.perf_counter() - fetch_start)
+
+	for key, names in pending.items():
+		img_bytes = fetched.get(key)
+		if not img_bytes:
+			continue
+		for name in names:
+			item = dict(image_items[name]) if isinstance(image_items[name], dict) else {}
+			item.pop('data', None)
+			item.pop('url', None)
+			item['source'] = img_bytes
+			resolved[name] = item
+	return resolved
+
+
+class AtkImagePlacer:
+	"""Inserts images into one document, resampling them for their rect (see AtkImageResampler) and
+	embedding identical image bytes once, reusing that xref."""
+
+	def __init__(self, max_dpi: Optional[int] = None):
+		self.max_dpi = max_dpi
+		self.xrefs: Dict[str, int] = {}
+		self.placed = 0
+		self.reused = 0
+		self.resampled = 0
+		self.source_bytes = 0
+		self.embedded_bytes = 0
+		self.bytes_saved = 0
+		self.insert_seconds = 0.0
+
+	def place(self, page, rect, img_bytes: bytes, keep_proportion: bool = True) -> None:
+		start = time.perf_counter()
+		try:
+			key, data, resampled = atkResampler.prepare(img_bytes, rect, keep_proportion, self.max_dpi)
+			self.source_bytes += len(img_bytes)
+			self.resampled += resampled
+			xref = self.xrefs.get(key)
+			if xref:
+				page.insert_image(rect, xref=xref, keep_proportion=keep_proportion, overlay=True)
+				self.reused += 1
+				self.bytes_saved += len(data)
+			else:
+				self.xrefs[key] = page.insert_image(rect, stream=data, keep_proportion=keep_proportion, overlay=True)
+				self.embedded_bytes += len(data)
+			self.placed += 1
+		finally:
+			self.insert_seconds += time.perf_counter() - start
+
+	def stats(self) -> Dict[str, Any]:
+		return {
+			"placed": self.placed,
+			"embedded": len(self.xrefs),
+			"reused": self.reused,
+			"resampled": self.resampled,
+			"sourceBytes": self.source_bytes,
+			"embeddedBytes": self.embedded_bytes,
+			"bytesSaved": self.bytes_saved,
+			"insertMs": round(self.insert_seconds * 1000, 3),
+		}
+
+
+def atkSetReadonly(doc, xrefs) -> None:
+	"""Set the ReadOnly bit in /Ff of the fields owning the given widget xrefs. Kids without their own /T
+	(radio buttons, repeated widgets) inherit /Ff, so the bit goes on their parent field dictionary.
+	Uses the mupdf dictionary calls directly (about 20x cheaper per widget than xref_get_key/xref_set_key,
+	which matters for forms with thousands of widgets) and falls back to the xref calls if they are missing."""
+	import fitz
+	try:
+		mu = fitz.mupdf
+		pdf = fitz._as_pdf_document(doc)
+		name_t, name_ff, name_parent = mu.PDF_ENUM_NAME_T, mu.PDF_ENUM_NAME_Ff, mu.PDF_ENUM_NAME_Parent
+	except AttributeError:
+		mu = None
+	done = set()
+	for xref in xrefs:
+		if mu is not None:
+			obj = mu.pdf_load_object(pdf, xref)
+			if not mu.pdf_is_string(mu.pdf_dict_get(obj, name_t)):
+				parent = mu.pdf_dict_get(obj, name_parent)
+				if mu.pdf_is_dict(parent):
+					obj = parent
+			key = mu.pdf_to_num(obj) or xref
+			if key in done:
+				continue
+			done.add(key)
+			flags = mu.pdf_to_int(mu.pdf_dict_get_inheritable(obj, name_ff))
+			if not flags & 1:
+				mu.pdf_dict_put_int(obj, name_ff, flags | 1)
+			continue
+		if doc.xref_get_key(xref, "T")[0] == 'null':
+			kind, parent = doc.xref_get_key(xref, "Parent")
+			if kind == 'xref':
+				xref = int(parent.split()[0])
+		if xref in done:
+			continue
+		done.add(xref)
+		kind, value = doc.xref_get_key(xref, "Ff")
+		flags = int(value) if kind == 'int' else 0
+		if not flags & 1:
+			doc.xref_set_key(xref, "Ff", str(flags | 1))
+
+
+def atkFlattenOption(value: Any):
+	"""form.flatten as given by a request: False, True (every page) or a sorted list of page numbers."""
+	if isinstance(value, (list, tuple)):
+		pages = set()
+		for item in value:
+			try:
+				pages.add(int(item))
+			except (TypeError, ValueError):
+				continue
+		return sorted(pages) or False
+	return bool(value)
+
+
+def atkFlatten(doc, template: AtkTemplate, pages: Optional[list] = None) -> None:
+	"""Bake widget appearances into the page content with one document-level doc.bake() and drop the form.
+
+	With pages (page numbers), only widgets on those pages are baked: the /Annots of the other pages are
+	hidden from bake and restored afterwards, and the AcroForm comes back without the baked fields (kids
+	on baked pages are dropped from their parents). Without pages, or when they cover every widget page,
+	the AcroForm is removed entirely.
+	"""
+	widget_pages = {pno for pno, widgets in enumerate(template.layout) if widgets}
+	keep = sorted(widget_pages - set(pages)) if pages is not None else []
+	if pages is not None and not widget_pages & set(pages):
+		return
+	catalog = doc.pdf_catalog()
+	hidden = {}
+	acroform = doc.xref_get_key(catalog, "AcroForm")
+	for pno in keep:
+		xref = doc.page_xref(pno)
+		hidden[xref] = doc.xref_get_key(xref, "Annots")
+		doc.xref_set_key(xref, "Annots", "null")
+	doc.bake(annots=False, widgets=True)
+	for pno in widget_pages.difference(keep):
+		# bake wraps the old /Contents in q/Q streams; a page that had none ends up with a null entry
+		xref = doc.page_xref(pno)
+		kind, contents = doc.xref_get_key(xref, "Contents")
+		if kind == 'array' and 'null' in contents:
+			doc.xref_set_key(xref, "Contents", contents.replace('null', ''))
+	if not keep:
+		if doc.xref_get_key(catalog, "AcroForm")[0] != 'null':
+			doc.xref_set_key(catalog, "AcroForm", "null")
+		return
+	for xref, (kind, value) in hidden.items():
+		doc.xref_set_key(xref, "Annots", value)
+	doc.xref_set_key(catalog, "AcroForm", acroform[1])
+
+	def refs(value: str) -> list:
+		return [int(n) for n in re.findall(r'(\d+) 0 R', value or '')]
+
+	kept = {w["xref"] for pno in keep for w in template.layout[pno]}
+	baked = {w["xref"] for pno in widget_pages - set(keep) for w in template.layout[pno]}
+
+	def top(xref: int) -> int:
+		seen = set()
+		while xref not in seen:
+			seen.add(xref)
+			kind, parent = doc.xref_get_key(xref, "Parent")
+			if kind != 'xref':
+				break
+			xref = refs(parent)[0]
+		return xref
+
+	live = {top(x) for x in kept}
+	for xref in baked:
+		kind, parent = doc.xref_get_key(xref, "Parent")
+		if kind == 'xref':
+			pxref = refs(parent)[0]
+			kids = [k for k in refs(doc.xref_get_key(pxref, "Kids")[1]) if k != xref]
+			doc.xref_set_key(pxref, "Kids", '[%s]' % ' '.join(f'{k} 0 R' for k in kids))
+	fields_key = "AcroForm/Fields"
+	fields = [f for f in refs(doc.xref_get_key(catalog, fields_key)[1]) if f in live]
+	doc.xref_set_key(catalog, fields_key, '[%s]' % ' '.join(f'{f} 0 R' for f in fields))
+
+
+def _atkFillDocument(doc, template: AtkTemplate, field_values: Dict[str, Any], image_items: Dict[str, Any],
+		form_readonly: bool = False, form_flatten: bool = False, load_image=atkLoadImageBytes, placer=None,
+		timings: Optional[Dict[str, float]] = None):
+	"""Apply field values, readonly/flatten and images to an open copy of the template.
+	form_flatten is True for the whole document or a list of page numbers (see atkFlatten).
+	Images go through `placer` (an AtkImagePlacer for this document unless given); font embedding and flatten
+	time are added to timings['fonts'] and timings['flatten'] when a dict is given.
+	Returns None on success or an error dict; unexpected failures raise.
+	"""
+	import fitz
+	placer = placer or AtkImagePlacer()
+	index = template.fields
+
+	# Plan from the field index: only pages holding targeted widgets or image placements are visited
+	fill_xrefs = {}  # page_num -> [widget xref] for data fields
+	field_images = {}  # page_num -> {widget xref: cfg}, images drawn into their own field's rect
+	free_images = {}  # page_num -> [(name, cfg, anchor)], images placed at coordinates or an anchor field
+	for field_name in field_values:
+		for loc in index.get(field_name, ()):
+			fill_xrefs.setdefault(loc["page"], []).append(loc["xref"])
+	for field_name, cfg in image_items.items():
+		locs = index.get(field_name)
+		if locs:
+			field_images.setdefault(locs[0]["page"], {})[locs[0]["xref"]] = cfg
+			continue
+		anchor_name = pxJson(cfg, 'anchor')
+		anchor = index[anchor_name][0] if anchor_name in index else None
+		free_images.setdefault(anchor["page"] if anchor else 0, []).append((field_name, cfg, anchor))
+	target_pages = set(fill_xrefs) | set(field_images) | set(free_images)
+
+	# Readonly only sets the ReadOnly bit of /Ff, which needs no page or widget object: write it straight to
+	# each widget dictionary from the layout, so untouched pages stay unloaded. Widgets loaded below read
+	# the new flags, so their update() keeps them.
+	if form_readonly:
+		try:
+			atkSetReadonly(doc, [w["xref"] for widgets in template.layout for w in widgets
+				if w["xref"] > 0 and not int(w.get("flags") or 0) & 1])
+		except Exception:
+			pass
+
+	filler = None
+	for page_num in sorted(target_pages):
+		page = doc[page_num]
+		page_images = field_images.get(page_num, {})
+		# 1. Text fields and checkboxes in one pass over the widget dictionaries (see AtkWidgetFiller);
+		# everything else is left to fitz.Widget below
+		filled = set()
+		for xref in dict.fromkeys(fill_xrefs.get(page_num, [])):
+			try:
+				if filler is None:
+					filler = AtkWidgetFiller(doc, template)
+				if filler.fill(page, xref, field_values[template.widgets[xref]["name"]]):
+					filled.add(xref)
+			except AttributeError:
+				break
+			except Exception:
+				return {'report':'error','message':'PDF processing failed','code':'ATKPDF-04'}
+		xrefs = dict.fromkeys([x for x in fill_xrefs.get(page_num, []) if x not in filled] + list(page_images))
+		_page_widgets = [w for w in (page.load_widget(x) for x in xrefs) if w]
+		for widget in _page_widgets:
+			field_name = widget.field_name
+
+			# 1.1 Remaining form fields (choices, radio buttons, ...)
+			if field_name in field_values and widget.xref not in filled:
+				try:
+					value = field_values[field_name]
+					if widget.field_type == fitz.PDF_WIDGET_TYPE_CHECKBOX:
+						# Handle boolean-like values for checkboxes
+						if str(value).lower() in ['true', '1', 'yes', 'on', 'x']:
+							widget.field_value = True
+						else:
+							widget.field_value = False
+					elif widget.field_type != fitz.PDF_WIDGET_TYPE_BUTTON:
+						widget.field_value = str(value)
+					widget.update()
+				except Exception as e:
+					return {'report':'error','message':'PDF processing failed','code':'ATKPDF-04'}
+
+			# 2. Image Placement on existing fields (use the widget's rectangle for perfect placement)
+			if widget.xref in page_images:
+				try:
+					cfg = page_images[widget.xref]
+					img_bytes = load_image(cfg)
+					if img_bytes:
+						placer.place(page, widget.rect, img_bytes, _atkKeepProportion(cfg))
+				except Exception:
+					pass
+
+		# 3. Images that don't match any existing field (place at coordinates or anchor)
+		for field_name, cfg, anchor in free_images.get(page_num, []):
+			try:
+				img_bytes = load_image(cfg)
+				if not img_bytes:
+					continue
+				anchor_rect = fitz.Rect(anchor["rect"]) if anchor else None
+				fit_to_anchor = bool(pxJson(cfg, 'fitToAnchor'))
+				if anchor_rect and fit_to_anchor:
+					rect = anchor_rect
+				else:
+					x = pxJson(cfg, 'x') or (float(anchor_rect.x0) if anchor_rect else 50)
+					y = pxJson(cfg, 'y') or (float(anchor_rect.y0) if anchor_rect else 50)
+					width = pxJson(cfg, 'width') or (float(anchor_rect.width) if anchor_rect else 100)
+					height = pxJson(cfg, 'height') or (float(anchor_rect.height) if anchor_rect else 100)
+					rect = fitz.Rect(x, y, x + width, y + height)
+				placer.place(page, rect, img_bytes, _atkKeepProportion(cfg))
+			except Exception:
+				pass
+
+	# 4. Fonts of appearances written outside mupdf, embedded once per document
+	if filler is not None:
+		fonts_start = time.perf_counter()
+		try:
+			filler.finish()
+		except Exception:
+			return {'report':'error','message':'PDF processing failed','code':'ATKPDF-04'}
+		if timings is not None:
+			timings['fonts'] = timings.get('fonts', 0.0) + time.perf_counter() - fonts_start
+
+	# 5. Flatten once for the whole document, after every appearance is final
+	if form_flatten:
+		flatten_start = time.perf_counter()
+		try:
+			atkFlatten(doc, template, None if form_flatten is True else form_flatten)
+		except Exception:
+			return {'report':'error','message':'PDF processing failed','code':'ATKPDF-04'}
+		if timings is not None:
+			timings['flatten'] = timings.get('flatten', 0.0) + time.perf_counter() - flatten_start
+
+
+# Output optimization profiles for the final save, selected per request by return.optimize (default
+# ATKPDF_OPTIMIZE, "fast"). fast is the plain tobytes() with the lowest latency; balanced drops unreferenced
+# objects and compresses uncompressed streams; compact also merges duplicate objects, recompresses images
+# and fonts and packs objects into object streams.
+ATK_OPTIMIZE_PROFILES: Dict[str, Dict[str, Any]] = {
+	"fast": {},
+	"balanced": {"garbage": 2, "deflate": True},
+	"compact": {"garbage": 3, "deflate": True, "deflate_images": True, "deflate_fonts": True, "use_objstms": 1},
+}
+
+
+def atkOptimizeProfile(value: Any = None) -> Optional[str]:
+	"""Profile name for a return.optimize value (empty -> ATKPDF_OPTIMIZE); None if it is not a known profile."""
+	name = str(value or os.environ.get('ATKPDF_OPTIMIZE') or 'fast').strip().lower()
+	return name if name in ATK_OPTIMIZE_PROFILES else None
+
+
+def atkRenderTemplate(template: AtkTemplate, field_values: Dict[str, Any], image_items: Dict[str, Any],
+		form_readonly: bool = False, form_flatten: bool = False, load_image=atkLoadImageBytes, optimize: str = 'fast',
+		out_path: Optional[str] = None):
+	"""Fill one copy of a template and save it with the given optimize profile.
+	Returns { report: "success", pdf: <bytes>, stats: {...} }, or { report: "success", path, bytes, stats }
+	when out_path is given, or an error dict (ATKPDF-04).
+	"""
+	doc = None
+	probe = AtkMemoryProbe()
+	stages = {}
+	try:
+		with probe:
+			start = time.perf_counter()
+			doc = template.open()
+			stages['open'] = time.perf_counter() - start
+			placer = AtkImagePlacer()
+			start = time.perf_counter()
+			err = _atkFillDocument(doc, template, field_values, image_items, form_readonly, form_flatten, load_image, placer, stages)
+			if err:
+				return err
+			stages['images_insert'] = placer.insert_seconds
+			stages['fill'] = time.perf_counter() - start - placer.insert_seconds - stages.get('flatten', 0.0) - stages.get('fonts', 0.0)
+			# tobytes() writes through a Python callback; saving to a file is several times faster, even
+			# when the bytes are read back
+			start = time.perf_counter()
+			path = out_path or pxSpoolPath()
+			save_options = dict(ATK_OPTIMIZE_PROFILES[optimize])
+			if 'flatten' in stages:
+				# baking orphans every widget dictionary; dropping them is cheaper than writing them
+				save_options['garbage'] = max(1, save_options.get('garbage', 0))
+			try:
+				doc.save(path, **save_options)
+				doc.close()
+				doc = None
+				if out_path:
+					result = {"report": "success", "path": out_path, "bytes": os.path.getsize(out_path)}
+				else:
+					with open(path, 'rb') as f:
+						result = {"report": "success", "pdf": f.read()}
+			finally:
+				if not out_path:
+					pxRemoveQuiet(path)
+			stages['save'] = time.perf_counter() - start
+			save = {"profile": optimize, "ms": round(stages['save'] * 1000, 3)}
+		result["stats"] = {"images": placer.stats(), "save": save, "memory": probe.stats(), "stages": stages}
+		return result
+
+	except Exception as e:
+		return {"report": "error", "message": f"PDF processing failed: {e}", "code": "ATKPDF-04"}
+	finally:
+		if doc: doc.close()
+
+
+# ----------------------------- Admission Control -----------------------------
+# Fills are admitted against a per-worker budget before they decode their input, so a burst of large PDFs queues
+# instead of pushing the worker past its memory limit. A fill is admitted on an estimate from the sizes of its
+# inputs (atkAdmissionEstimate) and, once the template is parsed and the images are fetched, its estimate is
+# corrected from the template size, its page count and the image bytes (atkAdmissionCost); both are fitted to
+# peak RSS and render time measurements. Admitted costs are held until the render returns. A fill is admitted
+# while the admitted memory stays within ATKPDF_ADMIT_MEMORY_MB (default 512) and the admitted CPU estimate within
+# ATKPDF_ADMIT_CPU_MS (default 2000 per engine process; 0 disables either budget). Admission is first come first
+# served, and a fill is always admitted when nothing else is in flight. HTTP requests wait at most
+# ATKPDF_ADMIT_WAIT_MS (default 10000) behind at most ATKPDF_ADMIT_QUEUE others and are otherwise rejected with
+# ATKPDF-15 (429 with Retry-After). A worker never sees more requests than its gunicorn --threads, so the queue
+# defaults to half of them (at least 1), which leaves the limit reachable; background jobs and direct calls wait
+# for their turn.
+
+ATK_ADMIT_BASE_BYTES = 2 * 1024 * 1024
+ATK_ADMIT_PAGE_BYTES = 100 * 1024
+ATK_ADMIT_IMAGE_FACTOR = 4  # decoded and resampled pixels per compressed image byte
+ATK_ADMIT_PAGE_MS = 1.0
+ATK_ADMIT_PDF_MS_PER_MB = 1.0
+ATK_ADMIT_IMAGE_MS_PER_MB = 135.0
+# before parsing: form templates run about 10KB a page, an image URL is counted as 1MB until it is fetched
+ATK_ADMIT_PDF_BYTES_PER_PAGE = 10 * 1024
+ATK_ADMIT_URL_IMAGE_BYTES = 1024 * 1024
+
+
+def _atkAdmissionCost(pdf_size: int, page_count: int, image_size: int, records: int, output_copies: int,
+		input_copies: int = 0) -> Tuple[int, float]:
+	memory = (ATK_ADMIT_BASE_BYTES + pdf_size * (1 + input_copies + output_copies) + ATK_ADMIT_PAGE_BYTES * page_count
+		+ ATK_ADMIT_IMAGE_FACTOR * image_size)
+	cpu_ms = records * (ATK_ADMIT_PAGE_MS * page_count + ATK_ADMIT_PDF_MS_PER_MB * pdf_size / 1048576.0
+		+ ATK_ADMIT_IMAGE_MS_PER_MB * image_size / 1048576.0)
+	return int(memory), cpu_ms
+
+
+def _atkSourceSize(src: Any) -> int:
+	"""Bytes a pdf or image source decodes to, without decoding it."""
+	if isinstance(src, (bytes, bytearray, memoryview)):
+		return len(src)
+	if isinstance(src, AtkSpooledFile):
+		return src.size
+	if isinstance(src, str):
+		src = src.strip()
+		if src.startswith('http') or src.startswith('www.'):
+			return ATK_ADMIT_URL_IMAGE_BYTES
+		return len(src) * 3 // 4
+	return 0
+
+
+def _atkImageSize(image_items: Dict[Any, Any]) -> int:
+	# items sharing one source (batch records) share its bytes
+	sources = (pxJson(cfg, 'source') or pxJson(cfg, 'data') or pxJson(cfg, 'url') for cfg in (image_items or {}).values())
+	return sum(_atkSourceSize(src) for src in {id(src): src for src in sources if src}.values())
+
+
+def atkAdmissionEstimate(pdf_input: Any, template_id: Any, image_items: Dict[Any, Any], records: int = 1,
+		output_copies: int = 0) -> Tuple[int, float]:
+	"""Estimated (peak memory bytes, CPU ms) of a fill from the sizes of its raw inputs, before anything is decoded.
+	A base64 pdf is held twice while it is decoded."""
+	if pdf_input:
+		pdf_size = _atkSourceSize(pdf_input)
+	else:
+		paths = _atkTemplatePaths(str(template_id or ''))
+		try:
+			pdf_size = os.path.getsize(paths[0]) if paths else 0
+		except OSError:
+			pdf_size = 0
+	return _atkAdmissionCost(pdf_size, pdf_size // ATK_ADMIT_PDF_BYTES_PER_PAGE + 1, _atkImageSize(image_items), records,
+		output_copies, 1 if isinstance(pdf_input, str) else 0)
+
+
+def atkAdmissionCost(template: AtkTemplate, image_items: Dict[Any, Any], records: int = 1,
+		output_copies: int = 0) -> Tuple[int, float]:
+	"""Estimated (peak memory bytes, CPU ms) of rendering records fills of template with the resolved image_items.
+	output_copies is how many rendered PDFs are held in memory until the response (batch json output)."""
+	if template.pdf_bytes is not None:
+		pdf_size = len(template.pdf_bytes)
+	else:
+		try:
+			pdf_size = os.path.getsize(template.path)
+		except (OSError, TypeError):
+			pdf_size = 0
+	return _atkAdmissionCost(pdf_size, template.page_count, _atkImageSize(image_items), records, output_copies)
+
+
+class AtkAdmissionRejected(Exception):
+	"""Raised by AtkAdmission.admit when a request cannot be admitted; retry_after is in seconds."""
+
+	def __init__(self, reason: str, retry_after: int):
+		super().__init__(reason)
+		self.reason = reason
+		self.retry_after = retry_after
+
+	def error(self) -> Dict[str, Any]:
+		return {"report": "error", "message": "Server is busy, retry later.", "code": "ATKPDF-15", "retryAfter": self.retry_after}
+
+
+class AtkAdmission:
+	"""FIFO admission of estimated (memory, CPU) costs against per-process budgets."""
+
+	def __init__(self, memory_bytes: int, cpu_ms: float, max_queue: int, wait_ms: int, parallelism: int = 1):
+		self.memory_bytes = max(0, memory_bytes)
+		self.cpu_ms = max(0, cpu_ms)
+		self.max_queue = max(0, max_queue)
+		self.wait = max(0, wait_ms) / 1000.0
+		self.parallelism = max(1, parallelism)
+		self.admitted = 0
+		self.queued = 0
+		self.rejected = 0
+		self.timed_out = 0
+		self._memory = 0
+		self._cpu = 0.0
+		self._running = 0
+		self._waiting: list = []  # [memory, cpu_ms] of queued requests, oldest first
+		self._cond = threading.Condition()
+
+	def _fits(self, memory: int, cpu_ms: float) -> bool:
+		if not self._running:
+			return True
+		if self.memory_bytes and self._memory + memory > self.memory_bytes:
+			return False
+		return not self.cpu_ms or self._cpu + cpu_ms <= self.cpu_ms
+
+	def admit(self, memory: int, cpu_ms: float, bounded: Optional[bool] = None):
+		"""Context manager holding (memory, cpu_ms) of the budgets while the block runs. bounded (default: inside
+		an HTTP request) applies the queue limit and wait deadline; AtkAdmissionRejected is raised past them."""
+		if bounded is None:
+			bounded = has_request_context()
+		start = time.perf_counter()
+		cost = [memory, cpu_ms]
+		with self._cond:
+			if self._waiting or not self._fits(memory, cpu_ms):
+				if bounded and len(self._waiting) >= self.max_queue:
+					self.rejected += 1
+					atkMetrics.inc('atkpdf_admission_rejected_total', reason='queue_full')
+					raise AtkAdmissionRejected('queue_full', self._retry_after_locked())
+				self.queued += 1
+				self._waiting.append(cost)
+				atkMetrics.inc('atkpdf_admission_waiting', 1)
+				deadline = start + self.wait
 				try:
-					images = json.loads(images_raw)
-					if isinstance(images, dict):
-						result['images'] = images
-				except Exception:
-					pass
-			readonly = request.form.get('readonly')
-			flatten = request.form.get('flatten')
-			form = {}
-			if readonly is not None:
-				form['readonly'] = str(readonly).lower() in ['1', 'true', 'on', 'yes']
-			if flatten is not None:
-				form['flatten'] = str(flatten).lower() in ['1', 'true', 'on', 'yes']
-			if form:
-				result['form'] = form
-		elif 'application/json' in ct:
-			payload = request.get_json(silent=True) or {}
-			if isinstance(payload, dict):
-				result = payload
+					while self._waiting[0] is not cost or not self._fits(memory, cpu_ms):
+						left = deadline - time.perf_counter()
+						if bounded and left <= 0:
+							self.rejected += 1
+							self.timed_out += 1
+							atkMetrics.inc('atkpdf_admission_rejected_total', reason='timeout')
+							raise AtkAdmissionRejected('timeout', self._retry_after_locked())
+						self._cond.wait(left if bounded else None)
+				finally:
+					self._waiting.remove(cost)
+					atkMetrics.inc('atkpdf_admission_waiting', -1)
+					# the next in line may fit now, or may have been waiting on this one's place
+					self._cond.notify_all()
+			self._memory += memory
+			self._cpu += cpu_ms
+			self._running += 1
+			self.admitted += 1
+		waited = time.perf_counter() - start
+		atkMetrics.observe('atkpdf_admission_wait_seconds', waited)
+		atkMetrics.stage('queue', waited)
+		atkMetrics.inc('atkpdf_admission_memory_bytes', memory)
+		return _AtkAdmitted(self, memory, cpu_ms)
+
+	def _retry_after_locked(self) -> int:
+		"""Seconds until the admitted and queued CPU estimate is worked off (1..60)."""
+		backlog = self._cpu + sum(cost[1] for cost in self._waiting)
+		return max(1, min(60, int(backlog / self.parallelism / 1000.0 + 0.999)))
+
+	def adjust(self, memory: int, cpu_ms: float) -> None:
+		with self._cond:
+			self._memory += memory
+			self._cpu += cpu_ms
+			self._cond.notify_all()
+		atkMetrics.inc('atkpdf_admission_memory_bytes', memory)
+
+	def release(self, memory: int, cpu_ms: float) -> None:
+		with self._cond:
+			self._memory -= memory
+			self._cpu -= cpu_ms
+			self._running -= 1
+			self._cond.notify_all()
+		atkMetrics.inc('atkpdf_admission_memory_bytes', -memory)
+
+	def stats(self) -> Dict[str, Any]:
+		with self._cond:
+			return {
+				"memoryBudget": self.memory_bytes,
+				"cpuBudgetMs": self.cpu_ms,
+				"maxQueue": self.max_queue,
+				"waitMs": int(self.wait * 1000),
+				"running": self._running,
+				"waiting": len(self._waiting),
+				"memory": self._memory,
+				"cpuMs": round(self._cpu, 1),
+				"admitted": self.admitted,
+				"queued": self.queued,
+				"rejected": self.rejected,
+				"timedOut": self.timed_out,
+			}
+
+
+class _AtkAdmitted:
+	"""Held budget of one admitted fill; released on exit."""
+
+	def __init__(self, admission: AtkAdmission, memory: int, cpu_ms: float):
+		self.admission = admission
+		self.memory = memory
+		self.cpu_ms = cpu_ms
+
+	def adjust(self, memory: int, cpu_ms: float) -> None:
+		"""Replace the admitted estimate with a better one; the fill stays admitted even if it grew."""
+		self.admission.adjust(memory - self.memory, cpu_ms - self.cpu_ms)
+		self.memory = memory
+		self.cpu_ms = cpu_ms
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc) -> None:
+		self.admission.release(self.memory, self.cpu_ms)
+
+
+atkAdmission = AtkAdmission(pxEnvInt('ATKPDF_ADMIT_MEMORY_MB', 512) * 1024 * 1024,
+	pxEnvInt('ATKPDF_ADMIT_CPU_MS', 2000 * max(1, pxEnvInt('ATKPDF_ENGINE_PROCESSES', 0))),
+	pxEnvInt('ATKPDF_ADMIT_QUEUE', max(1, pxServerThreads() // 2)), pxEnvInt('ATKPDF_ADMIT_WAIT_MS', 10000),
+	pxEnvInt('ATKPDF_ENGINE_PROCESSES', 0))
+
+
+# ----------------------------- Render Engine -----------------------------
+# The fitz part of a fill (open, widget updates, image insertion, tobytes) is CPU bound and holds the GIL.
+# With ATKPDF_ENGINE_PROCESSES > 0 it runs in a pool of long-lived worker processes that keep fitz imported
+# and their own warm template cache; request threads only resolve inputs (template, prefetched images) and wait.
+# ATKPDF_ENGINE_MAX_TASKS recycles the workers after about that many renders each (0 = never).
+# Engine processes write no metrics snapshot: the stage timings and any other metrics of a render travel back
+# with its result and are added to the worker's metrics, so /metrics covers them.
+
+def _atkEngineInit() -> None:
+	import importlib
+	importlib.import_module('fitz')  # warm import
+	atkMetrics.forward = True
+
+
+def _atkEngineTask(task: Dict[str, Any]):
+	"""Worker side of AtkRenderEngine: resolve the template from the local cache and render."""
+	try:
+		tpl = atkTemplateCache.get(task["key"])
+		if tpl is None:
+			if task.get("pdf") is not None:
+				tpl = _atkParseTemplate(task["key"], task["pdf"])
+				atkTemplateCache.put(tpl)
+			elif task.get("path"):
+				tpl = _atkParseTemplate(task["key"], path=task["path"])
+			else:
+				loaded = atkLoadRegisteredTemplate(task["key"])
+				if not loaded:
+					return {"report": "error", "message": f"Template '{task['key']}' not found.", "code": "ATKPDF-07"}
+				tpl = loaded[0]
+		res = atkRenderTemplate(tpl, task["data"], task["images"], task["readonly"], task["flatten"],
+			optimize=task["optimize"], out_path=task["out"])
+		for stage, seconds in (res.get('stats') or {}).get('stages', {}).items():
+			atkMetrics.stage(stage, seconds)
+	except Exception as e:
+		res = {"report": "error", "message": f"PDF processing failed: {e}", "code": "ATKPDF-04"}
+	res["metrics"] = atkMetrics.drain()
+	return res
+
+
+class AtkRenderEngine:
+	"""Runs atkRenderTemplate inline or on a process pool; submit() always returns a Future."""
+
+	def __init__(self, processes: int, max_tasks: int = 0):
+		self.processes = max(0, processes)
+		self.max_tasks = max(0, max_tasks)
+		self.submitted = 0
+		self.failed = 0
+		self.restarts = 0
+		self._pool = None
+		self._pool_pid = None
+		self._pool_tasks = 0
+		self._lock = threading.Lock()
+
+	def _get_pool(self):
+		with self._lock:
+			# max_tasks_per_child of ProcessPoolExecutor can deadlock on Python 3.11, so recycling is done
+			# per pool generation: after processes * max_tasks renders new work goes to a fresh pool while
+			# the old one finishes what it has and exits
+			if self._pool is not None and self.max_tasks and self._pool_tasks >= self.processes * self.max_tasks:
+				self._pool.shutdown(wait=False)
+				self._pool = None
+			# a forked gunicorn worker must not reuse its parent's pool
+			if self._pool is None or self._pool_pid != os.getpid():
+				import multiprocessing
+				from concurrent.futures import ProcessPoolExecutor
+				self._pool = ProcessPoolExecutor(
+					max_workers=self.processes,
+					mp_context=multiprocessing.get_context('spawn'),
+					initializer=_atkEngineInit,
+				)
+				self._pool_pid = os.getpid()
+				self._pool_tasks = 0
+			self._pool_tasks += 1
+			return self._pool
+
+	def _reset_pool(self, pool) -> None:
+		with self._lock:
+			if self._pool is pool:
+				self._pool = None
+				self.restarts += 1
+		pool.shutdown(wait=False, cancel_futures=True)
+
+	def submit(self, template: AtkTemplate, field_values: Dict[str, Any], image_items: Dict[str, Any],
+			form_readonly: bool = False, form_flatten: bool = False, optimize: str = 'fast', out_path: Optional[str] = None,
+			inline: bool = False):
+		"""Queue one render; image_items should already be resolved by atkPrefetchImages.
+		With out_path the worker writes the PDF to that file and only its size comes back.
+		inline renders in the calling thread even with a process pool (used for profiling)."""
+		from concurrent.futures import Future
+		self.submitted += 1
+		if not self.processes or inline:
+			fut = Future()
+			fut.set_result(atkRenderTemplate(template, field_values, image_items, form_readonly, form_flatten,
+				optimize=optimize, out_path=out_path))
+			return fut
+		# registered and spooled templates are read by the worker from disk; other uploads travel with the task
+		paths = _atkTemplatePaths(template.key)
+		registered = paths and os.path.exists(paths[0])
+		task = {
+			"key": template.key,
+			"pdf": None if registered or template.path else template.pdf_bytes,
+			"path": None if registered else template.path,
+			"out": out_path,
+			"data": field_values,
+			"images": atkPrefetchImages(image_items),
+			"readonly": form_readonly,
+			"flatten": form_flatten,
+			"optimize": optimize,
+		}
+		pool = self._get_pool()
+		try:
+			return pool.submit(_atkEngineTask, task)
+		except Exception as e:
+			self._reset_pool(pool)
+			fut = Future()
+			fut.set_result({"report": "error", "message": f"PDF processing failed: {e}", "code": "ATKPDF-04"})
+			return fut
+
+	def result(self, fut):
+		"""Wait for a submitted render; a crashed worker becomes an ATKPDF-04 error and a fresh pool."""
+		try:
+			res = fut.result()
+		except Exception as e:
+			pool = self._pool
+			if pool is not None:
+				from concurrent.futures.process import BrokenProcessPool
+				if isinstance(e, BrokenProcessPool):
+					self._reset_pool(pool)
+			res = {"report": "error", "message": f"PDF processing failed: {e}", "code": "ATKPDF-04"}
+		metrics = res.pop('metrics', None)
+		if metrics is not None:
+			# recorded in the engine process; only the request's Server-Timing is left to add
+			atkMetrics.merge(metrics)
+		if res.get('report') != 'success':
+			self.failed += 1
 		else:
-			# Try to read raw body as JSON
-			payload = request.get_json(silent=True) or {}
-			if isinstance(payload, dict):
-				result = payload
-	except Exception:
-		pass
-	return result
-def atkFillPdfFromData(obj):
+			for stage, seconds in res['stats']['stages'].items():
+				(atkMetrics.timing if metrics is not None else atkMetrics.stage)(stage, seconds)
+		return res
+
+	def render(self, *args, **kwargs):
+		return self.result(self.submit(*args, **kwargs))
+
+	def shutdown(self) -> None:
+		with self._lock:
+			pool, self._pool = self._pool, None
+		if pool is not None and self._pool_pid == os.getpid():
+			pool.shutdown(wait=False, cancel_futures=True)
+
+	def stats(self) -> Dict[str, Any]:
+		return {
+			"mode": "process" if self.processes else "inline",
+			"processes": self.processes,
+			"maxTasksPerChild": self.max_tasks,
+			"submitted": self.submitted,
+			"failed": self.failed,
+			"restarts": self.restarts,
+		}
+
+
+atkEngine = AtkRenderEngine(pxEnvInt('ATKPDF_ENGINE_PROCESSES', 0), pxEnvInt('ATKPDF_ENGINE_MAX_TASKS', 0))
+atexit.register(atkEngine.shutdown)
+
+
+def atkFillPdfFromData(obj, inline: bool = False):
     # Mustafa Dogruer : 21.08.2025 
     # fill pdf from data
     # obj = {
     #     "pdf": "<base64|bytes>",
+    #     "template_id": "<sha256>",  # alternative to "pdf": a template registered via POST /api/templates
     #     "data": {
     #         "field1": "value1",  # text/numeric values are written directly to matching form fields
     #         "check1": true,        # checkboxes accept true/false, 1/0, yes/no, on/off, x
@@ -86,7 +3042,8 @@ def atkFillPdfFromData(obj):
     #     },
     #     "form": {
     #         "readonly": true, # if true, the form fields will be readonly
-    #         "flatten": true # if true, the form fields will be flattened
+    #         "flatten": true # if true, the form fields will be flattened (baked into the page content, AcroForm removed);
+    #                         # a list of page numbers (0-based) flattens only those pages (form field flatten_pages=0,2)
     #     },
     #     "images": {                # preferred image map (same structure as per-field), overrides data.* images
     #         "Image9_af_image": {"source": "<url|www.|data-url|base64|bytes>", "keepProportion": true},
@@ -94,6 +3051,12 @@ def atkFillPdfFromData(obj):
     #     },
     #     "return": "base64|bytes",   # For direct output, backward-compatible.
     #
+    #     # OR, to choose the output optimization (any mode):
+    #     "return": {
+    #       "mode": "base64",          # base64 (default), bytes or one of the file modes below
+    #       "optimize": "fast"         # fast (default, ATKPDF_OPTIMIZE) | balanced | compact, see ATK_OPTIMIZE_PROFILES
+    #     },
+    #
     #     # OR, for advanced file saving options:
     #     "return": {
     #       "mode": "file",            # Accepted modes for saving: "file", "save", "path".
@@ -114,54 +3077,56 @@ def atkFillPdfFromData(obj):
     # - source supports: full http(s) URL, bare "www.*" (auto-normalized to https://), data URLs (data:image/*;base64,...),
     #   raw base64 strings, or raw bytes
     # - keepProportion/preserveAspect (bool): controls aspect ratio (default True if not provided)
-    # - maxBytes (int): server-side guard for downloaded images (default 10MB)
-    # - Timeout for URL fetches: 10 seconds (best-effort)
+    # - maxBytes (int): server-side guard for downloaded images (default 10MB), enforced while streaming
+    # - URL fetches use pooled keep-alive connections, a 10 second overall read deadline and must sniff as an image
+    # - All sources are resolved concurrently before the page loop (ATKPDF_IMAGE_CONCURRENCY per request, default 8)
     #
     # Returns:
-    # - { report: "success", pdf: <base64|bytes>, meta: { bytes: <len> } }
+    # - { report: "success", pdf: <base64|bytes>, meta: { bytes: <len>, template: { key: <sha256>, cache: "hit|miss" },
+    #     save: { profile: <optimize profile>, ms: <save time> },
+    #     memory: { rssStart, rssEnd, rssPeak, peakDelta } (see AtkMemoryProbe) } }
+    # - bytes mode streams the PDF from a spooled file and carries the same numbers as X-Atkpdf-Bytes /
+    #   X-Atkpdf-Optimize / X-Atkpdf-Save-Ms / X-Atkpdf-Memory headers; file mode moves the spooled file into place
     # - { report: "success", message: "File saved", path: "/path/to/file.pdf" }
     # - On error: { report: "error", code: "ATKPDF-xx", message: "..." }
     #   Codes: ATKPDF-01 (missing input), ATKPDF-02 (missing fitz), ATKPDF-03 (decode fail),
-    #          ATKPDF-04 (processing fail), ATKPDF-05 (encode fail), ATKPDF-06 (file save fail)
+    #          ATKPDF-04 (processing fail), ATKPDF-05 (encode fail), ATKPDF-06 (file save fail),
+    #          ATKPDF-07 (unknown template_id), ATKPDF-08 (invalid batch records, see atkFillPdfBatch),
+    #          ATKPDF-09 (unknown return.optimize profile), ATKPDF-10..12 (job queue full, unknown job,
+    #          job cancelled; see AtkJobManager), ATKPDF-13/14 (profiling not permitted, unknown profile),
+    #          ATKPDF-15 (server busy, retryAfter seconds; see AtkAdmission)
     #
     # Notes:
+    # - Parsed templates are kept in an in-process LRU keyed by the sha256 of the PDF bytes
+    #   (ATKPDF_TEMPLATE_CACHE_MB, default 256); counters are served by GET /api/stats.
+    # - The fitz work runs inline or, with ATKPDF_ENGINE_PROCESSES > 0, on a worker process pool (AtkRenderEngine),
+    #   once admitted against the worker's memory and CPU budget (AtkAdmission).
     # - Images can be provided either under data.* (legacy) or under images.* (preferred). If both exist, images.* wins.
-	# safe base64 decoder with padding and urlsafe fallback
-    
-	def _decode_b64_bytes(s):
-		if not isinstance(s, str): return None
-		val = s.strip()
-		if val.startswith('data:image'):
-			parts = val.split(',', 1)
-			if len(parts) == 2: val = parts[1]
-		val = ''.join(val.split())
-		pad = len(val) % 4
-		if pad: val += '=' * (4 - pad)
-		try: return base64.b64decode(val)
-		except Exception:
-			try: return base64.urlsafe_b64decode(val)
-			except Exception: return None
-
+    # - pdf and image sources may be raw bytes; base64 is only decoded for string values. Over HTTP, multipart
+    #   uploads (pdf part, images.<field> parts) and raw application/pdf bodies (options in the query string)
+    #   reach this function as bytes, or above ATKPDF_SPOOL_MB as an AtkSpooledFile opened by filename.
 	# --- Input Processing ---
 	obj = obj or {}
 	custom = obj
 	try: # service call fallback
-		if not pxJson(custom, 'pdf'):
+		if not pxJson(custom, 'pdf') and not pxJson(custom, 'template_id'):
 			reqx = pxConvertRequest()
-			if isinstance(reqx, dict) and pxJson(reqx, 'pdf'): custom = reqx
+			if isinstance(reqx, dict) and (pxJson(reqx, 'pdf') or pxJson(reqx, 'template_id')): custom = reqx
 	except Exception: pass
 	
 	pdf_input = pxJson(custom, 'pdf') or pxJson(custom, 'file')
+	template_id = pxJson(custom, 'template_id')
 	field_values = pxJson(custom, 'data') or {}
 	image_items = pxJson(custom, 'images') or {}
 	# form options
 	form_conf = pxJson(custom, 'form') or {}
 	form_readonly = bool(pxJson(form_conf, 'readonly')) if isinstance(form_conf, dict) else False
-	form_flatten = bool(pxJson(form_conf, 'flatten')) if isinstance(form_conf, dict) else False
+	form_flatten = atkFlattenOption(pxJson(form_conf, 'flatten')) if isinstance(form_conf, dict) else False
 	
 	return_config = pxJson(custom, 'return') or 'base64'
 	ret_mode = 'base64'
 	file_save_options = None
+	optimize = atkOptimizeProfile()
 
 	if isinstance(return_config, str):
 		ret_mode = return_config.lower()
@@ -169,210 +3134,50 @@ def atkFillPdfFromData(obj):
 		ret_mode = (return_config.get('mode') or 'base64').lower()
 		if ret_mode in ['file', 'pdf', 'path', 'save']:
 			file_save_options = return_config
+		optimize = atkOptimizeProfile(return_config.get('optimize'))
+		if optimize is None:
+			return {"report": "error", "message": f"Unknown optimize profile '{return_config.get('optimize')}'.", "code": "ATKPDF-09"}
 
 	# Backward compatibility: find images in `data` if not in `images`
-	if isinstance(field_values, dict):
-		for k, v in field_values.items():
-			if k not in image_items and isinstance(v, dict) and 'source' in v:
-				image_items[k] = v
+	image_items = atkImageItems(field_values, image_items)
 
-	if not pdf_input:
-		return {"report": "error", "message": "PDF 'pdf' or 'file' key required.", "code": "ATKPDF-01"}
+	if not pdf_input and not template_id:
+		return {"report": "error", "message": "PDF 'pdf', 'file' or 'template_id' key required.", "code": "ATKPDF-01"}
 
-	# --- Library Import ---
-	try:
-		import fitz # PyMuPDF
-	except ImportError:
+	# --- Library Check ---
+	if not pxHasModule('fitz'):
 		return {"report": "error", "message": "PyMuPDF (fitz) is required. Please install it.", "code": "ATKPDF-02"}
 	
-	# --- PDF Decoding ---
-	pdf_bytes = None
-	try:
-		if isinstance(pdf_input, str):
-			pdf_bytes = _decode_b64_bytes(pdf_input)
-		elif isinstance(pdf_input, (bytes, bytearray)):
-			pdf_bytes = bytes(pdf_input)
-		if not pdf_bytes: raise ValueError("PDF input could not be decoded to bytes.")
-	except Exception as e:
-		return {"report": "error", "message": f"PDF decoding failed: {e}", "code": "ATKPDF-03"}
-
 	# --- Core PDF Processing with Fitz ---
-	doc = None
+	# admitted on the raw input sizes before anything is decoded, then on the parsed template and fetched images
 	try:
-		doc = fitz.open(stream=pdf_bytes, filetype="pdf")
-		
-		# Process all pages for widgets (form fields)
-		processed_images = set()  # Track which images have been placed
-		for page_num, page in enumerate(doc):
-			# collect widgets to optionally flatten after processing
-			_page_widgets = list(page.widgets()) or []
-			for widget in _page_widgets:
-				field_name = widget.field_name
-
-				# 1. Form Field Filling
-				if field_name in field_values:
-					try:
-						value = field_values[field_name]
-						if widget.field_type == fitz.PDF_WIDGET_TYPE_CHECKBOX:
-							# Handle boolean-like values for checkboxes
-							if str(value).lower() in ['true', '1', 'yes', 'on', 'x']:
-								widget.field_value = True
-							else:
-								widget.field_value = False
-						elif widget.field_type != fitz.PDF_WIDGET_TYPE_BUTTON:
-							widget.field_value = str(value)
-						widget.update()
-					except Exception as e:
-						return {'report':'error','message':'PDF processing failed','code':'ATKPDF-04'}
-
-				# 1.1 Readonly handling (if requested)
-				if form_readonly:
-					try:
-						# common patterns across fitz versions
-						if hasattr(widget, 'set_readonly') and callable(getattr(widget, 'set_readonly')):
-							widget.set_readonly(True)
-						else:
-							ff = getattr(widget, 'field_flags', None)
-							if isinstance(ff, int):
-								try:
-									widget.field_flags = ff | 1
-								except Exception:
-									pass
-						widget.update()
-					except Exception:
-						pass
-
-				# 2. Image Placement on existing fields
-				if field_name in image_items and field_name not in processed_images:
-					try:
-						cfg = image_items[field_name]
-						src = pxJson(cfg, 'source') or pxJson(cfg, 'data') or pxJson(cfg, 'url')
-						if not src: 
-							continue
-
-						img_bytes = None
-						if isinstance(src, (bytes, bytearray)):
-							img_bytes = bytes(src)
-						elif isinstance(src, str):
-							src_clean = src.strip()
-							# normalize bare www.* to https://
-							if src_clean.startswith('www.'):
-								src_clean = 'https://' + src_clean
-							if src_clean.startswith('http'):
-								try:
-									import requests
-									max_bytes = int(pxJson(cfg, 'maxBytes') or 10485760)
-									resp = requests.get(src_clean, timeout=10)
-									if resp.ok and len(resp.content) <= max_bytes:
-										img_bytes = resp.content
-								except Exception:
-									img_bytes = None
-							else: # Assume base64 or data-url
-								img_bytes = _decode_b64_bytes(src_clean)
-								if not img_bytes and len(src_clean) > 10:
-									try:
-										mb = len(src_clean) % 4
-										img_bytes = base64.b64decode(src_clean + ('=' * (4 - mb) if mb else ''))
-									except Exception:
-										img_bytes = None
-						
-						if img_bytes:
-							# Use the widget's rectangle for perfect placement
-							rect = widget.rect
-							preserve = pxJson(cfg, 'preserveAspect')
-							if preserve is None:
-								preserve = pxJson(cfg, 'keepProportion')
-							keep_prop = True if preserve is None else bool(preserve)
-							try:
-								page.insert_image(rect, stream=img_bytes, keep_proportion=keep_prop, overlay=True)
-								processed_images.add(field_name)  # Mark as processed
-							except Exception:
-								pass
-					except Exception:
-						pass
-
-			# 3. Process images that don't match any existing fields (place at coordinates or anchor)
-			for field_name, cfg in image_items.items():
-				# Skip if already processed above or in previous pages
-				if field_name in processed_images:
-					continue
-				if any(w.field_name == field_name for w in _page_widgets):
-					continue
-				try:
-					src = pxJson(cfg, 'source') or pxJson(cfg, 'data') or pxJson(cfg, 'url')
-					if not src: 
-						continue
-					img_bytes = None
-					if isinstance(src, (bytes, bytearray)):
-						img_bytes = bytes(src)
-					elif isinstance(src, str):
-						src_clean = src.strip()
-						if src_clean.startswith('www.'):
-							src_clean = 'https://' + src_clean
-						if src_clean.startswith('http'):
-							try:
-								import requests
-								max_bytes = int(pxJson(cfg, 'maxBytes') or 10485760)
-								resp = requests.get(src_clean, timeout=10)
-								if resp.ok and len(resp.content) <= max_bytes:
-									img_bytes = resp.content
-							except Exception:
-								img_bytes = None
-						else:
-							img_bytes = _decode_b64_bytes(src_clean)
-							if not img_bytes and len(src_clean) > 10:
-								try:
-									mb = len(src_clean) % 4
-									img_bytes = base64.b64decode(src_clean + ('=' * (4 - mb) if mb else ''))
-								except Exception:
-									img_bytes = None
-					if img_bytes:
-						anchor_name = pxJson(cfg, 'anchor')
-						anchor_rect = None
-						if anchor_name:
-							for w in _page_widgets:
-								if getattr(w, 'field_name', None) == anchor_name:
-									anchor_rect = getattr(w, 'rect', None)
-									break
-						fit_to_anchor = bool(pxJson(cfg, 'fitToAnchor'))
-						if anchor_rect and fit_to_anchor:
-							rect = anchor_rect
-						else:
-							x = pxJson(cfg, 'x') or (float(anchor_rect.x0) if anchor_rect else 50)
-							y = pxJson(cfg, 'y') or (float(anchor_rect.y0) if anchor_rect else 50)
-							width = pxJson(cfg, 'width') or (float(anchor_rect.width) if anchor_rect else 100)
-							height = pxJson(cfg, 'height') or (float(anchor_rect.height) if anchor_rect else 100)
-							rect = fitz.Rect(x, y, x + width, y + height)
-						preserve = pxJson(cfg, 'preserveAspect')
-						if preserve is None:
-							preserve = pxJson(cfg, 'keepProportion')
-						keep_prop = True if preserve is None else bool(preserve)
-						try:
-							page.insert_image(rect, stream=img_bytes, keep_proportion=keep_prop, overlay=True)
-							processed_images.add(field_name)  # Mark as processed
-						except Exception:
-							pass
-				except Exception:
-					pass
-
-			# 4. Flatten widgets on this page if requested (remove interactivity)
-			if form_flatten and _page_widgets:
-				for _w in _page_widgets:
-					try:
-						_w.delete()
-					except Exception:
-						pass
-
-		# Save the modified PDF to bytes
-		out_bytes = doc.tobytes()
-
-	except Exception as e:
-		return {"report": "error", "message": f"PDF processing failed: {e}", "code": "ATKPDF-04"}
-	finally:
-		if doc: doc.close()
+		admitted = atkAdmission.admit(*atkAdmissionEstimate(pdf_input, template_id, image_items))
+	except AtkAdmissionRejected as e:
+		return e.error()
+	with admitted:
+		resolved = atkResolveTemplate(pdf_input, template_id)
+		if isinstance(resolved, dict):
+			return resolved
+		template, cache_hit = resolved
+		# resolve all image sources concurrently; the page loop only consumes bytes
+		image_items = atkPrefetchImages(image_items)
+		admitted.adjust(*atkAdmissionCost(template, image_items))
+		# file and bytes modes get the output as a spooled file that is moved or streamed, never held in memory
+		out_path = pxSpoolPath() if file_save_options or ret_mode == 'bytes' else None
+		rendered = atkEngine.render(template, field_values, image_items, form_readonly, form_flatten, optimize, out_path, inline)
+	if rendered.get('report') != 'success':
+		pxRemoveQuiet(out_path)
+		return rendered
+	out_bytes = rendered.get('pdf')
 
 	# --- Return Result ---
-	meta_base = {"bytes": len(out_bytes)}
+	meta_base = {"bytes": rendered['bytes'] if out_path else len(out_bytes),
+		"template": {"key": template.key, "cache": "hit" if cache_hit else "miss"}}
+	if rendered['stats']['images']['placed']:
+		meta_base["images"] = rendered['stats']['images']
+	meta_base["save"] = rendered['stats']['save']
+	if rendered['stats']['memory']:
+		meta_base["memory"] = rendered['stats']['memory']
 	from pathlib import Path
 	if file_save_options:
 		try:
@@ -398,17 +3203,26 @@ def atkFillPdfFromData(obj):
 					counter += 1
 					final_path = directory / f"{base}({counter}){ext}"
 			
-			final_path.write_bytes(out_bytes)
+			import shutil
+			shutil.move(out_path, str(final_path))
 			try:
 				abs_path = str(final_path.resolve())
 			except Exception:
 				abs_path = str(final_path)
-			return {"report": "success", "message": "File saved successfully", "path": abs_path}
+			return {"report": "success", "message": "File saved successfully", "path": abs_path, "meta": meta_base}
 		except Exception as e:
+			pxRemoveQuiet(out_path)
 			return {"report": "error", "message": f"Failed to save file: {e}", "code": "ATKPDF-06"}
 
 	elif ret_mode == 'bytes':
-		return Response(out_bytes, mimetype='application/pdf')
+		headers = {
+			"X-Atkpdf-Bytes": str(meta_base["bytes"]),
+			"X-Atkpdf-Optimize": meta_base["save"]["profile"],
+			"X-Atkpdf-Save-Ms": str(meta_base["save"]["ms"]),
+		}
+		if "memory" in meta_base:
+			headers["X-Atkpdf-Memory"] = json.dumps(meta_base["memory"])
+		return pxStreamFile(out_path, 'application/pdf', headers=headers, remove=True)
 	else: # base64
 		try:
 			# Ensure we are encoding bytes
@@ -416,14 +3230,765 @@ def atkFillPdfFromData(obj):
 			if isinstance(pdf_bytes, str):
 				pdf_bytes = out_bytes.encode('latin-1')
 			
-			b64 = base64.b64encode(pdf_bytes).decode('ascii')
+			with atkMetrics.time('encode'):
+				b64 = base64.b64encode(pdf_bytes).decode('ascii')
 			return {"report": "success", "message": "PDF processed successfully", "code": "200", "pdf": b64, "meta": meta_base}
 		except Exception as e:
 			return {"report": "error", "message": f"Base64 encoding failed: {e}", "code": "ATKPDF-05"}
 
 
+class _AtkDeferredPlacer:
+	"""Collects image placements as (page number, rect, bytes, keep_proportion) instead of inserting them."""
+
+	def __init__(self):
+		self.items = []
+
+	def place(self, page, rect, img_bytes: bytes, keep_proportion: bool = True) -> None:
+		self.items.append((page.number, rect, img_bytes, keep_proportion))
+
+
+def _atkEmptyPdf() -> bytes:
+	"""A valid PDF without pages (fitz refuses to save one), to be opened from a file and saved incrementally."""
+	objects = [b'<</Type/Catalog/Pages 2 0 R>>', b'<</Type/Pages/Kids[]/Count 0>>']
+	out = bytearray(b'%PDF-1.7\n')
+	offsets = []
+	for num, body in enumerate(objects, 1):
+		offsets.append(len(out))
+		out += b'%d 0 obj\n%s\nendobj\n' % (num, body)
+	xref = len(out)
+	out += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+	out += b''.join(b'%010d 00000 n \n' % offset for offset in offsets)
+	out += b'trailer\n<</Size %d/Root 1 0 R>>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref)
+	return bytes(out)
+
+
+def _atkCopyObject(src, dst, num: int, mapping: Dict[int, int], shared) -> int:
+	"""Number in dst of object num of src, copying it and what it references. shared(num) gives the number in dst
+	of an object that is already there (or None); mapping holds the objects copied so far."""
+	import fitz
+	mu = fitz.mupdf
+	if num in mapping:
+		return mapping[num]
+	found = shared(num)
+	if found:
+		mapping[num] = found
+		return found
+	new = mapping[num] = dst.get_new_xref()
+	text = re.sub(r'\b(\d+) 0 R\b', lambda m: '%d 0 R' % _atkCopyObject(src, dst, int(m.group(1)), mapping, shared),
+		src.xref_object(num, compressed=True))
+	dst.update_object(new, text)
+	if src.xref_is_stream(num):
+		# raw, so the stream keeps its /Filter
+		pdf = fitz._as_pdf_document(dst)
+		mu.pdf_update_stream(pdf, mu.pdf_new_indirect(pdf, new, 0), mu.fz_new_buffer_from_copied_data(src.xref_stream_raw(num)), 1)
+	return new
+
+
+def _atkShowOverlay(opage, master, rec, pno: int, content: bytes, base: int) -> None:
+	"""Draw the baked widgets of page pno of rec (content shows them as Form XObjects) on opage.
+
+	Grafting rec's page would copy the template resources it shares with every other record. Only the forms and
+	what the fill created are copied; template objects the fill left alone (fonts, checkbox appearances) go
+	through the graft map of master, so each is stored once in the output."""
+	import fitz
+	mu = fitz.mupdf
+	out = opage.parent
+	gmap = out.Graftmaps.get(master._graft_id)
+	if gmap is None:
+		gmap = out.Graftmaps[master._graft_id] = fitz.Graftmap(out)
+	mpdf = fitz._as_pdf_document(master)
+
+	def shared(num: int) -> Optional[int]:
+		if num >= base or rec.xref_object(num, compressed=True) != master.xref_object(num, compressed=True):
+			return None
+		if rec.xref_is_stream(num) and rec.xref_stream_raw(num) != master.xref_stream_raw(num):
+			return None
+		return mu.pdf_to_num(mu.pdf_graft_mapped_object(gmap.this, mu.pdf_new_indirect(mpdf, num, 0)))
+
+	resources = mu.pdf_dict_get_inheritable(fitz._as_pdf_page(rec[pno]).obj(), mu.pdf_new_name('Resources'))
+	xobjects = mu.pdf_dict_get(resources, mu.pdf_new_name('XObject'))
+	opdf = fitz._as_pdf_document(out)
+	page_obj = fitz._as_pdf_page(opage).obj()
+	out_resources = mu.pdf_dict_get_inheritable(page_obj, mu.pdf_new_name('Resources'))
+	if not out_resources.m_internal:
+		out_resources = mu.pdf_dict_put_dict(page_obj, mu.pdf_new_name('Resources'), 1)
+	out_xobjects = mu.pdf_dict_get(out_resources, mu.pdf_new_name('XObject'))
+	if not out_xobjects.m_internal:
+		out_xobjects = mu.pdf_dict_put_dict(out_resources, mu.pdf_new_name('XObject'), 8)
+	mapping: Dict[int, int] = {}
+	for name in set(re.findall(rb'/([^\s/\[\]()<>{}%]+)\s+Do\b', content)):
+		name = name.decode('latin-1')
+		num = mu.pdf_to_num(mu.pdf_dict_gets(xobjects, name))
+		if num:
+			mu.pdf_dict_puts(out_xobjects, name, mu.pdf_new_indirect(opdf, _atkCopyObject(rec, out, num, mapping, shared), 0))
+	overlay = out.get_new_xref()
+	out.update_object(overlay, '<<>>')
+	out.update_stream(overlay, b'q\n' + content + b'\nQ')
+	out.xref_set_key(opage.xref, 'Contents', '[%s]' % ' '.join('%d 0 R' % x for x in opage.get_contents() + [overlay]))
+
+
+def atkMergeRecords(template: AtkTemplate, jobs, out_path: str, chunk: Optional[int] = None,
+		optimize: str = 'fast', progress=None) -> Tuple[list, Dict[str, Any]]:
+	"""Fill each (index, data, images) job and append it as flattened pages to one PDF at out_path.
+
+	Each output page shows the template page as a single shared Form XObject, so static content, fonts and
+	images of the template are stored once; only the record's baked widgets are added per copy, and the
+	template objects those use (fonts, checkbox appearances) are shared as well (see _atkShowOverlay). Record
+	images are drawn straight onto the output pages through one AtkImagePlacer, so a logo or signature
+	repeated across records is embedded once.
+	The output starts as an empty PDF file and is extended by incremental saves after the first record and then
+	every `chunk` records (ATKPDF_MERGE_CHUNK, default 25), so the one graft map of the template lasts the run.
+	Profiles other than "fast" rewrite the finished file once with the profile's save options, which also
+	folds the incremental sections into one.
+	progress(done, total) is called after each record (see atkFillPdfBatch).
+	Returns (per-record errors, save stats).
+	"""
+	import fitz
+	chunk = chunk or pxEnvInt('ATKPDF_MERGE_CHUNK', 25)
+	errors = []
+	master = template.open()
+	master_shown = [bool(page.get_contents()) and bool(page.read_contents().strip()) for page in master]
+	with open(out_path, 'wb') as f:
+		f.write(_atkEmptyPdf())
+	out = fitz.open(out_path)
+	placer = AtkImagePlacer()
+	written = False
+	pending = 0
+	try:
+		for done, (i, field_values, image_items) in enumerate(jobs, 1):
+			if progress and done > 1:
+				progress(done - 1, len(jobs))
+			rec = None
+			first_page = out.page_count
+			try:
+				rec = template.open()
+				# drop the static content from the copy; it is shown from the shared template XObject
+				blank = rec.get_new_xref()
+				rec.update_object(blank, '<<>>')
+				rec.update_stream(blank, b' ')
+				for page in rec:
+					page.set_contents(blank)
+				deferred = _AtkDeferredPlacer()
+				err = _atkFillDocument(rec, template, field_values, image_items, placer=deferred)
+				if err:
+					errors.append({"index": i, **err})
+					continue
+				rec.bake()
+				for pno, page in enumerate(rec):
+					opage = out.new_page(width=master[pno].rect.width, height=master[pno].rect.height)
+					if master_shown[pno]:
+						opage.show_pdf_page(opage.rect, master, pno)
+					overlay = page.read_contents().strip()
+					if overlay:
+						_atkShowOverlay(opage, master, rec, pno, overlay, template.xref_count)
+				for pno, rect, img_bytes, keep in deferred.items:
+					placer.place(out[first_page + pno], rect, img_bytes, keep)
+			except Exception as e:
+				if out.page_count > first_page:
+					out.delete_pages(from_page=first_page, to_page=out.page_count - 1)
+				errors.append({"index": i, "report": "error", "message": f"PDF processing failed: {e}", "code": "ATKPDF-04"})
+				continue
+			finally:
+				if rec: rec.close()
+			pending += 1
+			if not written or pending >= chunk:
+				written = True
+				out.saveIncr()
+				pending = 0
+		if written and pending:
+			out.saveIncr()
+		start = time.perf_counter()
+		if written and ATK_OPTIMIZE_PROFILES[optimize]:
+			tmp_path = out_path + '.opt'
+			out.save(tmp_path, **ATK_OPTIMIZE_PROFILES[optimize])
+			out.close()
+			os.replace(tmp_path, out_path)
+	finally:
+		if not out.is_closed:
+			out.close()
+		master.close()
+	return errors, {"profile": optimize, "ms": round((time.perf_counter() - start) * 1000, 3)}
+
+
+def atkFillPdfBatch(obj, progress=None):
+	# fill one template with many data records
+	# obj = {
+	#     "pdf": "<base64|bytes>",      # or "template_id": "<sha256>" of a registered template
+	#     "form": { "readonly": true, "flatten": false },   # defaults for every record, a record's own "form" wins
+	#     "images": { ... },            # images shared by every record, a record's own images win
+	#     "records": [
+	#         { "data": { "field1": "value1" }, "images": { ... }, "form": { ... } },
+	#         ...
+	#     ],
+	#     "return": "json|zip|merge"    # json: per-record base64 (default), zip: record-0001.pdf, ...,
+	#                                   # merge: one PDF with a flattened copy of the template per record
+	#     # OR "return": { "mode": "json|zip|merge", "optimize": "fast|balanced|compact" }
+	# }
+	#
+	# The template is parsed once (template cache) and each distinct image source is resolved once per batch,
+	# concurrently, before any record is rendered (atkPrefetchImages).
+	# Merge output is written progressively to a temp file and streamed (see atkMergeRecords).
+	#
+	# Returns:
+	# - json: { report: "success", results: [{ index, report, pdf | code, message }],
+	#     meta: { records, succeeded, failed, bytes, save: { profile, ms (sum over records) } } }
+	# - zip: application/zip Response streamed from a spooled archive; failed records are listed in errors.json inside it
+	# - merge: application/pdf Response; X-Atkpdf-Records / X-Atkpdf-Failed headers list merged and failed records,
+	#   X-Atkpdf-Optimize / X-Atkpdf-Save-Ms report the final rewrite
+	# - On batch-level error: { report: "error", code: "ATKPDF-xx", message: "..." }
+	#   Per-record codes follow atkFillPdfFromData; ATKPDF-08 marks a missing/invalid records list or record.
+	#   ATKPDF-15: the batch was not admitted (see AtkAdmission); it is admitted as a whole, for all records.
+	#
+	# progress(done, total), if given, is called as records complete; it may raise AtkJobCancelled to stop
+	# the batch (see AtkJobManager).
+	obj = obj or {}
+	pdf_input = pxJson(obj, 'pdf') or pxJson(obj, 'file')
+	template_id = pxJson(obj, 'template_id')
+	records = pxJson(obj, 'records')
+	shared_images = pxJson(obj, 'images') or {}
+	form_conf = pxJson(obj, 'form') or {}
+	return_config = pxJson(obj, 'return') or 'json'
+	if isinstance(return_config, dict):
+		ret_mode = str(return_config.get('mode') or 'json').lower()
+		optimize = atkOptimizeProfile(return_config.get('optimize'))
+		if optimize is None:
+			return {"report": "error", "message": f"Unknown optimize profile '{return_config.get('optimize')}'.", "code": "ATKPDF-09"}
+	else:
+		ret_mode = str(return_config).lower()
+		optimize = atkOptimizeProfile()
+
+	if not pdf_input and not template_id:
+		return {"report": "error", "message": "PDF 'pdf', 'file' or 'template_id' key required.", "code": "ATKPDF-01"}
+	max_records = pxEnvInt('ATKPDF_BATCH_MAX_RECORDS', 1000)
+	if not isinstance(records, list) or not records:
+		return {"report": "error", "message": "'records' must be a non-empty list.", "code": "ATKPDF-08"}
+	if len(records) > max_records:
+		return {"report": "error", "message": f"Too many records ({len(records)} > {max_records}).", "code": "ATKPDF-08"}
+
+	if not pxHasModule('fitz'):
+		return {"report": "error", "message": "PyMuPDF (fitz) is required. Please install it.", "code": "ATKPDF-02"}
+
+	results = []
+	jobs = []
+	for i, record in enumerate(records):
+		if not isinstance(record, dict):
+			results.append({"index": i, "report": "error", "message": "Record must be an object.", "code": "ATKPDF-08"})
+			continue
+		field_values = pxJson(record, 'data') or {}
+		image_items = dict(shared_images) if isinstance(shared_images, dict) else {}
+		image_items.update(atkImageItems(field_values, pxJson(record, 'images') or {}))
+		rec_form = dict(form_conf) if isinstance(form_conf, dict) else {}
+		if isinstance(pxJson(record, 'form'), dict):
+			rec_form.update(record['form'])
+		jobs.append((i, field_values, image_items, rec_form))
+
+	all_images = {(i, name): cfg for i, _, image_items, _ in jobs for name, cfg in image_items.items()}
+	# the batch is admitted as a whole and holds its budget until every record is rendered; json output keeps
+	# every record in memory
+	copies = 0 if ret_mode in ('zip', 'merge') else len(jobs)
+	try:
+		admitted = atkAdmission.admit(*atkAdmissionEstimate(pdf_input, template_id, all_images, len(jobs), copies))
+	except AtkAdmissionRejected as e:
+		return e.error()
+	with admitted:
+		resolved = atkResolveTemplate(pdf_input, template_id)
+		if isinstance(resolved, dict):
+			return resolved
+		template, cache_hit = resolved
+
+		# resolve every image of the batch up front; each distinct source is fetched/decoded once
+		prefetched = atkPrefetchImages(all_images)
+		jobs = [(i, field_values, {name: prefetched[(i, name)] for name in image_items if (i, name) in prefetched}, rec_form)
+			for i, field_values, image_items, rec_form in jobs]
+		admitted.adjust(*atkAdmissionCost(template, prefetched, len(jobs), copies))
+
+		if ret_mode == 'merge':
+			out_path = pxSpoolPath('atkmerge-')
+			probe = AtkMemoryProbe()
+			try:
+				with probe, atkMetrics.time('merge'):
+					errors, save = atkMergeRecords(template, [(i, fv, im) for i, fv, im, _ in jobs], out_path,
+						optimize=optimize, progress=progress)
+				errors = results + errors
+			except AtkJobCancelled:
+				pxRemoveQuiet(out_path)
+				raise
+			except Exception as e:
+				pxRemoveQuiet(out_path)
+				return {"report": "error", "message": f"PDF processing failed: {e}", "code": "ATKPDF-04"}
+			merged = len(records) - len(errors)
+			if not merged:
+				pxRemoveQuiet(out_path)
+				return {"report": "error", "message": "No record could be filled.", "code": "ATKPDF-04", "results": errors}
+			headers = {
+				"Content-Disposition": "attachment; filename=merged.pdf",
+				"X-Atkpdf-Records": str(merged),
+				"X-Atkpdf-Failed": json.dumps([{"index": e["index"], "code": e.get("code")} for e in errors]),
+				"X-Atkpdf-Optimize": save["profile"],
+				"X-Atkpdf-Save-Ms": str(save["ms"]),
+			}
+			if probe.stats():
+				headers["X-Atkpdf-Memory"] = json.dumps(probe.stats())
+			return pxStreamFile(out_path, 'application/pdf', remove=True, headers=headers)
+
+		# submit every record first so a process engine renders them in parallel; zip records are written to
+		# spooled files and copied into a spooled archive, so the batch is never held in memory
+		out_paths = {i: pxSpoolPath() for i, _, _, _ in jobs} if ret_mode == 'zip' else {}
+		futures = ((i, atkEngine.submit(template, field_values, image_items,
+			bool(pxJson(rec_form, 'readonly')), atkFlattenOption(pxJson(rec_form, 'flatten')), optimize, out_paths.get(i)))
+			for i, field_values, image_items, rec_form in jobs)
+		if atkEngine.processes:
+			futures = list(futures)
+		# inline renders happen lazily in the loop, so progress and cancellation work per record there too
+		try:
+			image_stats = {}
+			save_seconds = 0.0
+			memory = {}
+			for done, (i, fut) in enumerate(futures, 1):
+				out = atkEngine.result(fut)
+				if out.get('report') == 'success':
+					stats = out.pop('stats')
+					for k, v in stats['images'].items():
+						image_stats[k] = image_stats.get(k, 0) + v
+					save_seconds += stats['save']['ms']
+					if stats['memory']:
+						for k in ('rssPeak', 'peakDelta'):
+							memory[k] = max(memory.get(k, 0), stats['memory'][k])
+				results.append({"index": i, **out})
+				if progress:
+					progress(done, len(jobs))
+			results.sort(key=lambda r: r["index"])
+
+			failed = [r for r in results if r.get('report') != 'success']
+			meta = {
+				"records": len(results),
+				"succeeded": len(results) - len(failed),
+				"failed": len(failed),
+				"bytes": sum(r['bytes'] if 'path' in r else len(r['pdf']) for r in results if r.get('report') == 'success'),
+				"template": {"key": template.key, "cache": "hit" if cache_hit else "miss"},
+				"save": {"profile": optimize, "ms": round(save_seconds, 3)},
+			}
+			if memory:
+				meta["memory"] = memory
+			if image_stats.get('placed'):
+				image_stats['insertMs'] = round(image_stats['insertMs'], 3)
+				meta["images"] = image_stats
+			if ret_mode == 'zip':
+				import zipfile
+				zip_path = pxSpoolPath('atkbatch-', '.zip')
+				try:
+					with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_STORED) as zf:
+						for r in results:
+							if r.get('report') == 'success':
+								zf.write(r['path'], f"record-{r['index'] + 1:04d}.pdf")
+						if failed:
+							zf.writestr('errors.json', json.dumps(failed))
+				except Exception as e:
+					pxRemoveQuiet(zip_path)
+					return {"report": "error", "message": f"Failed to save file: {e}", "code": "ATKPDF-06"}
+				return pxStreamFile(zip_path, 'application/zip', remove=True,
+					headers={"Content-Disposition": "attachment; filename=batch.zip"})
+		except AtkJobCancelled:
+			if isinstance(futures, list):
+				for _, fut in futures:
+					fut.cancel()
+			raise
+		finally:
+			for path in out_paths.values():
+				pxRemoveQuiet(path)
+		with atkMetrics.time('encode'):
+			for r in results:
+				if r.get('report') == 'success':
+					r['pdf'] = base64.b64encode(r['pdf']).decode('ascii')
+		return {"report": "success", "message": "Batch processed", "code": "200", "results": results, "meta": meta}
+
+
+# ----------------------------- Jobs -----------------------------
+# Fills and batches that may run past the gunicorn --timeout go through asynchronous jobs: POST /api/jobs/fill
+# or /api/jobs/batch queues the request and answers 202 with a job id, GET /api/jobs/<id> reports state and
+# progress, GET /api/jobs/<id>/result downloads the output and DELETE /api/jobs/<id> cancels or discards it.
+# Every gunicorn worker runs ATKPDF_JOB_WORKERS threads (default 2) over a queue of at most ATKPDF_JOB_QUEUE
+# jobs (default 100). Job state, inputs and results live in ATKPDF_JOB_DIR (default ./jobs), so any worker
+# can answer for any job; finished jobs are removed ATKPDF_JOB_RETENTION seconds (default 3600) after they end.
+
+class AtkJobCancelled(Exception):
+	"""Raised from a job's progress callback once the job has been cancelled."""
+
+
+class AtkJobManager:
+	"""Bounded in-process job queue with worker threads; job records and results are files in the job dir."""
+
+	def __init__(self, workers: int, max_queue: int, retention: int):
+		self.workers = max(1, workers)
+		self.max_queue = max(1, max_queue)
+		self.retention = max(0, retention)
+		self.submitted = 0
+		self.succeeded = 0
+		self.failed = 0
+		self.cancelled = 0
+		self.rejected = 0
+		self._queue = None
+		self._pid = None
+		self._active: Dict[str, Dict[str, Any]] = {}  # jobs of this process that are queued or running
+		self._swept = 0.0
+		self._lock = threading.Lock()
+
+	def job_dir(self) -> str:
+		return os.environ.get('ATKPDF_JOB_DIR') or os.path.join(os.getcwd(), 'jobs')
+
+	def _paths(self, job_id: str) -> Optional[Dict[str, str]]:
+		jid = str(job_id or '').strip().lower()
+		if len(jid) != 32 or any(c not in '0123456789abcdef' for c in jid):
+			return None
+		base = os.path.join(self.job_dir(), jid)
+		return {"meta": base + '.json', "input": base + '.input.pdf', "result": base + '.result', "cancel": base + '.cancel'}
+
+	def _save(self, job: Dict[str, Any]) -> None:
+		_atkWriteAtomic(self._paths(job["id"])["meta"], json.dumps(job).encode('utf-8'))
+
+	def _load(self, job_id: str) -> Optional[Dict[str, Any]]:
+		paths = self._paths(job_id)
+		if not paths:
+			return None
+		try:
+			with open(paths["meta"], 'rb') as f:
+				return json.loads(f.read().decode('utf-8'))
+		except (OSError, ValueError):
+			return None
+
+	def _get_queue(self):
+		with self._lock:
+			# a forked gunicorn worker starts its own threads
+			if self._queue is None or self._pid != os.getpid():
+				import queue
+				self._queue = queue.Queue(self.max_queue)
+				self._pid = os.getpid()
+				self._active = {}
+				for n in range(self.workers):
+					threading.Thread(target=self._work, name=f'atk-job-{n}', daemon=True).start()
+			return self._queue
+
+	def submit(self, kind: str, obj: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+		"""Queue a 'fill' or 'batch' request; returns the job record, or None when the queue is full."""
+		import queue
+		import uuid
+		q = self._get_queue()
+		os.makedirs(self.job_dir(), exist_ok=True)
+		self.sweep()
+		job_id = uuid.uuid4().hex
+		paths = self._paths(job_id)
+		pdf = pxJson(obj, 'pdf')
+		if isinstance(pdf, AtkSpooledFile):
+			# the job outlives the request, so its spooled upload moves out of the request cleanup
+			import shutil
+			shutil.move(pdf.path, paths["input"])
+			obj['pdf'] = AtkSpooledFile(paths["input"], pdf.key, pdf.size)
+		if kind == 'fill':
+			# the result is always the PDF itself; only the optimize profile of the caller is kept
+			optimize = pxJson(obj.get('return'), 'optimize') if isinstance(obj.get('return'), dict) else None
+			obj['return'] = {'mode': 'bytes', 'optimize': optimize}
+		records = pxJson(obj, 'records')
+		job = {
+			"id": job_id,
+			"kind": kind,
+			"state": "queued",
+			"created": time.time(),
+			"started": None,
+			"finished": None,
+			"progress": {"done": 0, "total": len(records) if kind == 'batch' and isinstance(records, list) else 1},
+			"pid": os.getpid(),
+		}
+		self._save(job)
+		with self._lock:
+			self._active[job_id] = job
+		try:
+			q.put_nowait((job, obj))
+		except queue.Full:
+			with self._lock:
+				self._active.pop(job_id, None)
+				self.rejected += 1
+			for path in paths.values():
+				pxRemoveQuiet(path)
+			return None
+		self.submitted += 1
+		return job
+
+	def _work(self) -> None:
+		while True:
+			job, obj = self._queue.get()
+			try:
+				self._run(job, obj)
+			except Exception:
+				pass
+			finally:
+				with self._lock:
+					self._active.pop(job["id"], None)
+				self._queue.task_done()
+
+	def _run(self, job: Dict[str, Any], obj: Dict[str, Any]) -> None:
+		paths = self._paths(job["id"])
+		cancelled = {"report": "error", "message": "Job cancelled.", "code": "ATKPDF-12"}
+		try:
+			if os.path.exists(paths["cancel"]):
+				raise AtkJobCancelled()
+			job["state"] = "running"
+			job["started"] = time.time()
+			self._save(job)
+			saved = [time.time()]
+
+			def progress(done: int, total: int) -> None:
+				if os.path.exists(paths["cancel"]):
+					raise AtkJobCancelled()
+				job["progress"] = {"done": done, "total": total}
+				# progress is persisted at most twice a second for readers in other workers
+				if time.time() - saved[0] >= 0.5:
+					saved[0] = time.time()
+					self._save(job)
+
+			if job["kind"] == 'batch':
+				res = atkFillPdfBatch(obj, progress)
+			else:
+				res = atkFillPdfFromData(obj)
+			if os.path.exists(paths["cancel"]):
+				if isinstance(res, Response):
+					res.close()
+				raise AtkJobCancelled()
+			self._store(job, res, paths["result"])
+		except AtkJobCancelled:
+			job["state"] = "cancelled"
+			job["error"] = cancelled
+			self.cancelled += 1
+		except Exception as e:
+			job["state"] = "failed"
+			job["error"] = {"report": "error", "message": f"PDF processing failed: {e}", "code": "ATKPDF-04"}
+			self.failed += 1
+		finally:
+			if job.get("error"):
+				atkMetrics.inc('atkpdf_errors_total', code=job["error"].get("code") or 'unknown')
+			pxRemoveQuiet(paths["input"])
+			pxRemoveQuiet(paths["cancel"])
+			if job["state"] == "succeeded":
+				job["progress"]["done"] = job["progress"]["total"]
+			job["finished"] = time.time()
+			self._save(job)
+
+	def _store(self, job: Dict[str, Any], res: Any, result_path: str) -> None:
+		"""Write a fill/batch return value to the result file and record how to serve it."""
+		if isinstance(res, Response):
+			try:
+				with open(result_path, 'wb') as f:
+					for block in res.iter_encoded():
+						f.write(block)
+			finally:
+				res.close()
+			job["result"] = {
+				"mimetype": res.mimetype,
+				"bytes": os.path.getsize(result_path),
+				"headers": {k: v for k, v in res.headers.items() if k.startswith('X-Atkpdf-') or k == 'Content-Disposition'},
+			}
+		elif isinstance(res, dict) and res.get('report') == 'success':
+			body = json.dumps(res).encode('utf-8')
+			_atkWriteAtomic(result_path, body)
+			job["result"] = {"mimetype": "application/json", "bytes": len(body), "headers": {}}
+		else:
+			job["state"] = "failed"
+			job["error"] = res if isinstance(res, dict) else {"report": "error", "message": "PDF processing failed", "code": "ATKPDF-04"}
+			self.failed += 1
+			return
+		job["state"] = "succeeded"
+		self.succeeded += 1
+
+	def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+		"""Current job record; None if unknown or expired."""
+		with self._lock:
+			job = self._active.get(str(job_id).strip().lower()) if self._pid == os.getpid() else None
+		if job is not None:
+			return dict(job)
+		job = self._load(job_id)
+		if job and job["state"] in ("queued", "running") and job["pid"] != os.getpid() and not self._alive(job["pid"]):
+			job["state"] = "failed"
+			job["error"] = {"report": "error", "message": "The worker running the job exited.", "code": "ATKPDF-04"}
+		return job
+
+	@staticmethod
+	def _alive(pid: int) -> bool:
+		try:
+			os.kill(pid, 0)
+			return True
+		except ProcessLookupError:
+			return False
+		except OSError:
+			return True
+
+	def result_path(self, job_id: str) -> Optional[str]:
+		paths = self._paths(job_id)
+		return paths["result"] if paths else None
+
+	def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+		"""Cancel a queued or running job, or discard a finished one with its result. None if unknown."""
+		job = self.status(job_id)
+		if job is None:
+			return None
+		paths = self._paths(job_id)
+		if job["state"] in ("queued", "running"):
+			# the marker is seen by the worker owning the job, whichever process that is
+			_atkWriteAtomic(paths["cancel"], b'')
+			job["cancelRequested"] = True
+		else:
+			for path in paths.values():
+				pxRemoveQuiet(path)
+		return job
+
+	def sweep(self, force: bool = False) -> int:
+		"""Remove jobs that finished more than `retention` seconds ago (at most once a minute); returns the count."""
+		now = time.time()
+		if not force and now - self._swept < 60:
+			return 0
+		self._swept = now
+		removed = 0
+		try:
+			names = [n for n in os.listdir(self.job_dir()) if n.endswith('.json')]
+		except OSError:
+			return 0
+		for name in names:
+			job = self._load(name[:-5])
+			if not job:
+				continue
+			ended = job.get("finished")
+			if ended is None and not self._alive(job.get("pid", 0)):
+				ended = job.get("created")
+			if ended is not None and now - ended > self.retention:
+				for path in self._paths(job["id"]).values():
+					pxRemoveQuiet(path)
+				removed += 1
+		return removed
+
+	def stats(self) -> Dict[str, Any]:
+		with self._lock:
+			active = list(self._active.values()) if self._pid == os.getpid() else []
+		return {
+			"workers": self.workers,
+			"maxQueue": self.max_queue,
+			"retention": self.retention,
+			"queued": sum(1 for j in active if j["state"] == "queued"),
+			"running": sum(1 for j in active if j["state"] == "running"),
+			"submitted": self.submitted,
+			"succeeded": self.succeeded,
+			"failed": self.failed,
+			"cancelled": self.cancelled,
+			"rejected": self.rejected,
+		}
+
+
+atkJobs = AtkJobManager(pxEnvInt('ATKPDF_JOB_WORKERS', 2), pxEnvInt('ATKPDF_JOB_QUEUE', 100), pxEnvInt('ATKPDF_JOB_RETENTION', 3600))
+
+
+def atkJobView(job: Dict[str, Any]) -> Dict[str, Any]:
+	"""Public form of a job record for the API."""
+	view = {k: v for k, v in job.items() if k != 'pid'}
+	if job["state"] == "succeeded":
+		view["resultUrl"] = f"/api/jobs/{job['id']}/result"
+	return {"report": "success", "job": view}
+
+
+# ----------------------------- Profiling -----------------------------
+# A fill request with "profile" set runs under cProfile, in the request thread (the render is forced
+# inline, image downloads still run on their own threads), with its peak memory sampled by AtkMemoryProbe.
+# Only callers sending X-Atkpdf-Admin-Token equal to ATKPDF_ADMIN_TOKEN may profile; without that setting
+# profiling is off. "profile": "return" answers JSON with the PDF and the report; any other true value
+# saves the profile to ATKPDF_PROFILE_DIR (default ./profiles, newest ATKPDF_PROFILE_KEEP kept, default 50),
+# names it in the X-Atkpdf-Profile header and serves it from GET /api/profiles/<id>.
+
+def atkIsAdmin() -> bool:
+	import hmac
+	token = os.environ.get('ATKPDF_ADMIN_TOKEN')
+	given = request.headers.get('X-Atkpdf-Admin-Token') or ''
+	return bool(token) and hmac.compare_digest(given.encode('utf-8'), token.encode('utf-8'))
+
+
+def atkProfileDir() -> str:
+	return os.environ.get('ATKPDF_PROFILE_DIR') or os.path.join(os.getcwd(), 'profiles')
+
+
+def _atkProfilePaths(profile_id: str) -> Optional[Tuple[str, str]]:
+	pid = str(profile_id or '').strip().lower()
+	if len(pid) != 32 or any(c not in '0123456789abcdef' for c in pid):
+		return None
+	base = os.path.join(atkProfileDir(), pid)
+	return base + '.prof', base + '.txt'
+
+
+def atkProfileCall(fn, *args, limit: int = 40, **kwargs):
+	"""Run fn under cProfile and AtkMemoryProbe; returns (result, profiler, report text, memory stats)."""
+	import cProfile
+	import pstats
+	profiler = cProfile.Profile()
+	probe = AtkMemoryProbe()
+	with probe:
+		profiler.enable()
+		try:
+			result = fn(*args, **kwargs)
+		finally:
+			profiler.disable()
+	out = io.StringIO()
+	pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(limit)
+	return result, profiler, out.getvalue(), probe.stats()
+
+
+def atkSaveProfile(profiler, text: str, memory: Optional[Dict[str, Any]]) -> str:
+	"""Store a profile (pstats dump plus text report) and return its id; prunes beyond ATKPDF_PROFILE_KEEP."""
+	import uuid
+	os.makedirs(atkProfileDir(), exist_ok=True)
+	profile_id = uuid.uuid4().hex
+	prof_path, txt_path = _atkProfilePaths(profile_id)
+	profiler.dump_stats(prof_path)
+	header = f"peak memory: {json.dumps(memory)}\n\n" if memory else ''
+	_atkWriteAtomic(txt_path, (header + text).encode('utf-8'))
+	keep = max(1, pxEnvInt('ATKPDF_PROFILE_KEEP', 50))
+	dumps = sorted((os.path.getmtime(os.path.join(atkProfileDir(), n)), n) for n in os.listdir(atkProfileDir()) if n.endswith('.prof'))
+	for _, name in dumps[:-keep]:
+		for path in _atkProfilePaths(name[:-5]) or ():
+			pxRemoveQuiet(path)
+	return profile_id
+
+
 # ----------------------------- Flask Endpoints -----------------------------
 
+@app.before_request
+def _atkRequestStart():
+	g.atk_started = time.perf_counter()
+	if request.endpoint != 'metrics':
+		g.atk_inflight = True
+		atkMetrics.inc('atkpdf_inflight_requests', 1)
+
+
+@app.after_request
+def _atkRequestMetrics(response):
+	endpoint = request.endpoint or 'unknown'
+	if endpoint != 'metrics':
+		atkMetrics.inc('atkpdf_requests_total', endpoint=endpoint, status=response.status_code)
+		atkMetrics.observe('atkpdf_request_seconds', time.perf_counter() - g.get('atk_started', time.perf_counter()), endpoint=endpoint)
+		atkMetrics.inc('atkpdf_bytes_in_total', request.content_length or 0, endpoint=endpoint)
+		atkMetrics.inc('atkpdf_bytes_out_total', response.content_length or 0, endpoint=endpoint)
+		if response.status_code >= 400 and response.is_json:
+			code = (response.get_json(silent=True) or {}).get('code')
+			atkMetrics.inc('atkpdf_errors_total', code=code or 'unknown')
+	stages = g.get('atk_stages')
+	if stages:
+		total = time.perf_counter() - g.get('atk_started', time.perf_counter())
+		response.headers['Server-Timing'] = ', '.join(
+			['%s;dur=%.3f' % (stage, seconds * 1000) for stage, seconds in stages.items()] + ['total;dur=%.3f' % (total * 1000)])
+	return response
+
+
+@app.teardown_request
+def _atkRemoveSpooled(exc=None):
+	if g.pop('atk_inflight', False):
+		atkMetrics.inc('atkpdf_inflight_requests', -1)
+	for spooled in g.pop('atk_spooled', ()):
+		spooled.remove()
+
+
 @app.route('/')
 def index():
 	return Response(
@@ -1133,14 +4698,28 @@ def index():
 	)
 
 
+def _atkErrorResponse(res: Dict[str, Any], status: int = 400):
+	"""JSON response for an error dict; ATKPDF-15 (not admitted, see AtkAdmission) becomes 429 with Retry-After
+	and ATKPDF-07 (unknown template_id) 404."""
+	if res.get('code') == 'ATKPDF-15':
+		return jsonify(res), 429, {"Retry-After": str(res.get('retryAfter') or 1)}
+	if res.get('code') == 'ATKPDF-07':
+		status = 404
+	return jsonify(res), status
+
+
 @app.route('/api/fill', methods=['POST'])
 def api_fill():
 	try:
 		obj = pxConvertRequest()
-		if not obj or not pxJson(obj, 'pdf'):
+		if not obj or not (pxJson(obj, 'pdf') or pxJson(obj, 'template_id')):
 			return jsonify({"report": "error", "message": "Missing PDF upload."}), 400
-		# Force bytes return so we can stream PDF
-		obj['return'] = 'bytes'
+		# Force bytes return so we can stream PDF; only the optimize profile of the caller is kept
+		optimize = pxJson(obj['return'], 'optimize') if isinstance(obj.get('return'), dict) else None
+		obj['return'] = {'mode': 'bytes', 'optimize': optimize}
+		profile = obj.pop('profile', None)
+		if profile and str(profile).lower() not in ('0', 'false', 'no', 'off'):
+			return _atkProfiledFill(obj, str(profile).lower())
 		res = atkFillPdfFromData(obj)
 		if isinstance(res, Response):
 			return res
@@ -1157,44 +4736,202 @@ def api_fill():
 			except Exception:
 				return jsonify({"report": "error", "message": "File saved but could not be read."}), 500
 		# Error case
+		return _atkErrorResponse(res)
+	except Exception as e:
+		return jsonify({"report": "error", "message": str(e)}), 500
+
+
+def _atkProfiledFill(obj: Dict[str, Any], mode: str):
+	"""/api/fill under the profiler (see Profiling)."""
+	if not atkIsAdmin():
+		return jsonify({"report": "error", "message": "Profiling requires an admin token.", "code": "ATKPDF-13"}), 403
+	if mode == 'return':
+		obj['return']['mode'] = 'base64'
+	res, profiler, text, memory = atkProfileCall(atkFillPdfFromData, obj, inline=True)
+	if isinstance(res, dict) and res.get('report') != 'success':
+		return _atkErrorResponse(res)
+	if mode == 'return':
+		return jsonify({**res, "profile": {"report": text, "memory": memory}})
+	res.headers['X-Atkpdf-Profile'] = atkSaveProfile(profiler, text, memory)
+	if memory:
+		res.headers['X-Atkpdf-Memory'] = json.dumps(memory)
+	return res
+
+
+@app.route('/api/profiles/<profile_id>', methods=['GET'])
+def api_profiles_get(profile_id):
+	if not atkIsAdmin():
+		return jsonify({"report": "error", "message": "Profiling requires an admin token.", "code": "ATKPDF-13"}), 403
+	paths = _atkProfilePaths(profile_id)
+	if not paths or not os.path.exists(paths[0]):
+		return jsonify({"report": "error", "message": f"Profile '{profile_id}' not found.", "code": "ATKPDF-14"}), 404
+	if request.args.get('format') == 'pstats':
+		return pxStreamFile(paths[0], 'application/octet-stream',
+			headers={"Content-Disposition": f"attachment; filename={profile_id}.prof"})
+	return pxStreamFile(paths[1], 'text/plain; charset=utf-8')
+
+
+@app.route('/api/templates', methods=['POST'])
+def api_templates_register():
+	try:
+		pdf_bytes = None
+		name = None
+		pdf_file = request.files.get('pdf')
+		if pdf_file:
+			pdf_bytes = pxSpoolUpload(pdf_file.stream)
+			name = request.form.get('name') or pdf_file.filename
+		elif 'application/pdf' in (request.content_type or '').lower():
+			pdf_bytes = pxSpoolUpload(request.stream)
+			name = request.args.get('name')
+		else:
+			payload = request.get_json(silent=True) or {}
+			src = pxJson(payload, 'pdf') or pxJson(payload, 'file')
+			pdf_bytes = pxDecodeB64Bytes(src) if isinstance(src, str) else None
+			name = pxJson(payload, 'name')
+		res = atkRegisterTemplate(pdf_bytes, name)
+		if res.get('report') == 'success':
+			return jsonify(res), 201
 		return jsonify(res), 400
 	except Exception as e:
 		return jsonify({"report": "error", "message": str(e)}), 500
 
 
-@app.route('/api/fields', methods=['POST'])
+@app.route('/api/templates', methods=['GET'])
+def api_templates_list():
+	return jsonify({"templates": atkListTemplates()})
+
+
+@app.route('/api/templates/<template_id>', methods=['GET'])
+def api_templates_get(template_id):
+	meta = atkGetTemplateMeta(template_id)
+	if not meta:
+		return jsonify({"report": "error", "message": f"Template '{template_id}' not found.", "code": "ATKPDF-07"}), 404
+	return jsonify(meta)
+
+
+@app.route('/api/templates/<template_id>', methods=['DELETE'])
+def api_templates_delete(template_id):
+	if not atkDeleteTemplate(template_id):
+		return jsonify({"report": "error", "message": f"Template '{template_id}' not found.", "code": "ATKPDF-07"}), 404
+	return jsonify({"report": "success", "message": "Template deleted", "template_id": template_id})
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+	return Response(atkMetrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@app.route('/api/stats', methods=['GET'])
+def api_stats():
+	return jsonify({"templateCache": atkTemplateCache.stats(), "imageCache": atkImageCache.stats(), "downloader": atkDownloader.stats(), "resampler": atkResampler.stats(), "appearances": atkAppearances.stats(), "fonts": atkFonts.stats(), "engine": atkEngine.stats(), "admission": atkAdmission.stats(), "jobs": atkJobs.stats()})
+
+
+@app.route('/api/fill/batch', methods=['POST'])
+def api_fill_batch():
+	try:
+		obj = pxConvertRequest()
+		res = atkFillPdfBatch(obj)
+		if isinstance(res, Response):
+			return res
+		if isinstance(res, dict) and res.get('report') == 'success':
+			return jsonify(res)
+		return _atkErrorResponse(res)
+	except Exception as e:
+		return jsonify({"report": "error", "message": str(e)}), 500
+
+
+def _atkSubmitJob(kind: str):
+	obj = pxConvertRequest()
+	if not obj or not (pxJson(obj, 'pdf') or pxJson(obj, 'file') or pxJson(obj, 'template_id')):
+		return jsonify({"report": "error", "message": "PDF 'pdf', 'file' or 'template_id' key required.", "code": "ATKPDF-01"}), 400
+	job = atkJobs.submit(kind, obj)
+	if job is None:
+		return jsonify({"report": "error", "message": "Job queue is full, retry later.", "code": "ATKPDF-10"}), 503, {"Retry-After": "5"}
+	return jsonify(atkJobView(job)), 202, {"Location": f"/api/jobs/{job['id']}"}
+
+
+@app.route('/api/jobs/fill', methods=['POST'])
+def api_jobs_fill():
+	try:
+		return _atkSubmitJob('fill')
+	except Exception as e:
+		return jsonify({"report": "error", "message": str(e)}), 500
+
+
+@app.route('/api/jobs/batch', methods=['POST'])
+def api_jobs_batch():
+	try:
+		return _atkSubmitJob('batch')
+	except Exception as e:
+		return jsonify({"report": "error", "message": str(e)}), 500
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def api_jobs_get(job_id):
+	job = atkJobs.status(job_id)
+	if not job:
+		return jsonify({"report": "error", "message": f"Job '{job_id}' not found.", "code": "ATKPDF-11"}), 404
+	return jsonify(atkJobView(job))
+
+
+@app.route('/api/jobs/<job_id>/result', methods=['GET'])
+def api_jobs_result(job_id):
+	job = atkJobs.status(job_id)
+	if not job:
+		return jsonify({"report": "error", "message": f"Job '{job_id}' not found.", "code": "ATKPDF-11"}), 404
+	if job["state"] != "succeeded":
+		return jsonify(atkJobView(job)), 409
+	path = atkJobs.result_path(job_id)
+	if not os.path.exists(path):
+		return jsonify({"report": "error", "message": f"Job '{job_id}' not found.", "code": "ATKPDF-11"}), 404
+	return pxStreamFile(path, job["result"]["mimetype"], headers=job["result"]["headers"])
+
+
+@app.route('/api/jobs/<job_id>', methods=['DELETE'])
+def api_jobs_delete(job_id):
+	job = atkJobs.cancel(job_id)
+	if not job:
+		return jsonify({"report": "error", "message": f"Job '{job_id}' not found.", "code": "ATKPDF-11"}), 404
+	return jsonify(atkJobView(job))
+
+
+@app.route('/api/fields', methods=['GET', 'POST'])
 def api_fields():
+	# Field index of an uploaded PDF (multipart "pdf" part or raw application/pdf body) or of a registered
+	# template (template_id in the query string, form or JSON body); see Field Index for the cache and ETag.
 	try:
-		from flask import request
-		pdf_file = request.files.get('pdf')
-		if not pdf_file:
-			return jsonify({"fields": []})
-		import fitz
-		doc = fitz.open(stream=pdf_file.read(), filetype='pdf')
-		fields = []
-		for page in doc:
-			for w in list(page.widgets() or []):
-				try:
-					name = getattr(w, 'field_name', None)
-					type_code = getattr(w, 'field_type', None)
-					rect = getattr(w, 'rect', None)
-					fields.append({
-						"name": name, 
-						"type": int(type_code) if isinstance(type_code, int) else None,
-						"rect": str(rect) if rect else None
-					})
-				except Exception:
-					pass
-		doc.close()
-		# unique by name, keep order
-		seen = set()
-		unique = []
-		for f in fields:
-			n = f.get('name')
-			if n and n not in seen:
-				seen.add(n)
-				unique.append(f)
-		return jsonify({"fields": unique})
+		payload = request.get_json(silent=True) if request.is_json else None
+		template_id = request.values.get('template_id') or pxJson(payload, 'template_id')
+		pdf_bytes = None
+		if template_id:
+			key = str(template_id).strip().lower()
+			# the registry file is checked before the ETag, so a template deleted by any worker is a 404, not a 304
+			paths = _atkTemplatePaths(key)
+			if not paths or not os.path.exists(paths[0]):
+				return jsonify({"report": "error", "message": f"Template '{template_id}' not found.", "code": "ATKPDF-07"}), 404
+		else:
+			pdf_file = request.files.get('pdf')
+			if pdf_file:
+				pdf_bytes = pxSpoolUpload(pdf_file.stream)
+			elif 'application/pdf' in (request.content_type or '').lower():
+				pdf_bytes = pxSpoolUpload(request.stream)
+			else:
+				return jsonify({"fields": []})
+			key = pdf_bytes.key if isinstance(pdf_bytes, AtkSpooledFile) else atkTemplateKey(pdf_bytes)
+		etag = atkFieldIndexEtag(key)
+		if request.if_none_match.contains(etag):
+			res = Response(status=304)
+		else:
+			index = atkRegisteredFieldIndex(key)
+			if index is None and template_id:
+				return jsonify({"report": "error", "message": f"Template '{template_id}' not found.", "code": "ATKPDF-07"}), 404
+			if index is None:
+				template, _ = atkLoadTemplate(pdf_bytes, key)
+				index = atkFieldIndex(template)
+			res = jsonify(index)
+		res.set_etag(etag)
+		res.headers['Cache-Control'] = 'no-cache'
+		return res
 	except Exception:
 		return jsonify({"fields": []})
 
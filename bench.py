@@ -0,0 +1,417 @@
+# ------------------------------------------------------------------------------
+
+# atk pdf fill benchmark
+
+# ------------------------------------------------------------------------------
+# Offline benchmark of the fill engine. Synthetic templates are generated for every combination of the
+# matrix (pages x fields per page x field kinds x images) and each case is run against five targets:
+#   inprocess   atkFillPdfFromData(obj) called directly
+#   api_fill    POST /api/fill through the Flask test client (JSON body, pdf as base64)
+#   api_fields  POST /api/fields through the Flask test client (raw application/pdf body)
+#   fields_warm atkRenderTemplate on the cached template with the same values every time, so appearance
+#               streams come from the appearance cache (see AtkWidgetFiller)
+#   fields_cold the same with values that change every iteration, so every appearance is generated
+# The fields_* targets also report fillUsPerField: the median fill stage time divided by the filled fields,
+# and outputBytes: the median size of the filled PDF.
+# Image URLs point at a stand-in HTTP server on 127.0.0.1, so nothing leaves the machine.
+#
+# Usage:
+#   python bench.py                                   # full matrix, results to bench-results.json
+#   python bench.py --quick                           # small matrix for a smoke run
+#   python bench.py --baseline old.json --threshold 0.15
+#
+# Every case reports latency percentiles (p50/p90/p95/p99, ms), throughput (requests/s) and memory
+# (peak RSS and the peak increase while the case ran, see AtkMemoryProbe). With --baseline, cases whose
+# p50/p95 latency or peak increase grew by more than --threshold (fraction) are listed under "regressions"
+# and the exit status is 1. Caches are warmed by the --warmup iterations; --cold-images makes every
+# iteration use fresh image URLs so downloads and resampling are measured too.
+import argparse
+import atexit
+import base64
+import http.server
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from itertools import product
+from typing import Any, Dict, List, Optional
+
+_workdir = tempfile.mkdtemp(prefix='atkpdf-bench-')
+for _name, _sub in (('ATKPDF_TEMPLATE_DIR', 'templates'), ('ATKPDF_JOB_DIR', 'jobs'), ('ATKPDF_METRICS_DIR', 'metrics'),
+		('ATKPDF_PROFILE_DIR', 'profiles'), ('ATKPDF_SPOOL_DIR', 'spool')):
+	os.environ.setdefault(_name, os.path.join(_workdir, _sub))
+os.makedirs(os.environ['ATKPDF_SPOOL_DIR'], exist_ok=True)
+# registered before app is imported so it runs after app's own exit hooks (metrics snapshot removal)
+atexit.register(shutil.rmtree, _workdir, True)
+
+import fitz  # noqa: E402
+import app as atkapp  # noqa: E402
+
+BENCH_MATRIX = {
+	"pages": [1, 5, 20],
+	"fields": [10, 50],
+	"kinds": ["text", "mixed", "intl"],
+	"images": [0, 2, 8],
+}
+BENCH_QUICK_MATRIX = {
+	"pages": [1, 5],
+	"fields": [10],
+	"kinds": ["mixed"],
+	"images": [0, 2],
+}
+BENCH_TARGETS = ("inprocess", "api_fill", "api_fields", "fields_warm", "fields_cold")
+
+
+# ----------------------------- Synthetic Inputs -----------------------------
+
+def benchImage(index: int, width: int = 600, height: int = 400) -> bytes:
+	"""A PNG with a per-index colour so every image is distinct (no dedup between fields)."""
+	pix = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, width, height), False)
+	pix.set_rect(pix.irect, ((index * 47) % 256, (index * 89) % 256, (index * 131) % 256))
+	return pix.tobytes('png')
+
+
+def benchTemplate(pages: int, fields: int, kind: str, images: int) -> bytes:
+	"""Build a form with `fields` widgets per page and `images` image button fields spread over the pages.
+	kind "text" and "intl" only use text fields; "mixed" cycles text, checkbox, combobox and listbox."""
+	doc = fitz.open()
+	kinds = [fitz.PDF_WIDGET_TYPE_TEXT]
+	if kind == 'mixed':
+		kinds += [fitz.PDF_WIDGET_TYPE_CHECKBOX, fitz.PDF_WIDGET_TYPE_COMBOBOX, fitz.PDF_WIDGET_TYPE_LISTBOX]
+	for p in range(pages):
+		page = doc.new_page()
+		rows = max(1, (fields + 1) // 2)
+		step = min(36.0, (page.rect.height - 100) / rows)
+		for i in range(fields):
+			widget = fitz.Widget()
+			widget.field_name = f"p{p}_f{i}"
+			widget.field_type = kinds[i % len(kinds)]
+			x = 40 if i % 2 == 0 else 310
+			y = 40 + (i // 2) * step
+			widget.rect = fitz.Rect(x, y, x + 240, y + step - 6)
+			if widget.field_type == fitz.PDF_WIDGET_TYPE_CHECKBOX:
+				widget.rect = fitz.Rect(x, y, x + 14, y + 14)
+			if widget.field_type in (fitz.PDF_WIDGET_TYPE_COMBOBOX, fitz.PDF_WIDGET_TYPE_LISTBOX):
+				widget.choice_values = ["Alpha", "Beta", "Gamma"]
+			page.add_widget(widget)
+	for n in range(images):
+		page = doc[n % pages]
+		widget = fitz.Widget()
+		widget.field_name = f"img{n}_af_image"
+		widget.field_type = fitz.PDF_WIDGET_TYPE_BUTTON
+		x = 40 + (n // pages % 4) * 130
+		widget.rect = fitz.Rect(x, page.rect.height - 150, x + 120, page.rect.height - 50)
+		page.add_widget(widget)
+	pdf = doc.tobytes(garbage=1)
+	doc.close()
+	return pdf
+
+
+BENCH_INTL_VALUES = ("Şişli Göğüş İstanbul", "مرحبا بالعالم", "Привет мир")
+
+
+def benchData(pages: int, fields: int, kind: str) -> Dict[str, Any]:
+	"""Values for every field built by benchTemplate (images are supplied separately).
+	kind "intl" fills Turkish, Arabic and Cyrillic text, which needs fonts beyond WinAnsi."""
+	data: Dict[str, Any] = {}
+	per_kind = 4 if kind == 'mixed' else 1
+	for p in range(pages):
+		for i in range(fields):
+			slot = i % per_kind
+			if kind == 'intl':
+				data[f"p{p}_f{i}"] = f"{BENCH_INTL_VALUES[i % len(BENCH_INTL_VALUES)]} {p}-{i}"
+			elif slot == 1:
+				data[f"p{p}_f{i}"] = True
+			elif slot in (2, 3):
+				data[f"p{p}_f{i}"] = "Beta"
+			else:
+				data[f"p{p}_f{i}"] = f"Value {p}-{i}"
+	return data
+
+
+BENCH_LAST_MODIFIED = 'Thu, 01 Jan 2026 00:00:00 GMT'
+
+
+class _BenchImageHandler(http.server.BaseHTTPRequestHandler):
+	"""Serves /img/<n>.png (any query string) from memory, standing in for remote image hosts.
+	Every response is held back by `latency` seconds plus a uniform random 0..`jitter`.
+	Responses carry an ETag and Last-Modified and conditional requests matching them get 304; the query
+	parameter validators=etag|modified|none limits the validators sent and cc=<value> adds a Cache-Control
+	header. Every request is logged to `requests` as (path, status)."""
+	cache: Dict[int, bytes] = {}
+	requests: List[tuple] = []
+	lock = threading.Lock()
+	latency = 0.0
+	jitter = 0.0
+	protocol_version = 'HTTP/1.1'
+
+	def do_GET(self):
+		from urllib.parse import parse_qs
+		path, _, query = self.path.partition('?')
+		params = {k: v[-1] for k, v in parse_qs(query).items()}
+		try:
+			index = int(path.rsplit('/', 1)[-1].split('.')[0])
+		except ValueError:
+			self.send_error(404)
+			return
+		if self.latency or self.jitter:
+			time.sleep(self.latency + random.uniform(0, self.jitter))
+		with self.lock:
+			body = self.cache.get(index)
+			if body is None:
+				body = self.cache[index] = benchImage(index)
+		validators = params.get('validators', 'etag,modified')
+		headers = {'Content-Type': 'image/png'}
+		if 'etag' in validators:
+			headers['ETag'] = '"img-%d-%d"' % (index, len(body))
+		if 'modified' in validators:
+			headers['Last-Modified'] = BENCH_LAST_MODIFIED
+		if params.get('cc'):
+			headers['Cache-Control'] = params['cc']
+		if (headers.get('ETag') and self.headers.get('If-None-Match') == headers['ETag']) or (
+				headers.get('Last-Modified') and self.headers.get('If-Modified-Since') == headers['Last-Modified']):
+			status, body = 304, b''
+		else:
+			status = 200
+		with self.lock:
+			self.requests.append((self.path, status))
+		self.send_response(status)
+		for name, value in headers.items():
+			self.send_header(name, value)
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, *args):
+		pass
+
+
+class _BenchImageServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+	daemon_threads = True
+
+
+def benchImageServer(latency_ms: float = 0, jitter_ms: float = 0):
+	"""Start the stand-in image server; returns (server, base url)."""
+	_BenchImageHandler.latency = latency_ms / 1000.0
+	_BenchImageHandler.jitter = jitter_ms / 1000.0
+	server = _BenchImageServer(('127.0.0.1', 0), _BenchImageHandler)
+	threading.Thread(target=server.serve_forever, name='bench-images', daemon=True).start()
+	return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+# ----------------------------- Measurement -----------------------------
+
+def benchPercentile(values: List[float], pct: float) -> Optional[float]:
+	"""Nearest-rank percentile of values (ms), None for an empty list."""
+	if not values:
+		return None
+	ordered = sorted(values)
+	rank = max(1, min(len(ordered), math.ceil(pct / 100.0 * len(ordered))))
+	return round(ordered[rank - 1], 3)
+
+
+def benchRun(call, iterations: int, warmup: int) -> Dict[str, Any]:
+	"""Time `call(i)` over iterations after warmup runs; call returns True on success."""
+	for i in range(warmup):
+		call(-1 - i)
+	latencies: List[float] = []
+	errors = 0
+	probe = atkapp.AtkMemoryProbe(interval_ms=2)
+	started = time.perf_counter()
+	with probe:
+		for i in range(iterations):
+			t0 = time.perf_counter()
+			ok = call(i)
+			latencies.append((time.perf_counter() - t0) * 1000)
+			if not ok:
+				errors += 1
+	elapsed = time.perf_counter() - started
+	memory = probe.stats() or {}
+	return {
+		"iterations": iterations,
+		"errors": errors,
+		"latencyMs": {
+			"min": round(min(latencies), 3) if latencies else None,
+			"mean": round(sum(latencies) / len(latencies), 3) if latencies else None,
+			"p50": benchPercentile(latencies, 50),
+			"p90": benchPercentile(latencies, 90),
+			"p95": benchPercentile(latencies, 95),
+			"p99": benchPercentile(latencies, 99),
+			"max": round(max(latencies), 3) if latencies else None,
+		},
+		"throughput": round(iterations / elapsed, 3) if elapsed > 0 else None,
+		"memory": {"rssPeak": memory.get('rssPeak'), "peakDelta": memory.get('peakDelta')},
+	}
+
+
+def benchCase(client, base_url: str, pages: int, fields: int, kind: str, images: int, targets, iterations: int,
+		warmup: int, cold_images: bool) -> Dict[str, Any]:
+	pdf = benchTemplate(pages, fields, kind, images)
+	pdf_b64 = base64.b64encode(pdf).decode('ascii')
+	data = benchData(pages, fields, kind)
+
+	def image_map(i: int) -> Dict[str, Any]:
+		suffix = f"?i={i}" if cold_images else ''
+		return {f"img{n}_af_image": {"source": f"{base_url}/img/{n}.png{suffix}"} for n in range(images)}
+
+	def run_inprocess(i: int) -> bool:
+		res = atkapp.atkFillPdfFromData({"pdf": pdf, "data": data, "images": image_map(i)})
+		return isinstance(res, dict) and res.get('report') == 'success'
+
+	def run_api_fill(i: int) -> bool:
+		resp = client.post('/api/fill', json={"pdf": pdf_b64, "data": data, "images": image_map(i)})
+		return resp.status_code == 200 and resp.data[:5] == b'%PDF-'
+
+	def run_api_fields(i: int) -> bool:
+		resp = client.post('/api/fields', data=pdf, content_type='application/pdf')
+		return resp.status_code == 200 and bool((resp.get_json(silent=True) or {}).get('fields'))
+
+	template, _ = atkapp.atkLoadTemplate(pdf)
+	fill_seconds: Dict[str, List[float]] = {"fields_warm": [], "fields_cold": []}
+	output_bytes: Dict[str, List[int]] = {"fields_warm": [], "fields_cold": []}
+
+	def run_fields(target: str):
+		def run(i: int) -> bool:
+			values = data if target == "fields_warm" else {k: v if v is True else f"{v} #{i}" for k, v in data.items()}
+			res = atkapp.atkRenderTemplate(template, values, {})
+			if i >= 0:
+				stages = res.get("stats", {}).get("stages", {})
+				fill_seconds[target].append(stages.get("fill", 0.0) + stages.get("fonts", 0.0))
+				output_bytes[target].append(len(res.get("pdf") or b''))
+			return res.get("report") == "success"
+		return run
+
+	runners = {"inprocess": run_inprocess, "api_fill": run_api_fill, "api_fields": run_api_fields,
+		"fields_warm": run_fields("fields_warm"), "fields_cold": run_fields("fields_cold")}
+	results = {target: benchRun(runners[target], iterations, warmup) for target in targets}
+	for target, seconds in fill_seconds.items():
+		if target in results and seconds:
+			results[target]["fillUsPerField"] = round(benchPercentile([x * 1e6 for x in seconds], 50) / max(1, len(data)), 2)
+			results[target]["outputBytes"] = int(benchPercentile(output_bytes[target], 50))
+	return {
+		"case": f"p{pages}-f{fields}-{kind}-i{images}",
+		"params": {"pages": pages, "fields": fields, "kinds": kind, "images": images, "templateBytes": len(pdf)},
+		"targets": results,
+	}
+
+
+def benchEnvironment() -> Dict[str, Any]:
+	commit = None
+	try:
+		commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+			capture_output=True, text=True, timeout=5).stdout.strip() or None
+	except Exception:
+		pass
+	return {
+		"python": platform.python_version(),
+		"pymupdf": getattr(fitz, 'VersionBind', None),
+		"platform": platform.platform(),
+		"cpus": os.cpu_count(),
+		"commit": commit,
+		"settings": {k: v for k, v in sorted(os.environ.items()) if k.startswith('ATKPDF_') and not k.endswith('_TOKEN')},
+	}
+
+
+def benchCompare(results: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[Dict[str, Any]]:
+	"""Cases/targets where p50, p95 or the memory increase grew beyond threshold relative to baseline."""
+	old_cases = {c["case"]: c for c in baseline.get("cases", [])}
+	regressions = []
+	for case in results["cases"]:
+		old = old_cases.get(case["case"])
+		if not old:
+			continue
+		for target, now in case["targets"].items():
+			before = old.get("targets", {}).get(target)
+			if not before:
+				continue
+			checks = [("latencyMs.p50", before["latencyMs"].get("p50"), now["latencyMs"].get("p50")),
+				("latencyMs.p95", before["latencyMs"].get("p95"), now["latencyMs"].get("p95")),
+				("memory.peakDelta", (before.get("memory") or {}).get("peakDelta"), (now.get("memory") or {}).get("peakDelta"))]
+			for metric, was, cur in checks:
+				if not was or cur is None:
+					continue
+				# memory samples are coarse; ignore growth under 1 MB
+				if metric == "memory.peakDelta" and cur - was < 1 << 20:
+					continue
+				change = (cur - was) / was
+				if change > threshold:
+					regressions.append({"case": case["case"], "target": target, "metric": metric,
+						"baseline": was, "current": cur, "change": round(change, 4)})
+	return regressions
+
+
+def main(argv=None) -> int:
+	parser = argparse.ArgumentParser(description='Offline benchmark for the atk pdf fill engine.')
+	parser.add_argument('--quick', action='store_true', help='run the small matrix')
+	parser.add_argument('--pages', type=int, nargs='+', help='page counts (overrides the matrix)')
+	parser.add_argument('--fields', type=int, nargs='+', help='fields per page (overrides the matrix)')
+	parser.add_argument('--kinds', nargs='+', choices=['text', 'mixed', 'intl'], help='field kinds (overrides the matrix)')
+	parser.add_argument('--images', type=int, nargs='+', help='image counts (overrides the matrix)')
+	parser.add_argument('--targets', nargs='+', choices=BENCH_TARGETS, default=list(BENCH_TARGETS))
+	parser.add_argument('--iterations', type=int, default=20)
+	parser.add_argument('--warmup', type=int, default=2)
+	parser.add_argument('--cold-images', action='store_true', help='fresh image URLs on every iteration')
+	parser.add_argument('--out', default='bench-results.json', help='JSON output path ("-" for stdout)')
+	parser.add_argument('--baseline', help='earlier results to compare against')
+	parser.add_argument('--threshold', type=float, default=0.15, help='allowed relative growth before flagging')
+	args = parser.parse_args(argv)
+
+	matrix = dict(BENCH_QUICK_MATRIX if args.quick else BENCH_MATRIX)
+	for key in ('pages', 'fields', 'kinds', 'images'):
+		if getattr(args, key):
+			matrix[key] = getattr(args, key)
+
+	server, base_url = benchImageServer()
+	client = atkapp.app.test_client()
+	results: Dict[str, Any] = {
+		"startedAt": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+		"environment": benchEnvironment(),
+		"config": {"matrix": matrix, "targets": args.targets, "iterations": args.iterations, "warmup": args.warmup,
+			"coldImages": args.cold_images},
+		"cases": [],
+	}
+	try:
+		for pages, fields, kind, images in product(matrix['pages'], matrix['fields'], matrix['kinds'], matrix['images']):
+			case = benchCase(client, base_url, pages, fields, kind, images, args.targets, args.iterations, args.warmup,
+				args.cold_images)
+			results["cases"].append(case)
+			summary = '  '.join(f"{t} p50={r['latencyMs']['p50']}ms {r['throughput']}/s"
+				for t, r in case["targets"].items())
+			print(f"{case['case']:<22} {summary}", file=sys.stderr)
+	finally:
+		server.shutdown()
+
+	status = 0
+	if args.baseline:
+		with open(args.baseline, 'r', encoding='utf-8') as f:
+			baseline = json.load(f)
+		results["baseline"] = {"path": args.baseline, "commit": (baseline.get("environment") or {}).get("commit"),
+			"threshold": args.threshold}
+		results["regressions"] = benchCompare(results, baseline, args.threshold)
+		for reg in results["regressions"]:
+			print(f"REGRESSION {reg['case']} {reg['target']} {reg['metric']}: {reg['baseline']} -> {reg['current']} "
+				f"(+{reg['change'] * 100:.1f}%)", file=sys.stderr)
+		status = 1 if results["regressions"] else 0
+	if any(r["errors"] for c in results["cases"] for r in c["targets"].values()):
+		print('some iterations failed, see "errors" in the results', file=sys.stderr)
+		status = 1
+
+	text = json.dumps(results, indent=2)
+	if args.out == '-':
+		print(text)
+	else:
+		with open(args.out, 'w', encoding='utf-8') as f:
+			f.write(text)
+	return status
+
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,432 @@
+# ------------------------------------------------------------------------------
+
+# atk pdf fill load test
+
+# ------------------------------------------------------------------------------
+# Starts the app under gunicorn on 127.0.0.1 (same command as the Procfile, worker/thread counts
+# configurable) and drives POST /api/fill concurrently. Image URLs in the payloads are served by the
+# stand-in server from bench.py, with injectable latency, so the run is fully local.
+#
+# Usage:
+#   python loadtest.py --workers 2 --threads 4 --concurrency 8 --duration 30
+#   python loadtest.py --rate 20 --mix small=6,medium=3,large=1 --image-latency 150 --image-jitter 100
+#   python loadtest.py --engine-processes 2 --templates registered --out load.json
+#
+# Load models:
+#   closed loop (default)   --concurrency clients each send the next request as soon as the last one answered
+#   open loop (--rate N)    requests arrive as a Poisson process of N/s and are served by up to --concurrency
+#                           clients; latency is measured from the scheduled arrival, so queueing in front of
+#                           a saturated server shows up in the tail instead of being hidden
+#
+# Payload mix: --mix picks LOAD_PROFILES by weight. --templates inline sends the PDF as base64 with every
+# request, registered uploads each template once (POST /api/templates) and sends template_id instead.
+#
+# Report (JSON, --out): throughput, latency percentiles and error counts overall and per profile, plus the
+# RSS of every gunicorn worker (and its engine processes) sampled over the run from /proc (Linux only).
+import argparse
+import base64
+import json
+import os
+import queue
+import random
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import requests
+
+import bench
+
+LOAD_PROFILES = {
+	"small": {"pages": 1, "fields": 10, "kinds": "text", "images": 0},
+	"medium": {"pages": 5, "fields": 25, "kinds": "mixed", "images": 2},
+	"large": {"pages": 20, "fields": 50, "kinds": "mixed", "images": 8},
+}
+
+
+# ----------------------------- Server Under Test -----------------------------
+
+def loadFreePort() -> int:
+	with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+		s.bind(('127.0.0.1', 0))
+		return s.getsockname()[1]
+
+
+def loadStartGunicorn(port: int, workers: int, threads: int, timeout: int, env: Dict[str, str],
+		extra: List[str], log_path: str) -> subprocess.Popen:
+	"""Start gunicorn serving app:app and wait until it answers; raises RuntimeError if it does not come up."""
+	cmd = [sys.executable, '-m', 'gunicorn', 'app:app', '--bind', f'127.0.0.1:{port}',
+		'--workers', str(workers), '--threads', str(threads), '--timeout', str(timeout)] + extra
+	log = open(log_path, 'wb')
+	proc = subprocess.Popen(cmd, cwd=os.path.dirname(os.path.abspath(__file__)), env=env, stdout=log, stderr=log)
+	# closed by loadStopGunicorn
+	proc.load_log = log
+	deadline = time.time() + 30
+	while time.time() < deadline:
+		if proc.poll() is not None:
+			log.close()
+			raise RuntimeError(f"gunicorn exited with {proc.returncode}, see {log_path}")
+		try:
+			if requests.get(f'http://127.0.0.1:{port}/api/stats', timeout=1).status_code == 200:
+				return proc
+		except requests.RequestException:
+			pass
+		time.sleep(0.2)
+	loadStopGunicorn(proc)
+	raise RuntimeError(f"gunicorn did not answer within 30s, see {log_path}")
+
+
+def loadStopGunicorn(proc: subprocess.Popen) -> None:
+	if proc.poll() is None:
+		proc.send_signal(signal.SIGTERM)
+		try:
+			proc.wait(timeout=30)
+		except subprocess.TimeoutExpired:
+			proc.kill()
+			proc.wait()
+	log = getattr(proc, 'load_log', None)
+	if log is not None:
+		log.close()
+
+
+def _loadChildren(pid: int) -> List[int]:
+	children: List[int] = []
+	try:
+		for tid in os.listdir(f'/proc/{pid}/task'):
+			with open(f'/proc/{pid}/task/{tid}/children', 'r') as f:
+				children.extend(int(c) for c in f.read().split())
+	except (OSError, ValueError):
+		pass
+	return children
+
+
+def _loadRss(pid: int) -> Optional[int]:
+	try:
+		with open(f'/proc/{pid}/status', 'r') as f:
+			for line in f:
+				if line.startswith('VmRSS:'):
+					return int(line.split()[1]) * 1024
+	except (OSError, ValueError):
+		pass
+	return None
+
+
+class LoadMemorySampler:
+	"""Samples the RSS of each gunicorn worker (including its descendants, e.g. engine processes) every interval.
+	Workers replaced during the run (timeouts, max-requests) show up as separate entries."""
+
+	def __init__(self, master_pid: int, interval: float = 0.5):
+		self.master_pid = master_pid
+		self.interval = interval
+		self.workers: Dict[int, Dict[str, Any]] = {}
+		self.master_rss: Optional[int] = None
+		self._stop = threading.Event()
+		self._thread = threading.Thread(target=self._run, name='load-memory', daemon=True)
+
+	def _tree_rss(self, pid: int) -> Optional[int]:
+		total = _loadRss(pid)
+		if total is None:
+			return None
+		for child in _loadChildren(pid):
+			total += self._tree_rss(child) or 0
+		return total
+
+	def sample(self) -> None:
+		self.master_rss = _loadRss(self.master_pid) or self.master_rss
+		for pid in _loadChildren(self.master_pid):
+			rss = self._tree_rss(pid)
+			if rss is None:
+				continue
+			entry = self.workers.setdefault(pid, {"pid": pid, "rssStart": rss, "rssPeak": rss, "rssEnd": rss,
+				"processes": 1})
+			entry["rssPeak"] = max(entry["rssPeak"], rss)
+			entry["rssEnd"] = rss
+			entry["processes"] = max(entry["processes"], 1 + len(_loadChildren(pid)))
+
+	def _run(self) -> None:
+		while not self._stop.wait(self.interval):
+			self.sample()
+
+	def __enter__(self):
+		self.sample()
+		self._thread.start()
+		return self
+
+	def __exit__(self, *exc) -> None:
+		self._stop.set()
+		self._thread.join()
+		self.sample()
+
+	def report(self) -> Dict[str, Any]:
+		workers = sorted(self.workers.values(), key=lambda w: w["pid"])
+		return {
+			"master": {"pid": self.master_pid, "rss": self.master_rss},
+			"workers": workers,
+			"totalPeak": sum(w["rssPeak"] for w in workers) or None,
+		}
+
+
+# ----------------------------- Load Generation -----------------------------
+
+def loadParseMix(text: str) -> Dict[str, float]:
+	mix: Dict[str, float] = {}
+	for part in filter(None, (p.strip() for p in text.split(','))):
+		name, _, weight = part.partition('=')
+		if name not in LOAD_PROFILES:
+			raise SystemExit(f"unknown profile '{name}' in --mix (known: {', '.join(LOAD_PROFILES)})")
+		mix[name] = float(weight or 1)
+	if not mix or sum(mix.values()) <= 0:
+		raise SystemExit('--mix needs at least one profile with a positive weight')
+	return mix
+
+
+class LoadPayloads:
+	"""Builds the synthetic template of every profile once and renders request bodies from them."""
+
+	def __init__(self, mix: Dict[str, float], base: str, image_url: str, registered: bool, cold_images: bool):
+		self.names = list(mix)
+		self.weights = [mix[n] for n in self.names]
+		self.image_url = image_url
+		self.cold_images = cold_images
+		self.counter = 0
+		self.lock = threading.Lock()
+		self.profiles: Dict[str, Dict[str, Any]] = {}
+		for name in self.names:
+			spec = LOAD_PROFILES[name]
+			pdf = bench.benchTemplate(spec["pages"], spec["fields"], spec["kinds"], spec["images"])
+			entry = {"spec": spec, "bytes": len(pdf), "data": bench.benchData(spec["pages"], spec["fields"], spec["kinds"])}
+			if registered:
+				resp = requests.post(f'{base}/api/templates', data=pdf, headers={'Content-Type': 'application/pdf'},
+					params={'name': f'load-{name}'}, timeout=60)
+				resp.raise_for_status()
+				entry["source"] = {"template_id": resp.json()["template_id"]}
+			else:
+				entry["source"] = {"pdf": base64.b64encode(pdf).decode('ascii')}
+			self.profiles[name] = entry
+
+	def next(self):
+		"""Pick a profile by weight; returns (name, JSON body bytes)."""
+		name = random.choices(self.names, self.weights)[0]
+		entry = self.profiles[name]
+		with self.lock:
+			self.counter += 1
+			n = self.counter
+		suffix = f'?i={n}' if self.cold_images else ''
+		images = {f"img{i}_af_image": {"source": f"{self.image_url}/img/{i}.png{suffix}"}
+			for i in range(entry["spec"]["images"])}
+		return name, json.dumps({**entry["source"], "data": entry["data"], "images": images}).encode('utf-8')
+
+
+class LoadRecorder:
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.samples: List[Dict[str, Any]] = []
+
+	def add(self, **sample) -> None:
+		with self.lock:
+			self.samples.append(sample)
+
+
+def loadSend(session: requests.Session, url: str, payloads: LoadPayloads, recorder: LoadRecorder, timeout: float,
+		scheduled: Optional[float] = None) -> None:
+	name, body = payloads.next()
+	started = time.perf_counter()
+	status, code, size = None, None, 0
+	try:
+		resp = session.post(url, data=body, headers={'Content-Type': 'application/json'}, timeout=timeout)
+		status = resp.status_code
+		size = len(resp.content)
+		if status != 200:
+			code = (resp.json() if 'json' in resp.headers.get('Content-Type', '') else {}).get('code')
+		elif resp.content[:5] != b'%PDF-':
+			code = 'not-pdf'
+	except requests.Timeout:
+		code = 'timeout'
+	except requests.RequestException as e:
+		code = type(e).__name__
+	except ValueError:
+		code = 'bad-json'
+	done = time.perf_counter()
+	recorder.add(profile=name, status=status, code=code, bytes=size, at=done,
+		latency=(done - (scheduled if scheduled is not None else started)) * 1000, service=(done - started) * 1000)
+
+
+def loadClosed(url: str, payloads: LoadPayloads, recorder: LoadRecorder, concurrency: int, until: float,
+		timeout: float) -> None:
+	def client():
+		session = requests.Session()
+		while time.perf_counter() < until:
+			loadSend(session, url, payloads, recorder, timeout)
+
+	threads = [threading.Thread(target=client, name=f'load-client-{i}', daemon=True) for i in range(concurrency)]
+	for t in threads:
+		t.start()
+	for t in threads:
+		t.join()
+
+
+def loadOpen(url: str, payloads: LoadPayloads, recorder: LoadRecorder, concurrency: int, until: float,
+		timeout: float, rate: float) -> int:
+	"""Poisson arrivals at `rate`/s served by `concurrency` clients; returns arrivals never started before `until`."""
+	arrivals: "queue.Queue[Optional[float]]" = queue.Queue()
+	skipped = [0]
+	lock = threading.Lock()
+
+	def client():
+		session = requests.Session()
+		while True:
+			scheduled = arrivals.get()
+			if scheduled is None:
+				return
+			if time.perf_counter() < until:
+				loadSend(session, url, payloads, recorder, timeout, scheduled)
+			else:
+				with lock:
+					skipped[0] += 1
+
+	threads = [threading.Thread(target=client, name=f'load-client-{i}', daemon=True) for i in range(concurrency)]
+	for t in threads:
+		t.start()
+	next_at = time.perf_counter()
+	while next_at < until:
+		delay = next_at - time.perf_counter()
+		if delay > 0:
+			time.sleep(delay)
+		arrivals.put(next_at)
+		next_at += random.expovariate(rate)
+	for _ in threads:
+		arrivals.put(None)
+	for t in threads:
+		t.join()
+	return skipped[0]
+
+
+def loadSummary(samples: List[Dict[str, Any]], seconds: float) -> Dict[str, Any]:
+	ok = [s for s in samples if s["status"] == 200 and s["code"] is None]
+	errors: Dict[str, int] = {}
+	for s in samples:
+		if s["status"] != 200 or s["code"] is not None:
+			key = f"{s['status'] or 'no-response'}:{s['code'] or '-'}"
+			errors[key] = errors.get(key, 0) + 1
+	latencies = [s["latency"] for s in ok]
+	return {
+		"requests": len(samples),
+		"ok": len(ok),
+		"errorRate": round(1 - len(ok) / len(samples), 4) if samples else None,
+		"errors": errors,
+		"throughput": round(len(ok) / seconds, 3) if seconds > 0 else None,
+		"bytesOut": sum(s["bytes"] for s in ok),
+		"latencyMs": {
+			"mean": round(sum(latencies) / len(latencies), 3) if latencies else None,
+			"p50": bench.benchPercentile(latencies, 50),
+			"p90": bench.benchPercentile(latencies, 90),
+			"p95": bench.benchPercentile(latencies, 95),
+			"p99": bench.benchPercentile(latencies, 99),
+			"p999": bench.benchPercentile(latencies, 99.9),
+			"max": round(max(latencies), 3) if latencies else None,
+		},
+		"serviceMs": {
+			"p50": bench.benchPercentile([s["service"] for s in ok], 50),
+			"p99": bench.benchPercentile([s["service"] for s in ok], 99),
+		},
+	}
+
+
+def main(argv=None) -> int:
+	parser = argparse.ArgumentParser(description='Load test of the atk pdf fill service under gunicorn.')
+	parser.add_argument('--workers', type=int, default=2)
+	parser.add_argument('--threads', type=int, default=4)
+	parser.add_argument('--timeout', type=int, default=120, help='gunicorn worker timeout')
+	parser.add_argument('--engine-processes', type=int, help='ATKPDF_ENGINE_PROCESSES for the server')
+	parser.add_argument('--env', action='append', default=[], metavar='NAME=VALUE', help='extra server environment')
+	parser.add_argument('--gunicorn-arg', action='append', default=[], help='extra gunicorn argument (repeatable)')
+	parser.add_argument('--concurrency', type=int, default=8, help='concurrent clients')
+	parser.add_argument('--rate', type=float, default=0, help='open-loop arrival rate in requests/s (0 = closed loop)')
+	parser.add_argument('--duration', type=float, default=30, help='measured seconds')
+	parser.add_argument('--warmup', type=float, default=3, help='seconds of load before measuring')
+	parser.add_argument('--mix', default='small=6,medium=3,large=1', help='profile weights, e.g. small=1,large=1')
+	parser.add_argument('--templates', choices=['inline', 'registered'], default='inline')
+	parser.add_argument('--image-latency', type=float, default=0, help='stub image server latency (ms)')
+	parser.add_argument('--image-jitter', type=float, default=0, help='extra uniform random latency (ms)')
+	parser.add_argument('--cold-images', action='store_true', help='fresh image URLs on every request')
+	parser.add_argument('--request-timeout', type=float, default=60)
+	parser.add_argument('--out', default='load-results.json', help='JSON output path ("-" for stdout)')
+	parser.add_argument('--server-log', default='load-gunicorn.log', help='gunicorn output')
+	args = parser.parse_args(argv)
+
+	mix = loadParseMix(args.mix)
+	env = dict(os.environ)
+	if args.engine_processes is not None:
+		env['ATKPDF_ENGINE_PROCESSES'] = str(args.engine_processes)
+	for item in args.env:
+		name, _, value = item.partition('=')
+		env[name] = value
+	port = loadFreePort()
+	base = f'http://127.0.0.1:{port}'
+	log_path = os.path.abspath(args.server_log)
+
+	image_server, image_url = bench.benchImageServer(args.image_latency, args.image_jitter)
+	proc = loadStartGunicorn(port, args.workers, args.threads, args.timeout, env, args.gunicorn_arg, log_path)
+	try:
+		payloads = LoadPayloads(mix, base, image_url, args.templates == 'registered', args.cold_images)
+		url = f'{base}/api/fill'
+		if args.warmup > 0:
+			until = time.perf_counter() + args.warmup
+			warm = LoadRecorder()
+			if args.rate > 0:
+				loadOpen(url, payloads, warm, args.concurrency, until, args.request_timeout, args.rate)
+			else:
+				loadClosed(url, payloads, warm, args.concurrency, until, args.request_timeout)
+		recorder = LoadRecorder()
+		dropped = 0
+		with LoadMemorySampler(proc.pid) as memory:
+			started = time.perf_counter()
+			until = started + args.duration
+			if args.rate > 0:
+				dropped = loadOpen(url, payloads, recorder, args.concurrency, until, args.request_timeout, args.rate)
+			else:
+				loadClosed(url, payloads, recorder, args.concurrency, until, args.request_timeout)
+			elapsed = time.perf_counter() - started
+		try:
+			server_stats = requests.get(f'{base}/api/stats', timeout=5).json()
+		except (requests.RequestException, ValueError):
+			server_stats = None
+	finally:
+		loadStopGunicorn(proc)
+		image_server.shutdown()
+
+	samples = recorder.samples
+	results = {
+		"startedAt": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+		"environment": bench.benchEnvironment(),
+		"config": {
+			"workers": args.workers, "threads": args.threads, "engineProcesses": env.get('ATKPDF_ENGINE_PROCESSES'),
+			"concurrency": args.concurrency, "rate": args.rate or None, "model": "open" if args.rate > 0 else "closed",
+			"duration": args.duration, "warmup": args.warmup, "mix": mix, "templates": args.templates,
+			"imageLatencyMs": args.image_latency, "imageJitterMs": args.image_jitter, "coldImages": args.cold_images,
+		},
+		"profiles": {name: {**entry["spec"], "templateBytes": entry["bytes"]} for name, entry in payloads.profiles.items()},
+		"overall": {**loadSummary(samples, elapsed), "notStarted": dropped},
+		"byProfile": {name: loadSummary([s for s in samples if s["profile"] == name], elapsed) for name in mix},
+		"memory": memory.report(),
+		"serverStats": server_stats,
+	}
+	overall = results["overall"]
+	print(f"{overall['ok']}/{overall['requests']} ok, {overall['throughput']}/s, p50={overall['latencyMs']['p50']}ms "
+		f"p99={overall['latencyMs']['p99']}ms, errors={overall['errors']}, "
+		f"worker peak RSS={[w['rssPeak'] for w in results['memory']['workers']]}", file=sys.stderr)
+	text = json.dumps(results, indent=2)
+	if args.out == '-':
+		print(text)
+	else:
+		with open(args.out, 'w', encoding='utf-8') as f:
+			f.write(text)
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
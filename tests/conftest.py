@@ -0,0 +1,211 @@
+# Shared fixtures: app imported over scratch directories, synthetic forms and values, and a stand-in image host.
+import atexit
+import http.server
+import os
+import shutil
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_workdir = tempfile.mkdtemp(prefix='atkpdf-tests-')
+for _name, _sub in (('ATKPDF_TEMPLATE_DIR', 'templates'), ('ATKPDF_JOB_DIR', 'jobs'), ('ATKPDF_METRICS_DIR', 'metrics'),
+		('ATKPDF_PROFILE_DIR', 'profiles'), ('ATKPDF_SPOOL_DIR', 'spool')):
+	os.environ[_name] = os.path.join(_workdir, _sub)
+os.makedirs(os.environ['ATKPDF_SPOOL_DIR'], exist_ok=True)
+# registered before app is imported so it runs after app's own exit hooks
+atexit.register(shutil.rmtree, _workdir, True)
+
+import fitz  # noqa: E402
+
+INTL_VALUES = ("Şişli Göğüş İstanbul", "مرحبا بالعالم", "Привет мир")
+LAST_MODIFIED = 'Thu, 01 Jan 2026 00:00:00 GMT'
+
+
+def formPdf(pages: int, fields: int, kind: str = 'text', images: int = 0) -> bytes:
+	"""A form with `fields` widgets per page named p<page>_f<n> and `images` image button fields img<n>_af_image.
+	kind "text" and "intl" only use text fields; "mixed" cycles text, checkbox, combobox and listbox."""
+	doc = fitz.open()
+	kinds = [fitz.PDF_WIDGET_TYPE_TEXT]
+	if kind == 'mixed':
+		kinds += [fitz.PDF_WIDGET_TYPE_CHECKBOX, fitz.PDF_WIDGET_TYPE_COMBOBOX, fitz.PDF_WIDGET_TYPE_LISTBOX]
+	for p in range(pages):
+		page = doc.new_page()
+		step = min(36.0, (page.rect.height - 100) / max(1, (fields + 1) // 2))
+		for i in range(fields):
+			widget = fitz.Widget()
+			widget.field_name = f"p{p}_f{i}"
+			widget.field_type = kinds[i % len(kinds)]
+			x, y = (40 if i % 2 == 0 else 310), 40 + (i // 2) * step
+			widget.rect = fitz.Rect(x, y, x + 240, y + step - 6)
+			if widget.field_type == fitz.PDF_WIDGET_TYPE_CHECKBOX:
+				widget.rect = fitz.Rect(x, y, x + 14, y + 14)
+			if widget.field_type in (fitz.PDF_WIDGET_TYPE_COMBOBOX, fitz.PDF_WIDGET_TYPE_LISTBOX):
+				widget.choice_values = ["Alpha", "Beta", "Gamma"]
+			page.add_widget(widget)
+	for n in range(images):
+		page = doc[n % pages]
+		widget = fitz.Widget()
+		widget.field_name = f"img{n}_af_image"
+		widget.field_type = fitz.PDF_WIDGET_TYPE_BUTTON
+		x = 40 + (n // pages % 4) * 130
+		widget.rect = fitz.Rect(x, page.rect.height - 150, x + 120, page.rect.height - 50)
+		page.add_widget(widget)
+	pdf = doc.tobytes(garbage=1)
+	doc.close()
+	return pdf
+
+
+def formValues(pages: int, fields: int, kind: str = 'text') -> dict:
+	"""A value for every field of formPdf: checkboxes True, choices "Beta", intl cycles INTL_VALUES."""
+	values = {}
+	for p in range(pages):
+		for i in range(fields):
+			slot = i % 4 if kind == 'mixed' else 0
+			if kind == 'intl':
+				values[f"p{p}_f{i}"] = f"{INTL_VALUES[i % len(INTL_VALUES)]} {p}-{i}"
+			else:
+				values[f"p{p}_f{i}"] = True if slot == 1 else "Beta" if slot in (2, 3) else f"Value {p}-{i}"
+	return values
+
+
+def formPng(index: int, width: int = 600, height: int = 400) -> bytes:
+	"""A PNG with a per-index colour."""
+	pix = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, width, height), False)
+	pix.set_rect(pix.irect, ((index * 47) % 256, (index * 89) % 256, (index * 131) % 256))
+	return pix.tobytes('png')
+
+
+class _ImageHandler(http.server.BaseHTTPRequestHandler):
+	"""Serves /img/<n>.png from memory with an ETag and Last-Modified, answering matching conditional requests
+	with 304. Query parameters: validators=etag|modified|none limits the validators sent, cc=<value> adds
+	Cache-Control, status=<code> answers with that error instead (as does a non-zero class-level status for every
+	path), length=none leaves out Content-Length and drip=<seconds> sends the body in 64-byte pieces that far
+	apart. Every request is logged as (path, status)."""
+	cache = {}
+	requests = []
+	lock = threading.Lock()
+	latency = 0.0
+	status = 0
+	protocol_version = 'HTTP/1.1'
+
+	def do_GET(self):
+		from urllib.parse import parse_qs
+		path, _, query = self.path.partition('?')
+		params = {k: v[-1] for k, v in parse_qs(query).items()}
+		try:
+			index = int(path.rsplit('/', 1)[-1].split('.')[0])
+		except ValueError:
+			self.send_error(404)
+			return
+		if self.latency:
+			time.sleep(self.latency)
+		with self.lock:
+			body = self.cache.get(index)
+			if body is None:
+				body = self.cache[index] = formPng(index)
+		validators = params.get('validators', 'etag,modified')
+		headers = {'Content-Type': 'image/png'}
+		if 'etag' in validators:
+			headers['ETag'] = '"img-%d-%d"' % (index, len(body))
+		if 'modified' in validators:
+			headers['Last-Modified'] = LAST_MODIFIED
+		if params.get('cc'):
+			headers['Cache-Control'] = params['cc']
+		if params.get('status') or self.status:
+			status, body = int(params.get('status') or self.status), b''
+		elif (headers.get('ETag') and self.headers.get('If-None-Match') == headers['ETag']) or (
+				headers.get('Last-Modified') and self.headers.get('If-Modified-Since') == headers['Last-Modified']):
+			status, body = 304, b''
+		else:
+			status = 200
+		with self.lock:
+			self.requests.append((self.path, status))
+		self.send_response(status)
+		for name, value in headers.items():
+			self.send_header(name, value)
+		if params.get('length') == 'none':
+			self.send_header('Connection', 'close')
+			self.close_connection = True
+		else:
+			self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		drip = float(params.get('drip') or 0)
+		try:
+			for i in range(0, len(body), 64 if drip else max(1, len(body))):
+				self.wfile.write(body[i:i + (64 if drip else len(body))])
+				self.wfile.flush()
+				if drip:
+					time.sleep(drip)
+		except OSError:
+			pass  # the client gave up
+
+	def log_message(self, *args):
+		pass
+
+
+class _ImageServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+	daemon_threads = True
+
+
+class ImageHost:
+	"""The running stand-in image host of one test: url, the requests it saw, the latency it adds and the
+	error status it answers every request with (0 serves images)."""
+
+	def __init__(self, url: str):
+		self.url = url
+		self.requests = _ImageHandler.requests
+
+	@property
+	def latency(self) -> float:
+		return _ImageHandler.latency
+
+	@latency.setter
+	def latency(self, seconds: float) -> None:
+		_ImageHandler.latency = seconds
+
+	@property
+	def status(self) -> int:
+		return _ImageHandler.status
+
+	@status.setter
+	def status(self, code: int) -> None:
+		_ImageHandler.status = code
+
+
+@pytest.fixture(scope='session')
+def _image_server():
+	server = _ImageServer(('127.0.0.1', 0), _ImageHandler)
+	threading.Thread(target=server.serve_forever, name='test-images', daemon=True).start()
+	yield f"http://127.0.0.1:{server.server_address[1]}"
+	server.shutdown()
+
+
+@pytest.fixture
+def image_host(_image_server):
+	with _ImageHandler.lock:
+		_ImageHandler.requests.clear()
+	host = ImageHost(_image_server)
+	yield host
+	host.latency = 0.0
+	host.status = 0
+
+
+@pytest.fixture(scope='session')
+def form_pdf():
+	return formPdf
+
+
+@pytest.fixture(scope='session')
+def form_values():
+	return formValues
+
+
+@pytest.fixture(scope='session')
+def form_png():
+	return formPng
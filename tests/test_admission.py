@@ -0,0 +1,78 @@
+# Admission control (AtkAdmission) of /api/fill and atkFillPdfFromData.
+import base64
+
+import pytest
+
+import app as atkapp
+
+
+@pytest.fixture
+def admission(monkeypatch):
+	adm = atkapp.AtkAdmission(64 * 1024 * 1024, 1000, 0, 0)
+	monkeypatch.setattr(atkapp, 'atkAdmission', adm)
+	return adm
+
+
+@pytest.fixture(scope='module')
+def pdf(form_pdf):
+	return form_pdf(1, 4)
+
+
+def _idle(adm):
+	stats = adm.stats()
+	return stats['running'] == 0 and stats['memory'] == 0 and stats['cpuMs'] == 0
+
+
+def test_busy_request_is_rejected_before_decoding(admission, pdf, monkeypatch):
+	decoded = []
+	monkeypatch.setattr(atkapp, 'atkResolveTemplate', lambda *a: decoded.append(a))
+	with admission.admit(1, 2000):
+		res = atkapp.app.test_client().post('/api/fill', json={"pdf": base64.b64encode(pdf).decode(), "data": {}})
+	assert res.status_code == 429
+	assert res.get_json()['code'] == 'ATKPDF-15'
+	assert int(res.headers['Retry-After']) >= 1
+	assert decoded == []
+	assert admission.stats()['rejected'] == 1 and _idle(admission)
+
+
+def test_failure_after_admission_releases_budget(admission, pdf, monkeypatch):
+	def fail(*a, **kw):
+		raise OSError('spool dir gone')
+	monkeypatch.setattr(atkapp, 'pxSpoolPath', fail)
+	with pytest.raises(OSError):
+		atkapp.atkFillPdfFromData({"pdf": pdf, "data": {}, "return": "bytes"})
+	assert _idle(admission)
+	# an idle worker still admits anything
+	with admission.admit(10 ** 12, 10 ** 9):
+		pass
+
+
+def test_fill_replaces_estimate_and_releases(admission, pdf, monkeypatch):
+	seen = []
+	render = atkapp.atkEngine.render
+
+	def spy(*a, **kw):
+		seen.append(admission.stats())
+		return render(*a, **kw)
+	monkeypatch.setattr(atkapp.atkEngine, 'render', spy)
+	res = atkapp.atkFillPdfFromData({"pdf": pdf, "data": {"p0_f0": "x"}})
+	assert res['report'] == 'success'
+	template = atkapp.atkLoadTemplate(pdf)[0]
+	assert seen[0]['memory'] == atkapp.atkAdmissionCost(template, {})[0]
+	assert _idle(admission)
+
+
+def test_estimate_before_decoding_counts_base64_twice(pdf):
+	raw = atkapp.atkAdmissionEstimate(pdf, None, {})
+	b64 = atkapp.atkAdmissionEstimate(base64.b64encode(pdf).decode(), None, {})
+	assert b64[0] >= raw[0] + len(pdf)
+	with_url = atkapp.atkAdmissionEstimate(pdf, None, {"img": {"source": "https://example.com/a.png"}})
+	assert with_url[0] - raw[0] == atkapp.ATK_ADMIT_IMAGE_FACTOR * atkapp.ATK_ADMIT_URL_IMAGE_BYTES
+
+
+def test_queue_default_follows_threads(monkeypatch):
+	monkeypatch.setattr('sys.argv', ['gunicorn', 'app:app', '--threads', '8'])
+	assert atkapp.pxServerThreads() == 8
+	monkeypatch.setattr('sys.argv', ['gunicorn', 'app:app'])
+	monkeypatch.setenv('GUNICORN_CMD_ARGS', '--workers 2 --threads=6')
+	assert atkapp.pxServerThreads() == 6
@@ -0,0 +1,87 @@
+# AtkWidgetFiller against fitz.Widget.update(), the way fills were done before it: same widget dictionaries
+# and the same rendered pages.
+import fitz
+import pytest
+
+import app as atkapp
+
+
+def _baseline(pdf, values):
+	doc = fitz.open("pdf", pdf)
+	for page in doc:
+		for widget in page.widgets():
+			if widget.field_name not in values:
+				continue
+			value = values[widget.field_name]
+			if widget.field_type == fitz.PDF_WIDGET_TYPE_CHECKBOX:
+				widget.field_value = str(value).lower() in ['true', '1', 'yes', 'on', 'x']
+			else:
+				widget.field_value = str(value)
+			widget.update()
+	return fitz.open("pdf", doc.tobytes())
+
+
+def _filled(pdf, values):
+	template = atkapp.atkLoadTemplate(pdf)[0]
+	res = atkapp.atkRenderTemplate(template, values, {})
+	assert res['report'] == 'success'
+	return fitz.open("pdf", res['pdf'])
+
+
+def _assert_same_pages(a, b):
+	for pa, pb in zip(a, b):
+		x, y = pa.get_pixmap(dpi=72), pb.get_pixmap(dpi=72)
+		assert sum(abs(p - q) > 40 for p, q in zip(x.samples, y.samples)) < len(x.samples) // 2000
+
+
+def _widgets(doc):
+	return {w.field_name: (w.field_value, doc.xref_get_key(w.xref, 'BS')[1]) for page in doc for w in page.widgets()}
+
+
+@pytest.fixture(scope='module')
+def styled():
+	"""Text fields with the border widths, quadding, fixed sizes and multiline flag mupdf lays out differently."""
+	doc = fitz.open()
+	page = doc.new_page()
+	specs = [(0, 0, 0, 0), (2, 0, 0, 0), (1, 1, 10, 0), (3, 2, 0, 0), (1, 0, 9, 4096), (2, 0, 0, 4096)]
+	for i, (border, quad, size, flags) in enumerate(specs):
+		widget = fitz.Widget()
+		widget.field_name = f"s{i}"
+		widget.field_type = fitz.PDF_WIDGET_TYPE_TEXT
+		widget.rect = fitz.Rect(40, 40 + i * 90, 300, 40 + i * 90 + (70 if flags else 30))
+		widget.text_fontsize = size
+		widget.field_flags = flags
+		page.add_widget(widget)
+	for widget, (border, quad, _, _) in zip(page.widgets(), specs):
+		doc.xref_set_key(widget.xref, 'BS/W', str(border))
+		doc.xref_set_key(widget.xref, 'Q', str(quad))
+	return doc.tobytes(garbage=1)
+
+
+@pytest.mark.parametrize('kind', ['text', 'mixed'])
+def test_form_fill_matches_widget_update(form_pdf, form_values, kind):
+	pdf, values = form_pdf(2, 8, kind), form_values(2, 8, kind)
+	base, new = _baseline(pdf, values), _filled(pdf, values)
+	assert _widgets(new) == _widgets(base)
+	_assert_same_pages(new, base)
+
+
+def test_borders_quadding_and_multiline_match_widget_update(styled):
+	values = {"s%d" % i: "Fill %d, a value" % i for i in range(6)}
+	values["s4"] = values["s5"] = "A longer value that has to wrap over more than one line\nand a second paragraph"
+	base, new = _baseline(styled, values), _filled(styled, values)
+	assert _widgets(new) == _widgets(base)
+	_assert_same_pages(new, base)
+
+
+def _spans(doc):
+	return [(round(s['size'], 1), round(s['origin'][0], 1), round(s['origin'][1], 1))
+		for b in doc[0].get_text('dict')['blocks'] for l in b['lines'] for s in l['spans']]
+
+
+def test_unicode_values_are_laid_out_like_mupdf(styled):
+	# the same glyph widths in Helvetica, so the font-cache layout must land where mupdf puts the ASCII text
+	shown = {"s%d" % i: "Şişli" for i in range(4)}
+	shown["s4"] = shown["s5"] = "Şişli Göğüş İstanbul\nşehir"
+	ascii_ = {name: value.replace("Ş", "S").replace("ş", "s").replace("ğ", "g").replace("İ", "I") for name, value in shown.items()}
+	assert _spans(_filled(styled, shown)) == _spans(_baseline(styled, ascii_))
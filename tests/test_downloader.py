@@ -0,0 +1,48 @@
+# AtkImageDownloader limits: the size cap and the overall deadline, against the stand-in image host.
+import time
+
+import pytest
+
+import app as atkapp
+
+
+@pytest.fixture
+def downloader():
+	return atkapp.AtkImageDownloader(2, 1.0, chunk_size=65536)
+
+
+def test_small_image_is_fetched(downloader, image_host, form_png):
+	status, body, _ = downloader.fetch(f'{image_host.url}/img/1.png', 1 << 20)
+	assert (status, body) == (200, form_png(1))
+
+
+@pytest.mark.parametrize('length', ['', 'none'])
+def test_size_cap(downloader, image_host, form_png, length):
+	# announced by Content-Length, or only found while streaming
+	status, body, _ = downloader.fetch(f'{image_host.url}/img/2.png?length={length}', len(form_png(2)) - 1)
+	assert (status, body) == (200, None)
+	assert downloader.too_large == 1
+	assert downloader.fetch(f'{image_host.url}/img/2.png?length={length}', len(form_png(2)))[1] == form_png(2)
+
+
+def test_deadline_across_chunks(downloader, image_host):
+	start = time.monotonic()
+	status, body, _ = downloader.fetch(f'{image_host.url}/img/3.png?drip=0.1', 1 << 20)
+	assert body is None and downloader.timeouts == 1
+	assert time.monotonic() - start < 1.5
+
+
+def test_deadline_within_one_slow_chunk(downloader, image_host, form_png):
+	# the whole body is far below the chunk size and every piece arrives well inside the read timeout
+	assert len(form_png(4)) < downloader.chunk_size
+	start = time.monotonic()
+	status, body, _ = downloader.fetch(f'{image_host.url}/img/4.png?drip=0.3&length=none', 1 << 20)
+	assert body is None and downloader.timeouts == 1
+	assert time.monotonic() - start < 1.5
+
+
+def test_stalled_body_times_out_at_the_deadline(downloader, image_host):
+	start = time.monotonic()
+	_, body, _ = downloader.fetch(f'{image_host.url}/img/5.png?drip=3', 1 << 20)
+	assert body is None and downloader.timeouts == 1
+	assert time.monotonic() - start < 1.5
@@ -0,0 +1,66 @@
+# Process-pool render engine (AtkRenderEngine).
+import json
+
+import fitz
+import pytest
+
+import app as atkapp
+
+
+@pytest.fixture(scope='module')
+def template(form_pdf):
+	return atkapp.atkLoadTemplate(form_pdf(1, 2))[0]
+
+
+@pytest.fixture
+def engine():
+	eng = atkapp.AtkRenderEngine(1, max_tasks=1)
+	yield eng
+	eng.shutdown()
+
+
+def _stage_count(stage):
+	series = atkapp.atkMetrics.collect()['atkpdf_stage_seconds']
+	hist = series.get(json.dumps([["stage", stage]]))
+	return hist[-1] if hist else 0
+
+
+def test_round_trip(engine, template, tmp_path):
+	res = engine.render(template, {"p0_f0": "from the pool"}, {})
+	assert res['report'] == 'success'
+	assert fitz.open("pdf", res['pdf'])[0].load_widget(template.fields["p0_f0"][0]["xref"]).field_value == "from the pool"
+	out = tmp_path / 'out.pdf'
+	res = engine.render(template, {"p0_f1": "to a file"}, {}, out_path=str(out))
+	assert res['report'] == 'success' and res['bytes'] == out.stat().st_size > 0
+
+
+def test_pool_is_recycled_after_max_tasks(engine, template):
+	assert engine.render(template, {"p0_f0": "a"}, {})['report'] == 'success'
+	first = engine._pool
+	assert engine.render(template, {"p0_f0": "b"}, {})['report'] == 'success'
+	assert engine._pool is not first and engine.restarts == 0
+
+
+def test_engine_metrics_reach_the_worker(engine, template):
+	before = _stage_count('open')
+	res = engine.render(template, {"p0_f0": "x"}, {})
+	assert 'metrics' not in res
+	assert _stage_count('open') == before + 1
+
+
+def test_drained_values_merge_without_gauges(tmp_path):
+	def registry():
+		m = atkapp.AtkMetrics()
+		m.metrics_dir = lambda: str(tmp_path)
+		m.describe('t_total', 'counter', 'test counter')
+		m.describe('t_now', 'gauge', 'test gauge')
+		return m
+	child, worker = registry(), registry()
+	child.forward = True
+	child.inc('t_total', 2)
+	child.inc('t_now', 1)
+	values = child.drain()
+	assert child.collect()['t_total'] == {}
+	worker.inc('t_total', 1)
+	worker.merge(values)
+	assert worker.collect()['t_total'] == {"[]": 3} and worker.collect()['t_now'] == {}
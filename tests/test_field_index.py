@@ -0,0 +1,68 @@
+# Fills planned from the per-template field index (AtkTemplate.fields) and /api/fields served from it.
+import fitz
+import pytest
+
+import app as atkapp
+
+
+@pytest.fixture(scope='module')
+def repeated(form_pdf):
+	"""Three pages with two fields each, three image fields, and "shared" on pages 0 and 2."""
+	doc = fitz.open("pdf", form_pdf(3, 2, 'text', 3))
+	for pno in (0, 2):
+		widget = fitz.Widget()
+		widget.field_name = "shared"
+		widget.field_type = fitz.PDF_WIDGET_TYPE_TEXT
+		widget.rect = fitz.Rect(40, 400, 280, 430)
+		doc[pno].add_widget(widget)
+	return doc.tobytes(garbage=1)
+
+
+def _fill(pdf, values, images=None):
+	template = atkapp.atkLoadTemplate(pdf)[0]
+	res = atkapp.atkRenderTemplate(template, values, images or {})
+	assert res['report'] == 'success'
+	return template, fitz.open("pdf", res['pdf'])
+
+
+def _values(page):
+	return {w.field_name: w.field_value for w in page.widgets()}
+
+
+def test_index_groups_widgets_by_name_in_document_order(repeated):
+	template = atkapp.atkLoadTemplate(repeated)[0]
+	assert [w["page"] for w in template.fields["shared"]] == [0, 2]
+	assert [w["page"] for w in template.fields["img1_af_image"]] == [1]
+	assert all(template.widgets[w["xref"]] is w for locs in template.fields.values() for w in locs)
+
+
+def test_fill_reaches_every_widget_of_a_name_and_nothing_else(repeated):
+	_, doc = _fill(repeated, {"shared": "both", "p1_f1": "one", "unknown": "ignored"})
+	assert _values(doc[0])["shared"] == _values(doc[2])["shared"] == "both"
+	assert _values(doc[1]) == {"p1_f0": "", "p1_f1": "one", "img1_af_image": ""}
+	assert _values(doc[0])["p0_f0"] == ""
+
+
+def test_image_goes_into_its_field_on_a_later_page(repeated, form_png):
+	template, doc = _fill(repeated, {}, {"img2_af_image": {"source": form_png(1, 60, 50)}})
+	rect = fitz.Rect(template.fields["img2_af_image"][0]["rect"])
+	assert doc[0].get_images() == doc[1].get_images() == []
+	placed = doc[2].get_image_info()
+	assert len(placed) == 1 and rect.contains(fitz.Rect(placed[0]["bbox"]))
+
+
+def test_anchored_image_goes_on_the_anchor_page(repeated, form_png):
+	template, doc = _fill(repeated, {}, {"logo": {"source": form_png(2, 60, 50), "anchor": "p1_f0", "fitToAnchor": True}})
+	rect = fitz.Rect(template.fields["p1_f0"][0]["rect"])
+	placed = doc[1].get_image_info()
+	assert len(placed) == 1 and rect.contains(fitz.Rect(placed[0]["bbox"]))
+	assert doc[0].get_images() == doc[2].get_images() == []
+
+
+def test_api_fields_lists_the_index(repeated):
+	res = atkapp.app.test_client().post('/api/fields', data=repeated, content_type='application/pdf')
+	fields = {f["name"]: f for f in res.get_json()["fields"]}
+	assert list(fields)[:2] == ["p0_f0", "p0_f1"]
+	assert [w["page"] for w in fields["shared"]["widgets"]] == [0, 2]
+	assert fields["p2_f1"]["page"] == 2 and fields["p2_f1"]["type"] == fitz.PDF_WIDGET_TYPE_TEXT
+	assert "widgets" not in fields["p0_f0"]
@@ -0,0 +1,82 @@
+# Flattening (atkFlatten): whole documents and selected pages, with the AcroForm rewritten for the rest.
+import fitz
+import pytest
+
+import app as atkapp
+
+
+@pytest.fixture(scope='module')
+def form(form_pdf):
+	"""Three pages with two fields each, plus "shared": one field whose kids sit on pages 0 and 1."""
+	doc = fitz.open("pdf", form_pdf(3, 2))
+	kids = []
+	for pno in (0, 1):
+		widget = fitz.Widget()
+		widget.field_name = "shared"
+		widget.field_type = fitz.PDF_WIDGET_TYPE_TEXT
+		widget.rect = fitz.Rect(40, 400, 280, 430)
+		doc[pno].add_widget(widget)
+		kids.append([w.xref for w in doc[pno].widgets() if w.field_name == "shared"][0])
+	parent = doc.get_new_xref()
+	doc.update_object(parent, '<< /FT /Tx /T (shared) /Kids [%s] >>' % ' '.join(f'{k} 0 R' for k in kids))
+	for kid in kids:
+		doc.xref_set_key(kid, "T", "null")
+		doc.xref_set_key(kid, "FT", "null")
+		doc.xref_set_key(kid, "Parent", f"{parent} 0 R")
+	catalog = doc.pdf_catalog()
+	fields = [f for f in doc.xref_get_key(catalog, "AcroForm/Fields")[1][1:-1].split(' 0 R') if f.strip()]
+	fields = [int(f) for f in fields if int(f) not in kids] + [parent]
+	doc.xref_set_key(catalog, "AcroForm/Fields", '[%s]' % ' '.join(f'{f} 0 R' for f in fields))
+	return doc.tobytes(garbage=1)
+
+
+def _fill(pdf, flatten):
+	template = atkapp.atkLoadTemplate(pdf)[0]
+	values = {f"p{p}_f{i}": f"value {p}-{i}" for p in range(3) for i in range(2)} | {"shared": "both pages"}
+	res = atkapp.atkRenderTemplate(template, values, {}, False, flatten)
+	assert res['report'] == 'success'
+	return fitz.open("pdf", res['pdf'])
+
+
+def _field_names(doc):
+	catalog = doc.pdf_catalog()
+	kind, value = doc.xref_get_key(catalog, "AcroForm/Fields")
+	if kind != 'array':
+		return None
+	return [doc.xref_get_key(int(x), "T")[1] for x in value[1:-1].split(' 0 R') if x.strip()]
+
+
+def test_partial_flatten_keeps_other_pages_widgets(form):
+	doc = _fill(form, [0, 2])
+	assert list(doc[0].widgets()) == list(doc[2].widgets()) == []
+	assert {w.field_name: w.field_value for w in doc[1].widgets()} == {
+		"p1_f0": "value 1-0", "p1_f1": "value 1-1", "shared": "both pages"}
+	# baked values stay visible as page content
+	for pno in (0, 2):
+		assert f"value {pno}-0" in doc[pno].get_text() and f"value {pno}-1" in doc[pno].get_text()
+	assert "both pages" in doc[0].get_text()
+	assert "value 1-0" in doc[1].get_text()
+
+
+def test_partial_flatten_rewrites_fields(form):
+	doc = _fill(form, [0, 2])
+	assert _field_names(doc) == ["p1_f0", "p1_f1", "shared"]
+	# the shared field lives on with its page 1 kid only
+	shared = [w for w in doc[1].widgets() if w.field_name == "shared"][0]
+	parent = int(doc.xref_get_key(shared.xref, "Parent")[1].split()[0])
+	assert doc.xref_get_key(parent, "Kids")[1] == f"[{shared.xref} 0 R]"
+	assert fitz.open("pdf", doc.tobytes(garbage=3)).is_form_pdf == 3
+
+
+def test_flatten_of_every_widget_page_drops_the_form(form):
+	for flatten in (True, [0, 1, 2], [0, 1, 2, 7]):
+		doc = _fill(form, flatten)
+		assert _field_names(doc) is None and not doc.is_form_pdf
+		assert all(not list(page.widgets()) for page in doc)
+		assert "both pages" in doc[1].get_text()
+
+
+def test_flatten_of_pages_without_widgets_changes_nothing(form):
+	doc = _fill(form, [7])
+	assert _field_names(doc) == ["p0_f0", "p0_f1", "p1_f0", "p1_f1", "p2_f0", "p2_f1", "shared"]
+	assert sum(len(list(page.widgets())) for page in doc) == 8
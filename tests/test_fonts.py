@@ -0,0 +1,115 @@
+# Fonts written by AtkWidgetFiller for values outside WinAnsi: shaping, subsets and the subset cache of AtkFontCache.
+import re
+
+import fitz
+import pytest
+
+import app as atkapp
+
+
+@pytest.fixture
+def fonts(monkeypatch):
+	cache = atkapp.AtkFontCache(32 * 1024 * 1024)
+	monkeypatch.setattr(atkapp, 'atkFonts', cache)
+	return cache
+
+
+@pytest.fixture(scope='module')
+def template(form_pdf):
+	return atkapp.atkLoadTemplate(form_pdf(1, 2, 'intl'))[0]
+
+
+def _fill(template, values, flatten=True):
+	res = atkapp.atkRenderTemplate(template, {"p0_f%d" % i: v for i, v in enumerate(values)}, {}, False, flatten)
+	assert res['report'] == 'success'
+	return fitz.open("pdf", res['pdf'])
+
+
+def _font_files(doc):
+	files = {}
+	for xref in range(1, doc.xref_length()):
+		kind, value = doc.xref_get_key(xref, "FontFile3")
+		if kind == 'xref':
+			files[doc.xref_get_key(xref, "FontName")[1]] = len(doc.xref_stream_raw(int(value.split()[0])))
+	return files
+
+
+def _to_unicode(doc):
+	"""Characters mapped by the /ToUnicode cmaps of the fonts the filler wrote."""
+	chars = set()
+	for xref in range(1, doc.xref_length()):
+		kind, value = doc.xref_get_key(xref, "ToUnicode")
+		if kind == 'xref' and doc.xref_get_key(xref, "Subtype")[1] == '/Type0':
+			cmap = doc.xref_stream(int(value.split()[0])).decode('latin-1')
+			for block in re.findall(r'beginbfchar(.*?)endbfchar', cmap, re.S):
+				for _, dst in re.findall(r'<([0-9a-fA-F]+)>\s*<([0-9a-fA-F]+)>', block):
+					chars.update(chr(int(dst[i:i + 4], 16)) for i in range(0, len(dst), 4))
+	return chars
+
+
+def test_base14_subset_keeps_every_glyph(fonts, template, monkeypatch):
+	values = ["Şişli Göğüş İstanbul", "Привет мир"]
+	doc = _fill(template, values)
+	files = _font_files(doc)
+	assert len(files) == 1 and next(iter(files)).endswith('+Helvetica')
+	subset = doc[0].get_pixmap(dpi=72)
+	# the same fill with the whole font embedded
+	monkeypatch.setattr(atkapp, 'atkFonts', atkapp.AtkFontCache(32 * 1024 * 1024))
+	monkeypatch.setattr(fitz.mupdf, 'pdf_subset_fonts2', lambda *a: None)
+	whole = _fill(template, values)
+	assert sum(_font_files(whole).values()) > 3 * sum(files.values())
+	assert subset.samples == whole[0].get_pixmap(dpi=72).samples
+	assert doc[0].get_text().split('\n')[:2] == values
+
+
+@pytest.mark.parametrize('flatten', [False, True])
+def test_arabic_is_shaped_and_extracts_in_logical_order(fonts, template, flatten):
+	value = "مرحبا بالعالم"
+	doc = _fill(template, [value, ""], flatten)
+	assert doc[0].get_text().strip() == value
+	shaped = atkapp.atkVisualOrder(atkapp.atkShapeArabic(value))
+	# joined presentation forms, drawn right to left
+	assert [ch for ch, _ in shaped][:3] == ['ﻢ', 'ﻟ', 'ﺎ']
+	assert ''.join(src for _, src in reversed(shaped)) == value
+	# lam-alef is one glyph standing for both letters
+	assert atkapp.atkShapeArabic("سلام") == [('ﺳ', 'س'), ('ﻼ', 'لا'), ('ﻡ', 'م')]
+
+
+def test_numbers_and_brackets_in_right_to_left_text():
+	shaped = atkapp.atkVisualOrder(atkapp.atkShapeArabic("رقم (12)"))
+	drawn = ''.join(ch for ch, _ in shaped)
+	assert drawn.startswith('(12)') and drawn.endswith('ﺭ')
+
+
+def test_each_output_subset_holds_only_its_own_glyphs(fonts, template):
+	first = _fill(template, ["Şişli", ""])
+	second = _fill(template, ["Göğü", ""])
+	assert _to_unicode(first) == set("Şişli")
+	assert _to_unicode(second) == set("Göğü")
+	assert second[0].get_text().strip() == "Göğü"
+
+
+def test_subset_cache_is_keyed_by_glyph_set(fonts, template):
+	_fill(template, ["Şişli Göğüş", ""])
+	assert fonts.stats()['subsetMisses'] == 1
+	# the same glyphs, in any order or split over fields, copy the cached subset
+	_fill(template, ["Göğüş Şişli", ""])
+	_fill(template, ["Göğüş Şişli", "Şişli"])
+	assert fonts.stats()['subsetMisses'] == 1 and fonts.stats()['subsetHits'] == 2
+	# fewer or other glyphs make a subset of their own
+	_fill(template, ["şiş", ""])
+	_fill(template, ["Şişli İ", "Göğüş"])
+	assert fonts.stats()['subsetMisses'] == 3 and fonts.stats()['subsets'] == 3
+
+
+def test_subsets_are_evicted_first_within_the_bound(template, monkeypatch):
+	cache = atkapp.AtkFontCache(32 * 1024 * 1024)
+	monkeypatch.setattr(atkapp, 'atkFonts', cache)
+	_fill(template, ["Şişli", ""])
+	font_bytes = cache.bytes
+	_fill(template, ["Göğüş", ""])
+	subset_bytes = cache.bytes - font_bytes
+	cache.max_bytes = cache.bytes - 1
+	_fill(template, ["İstanbul ğ", ""])
+	assert cache.stats()['subsets'] < 3 and cache.bytes <= cache.max_bytes
+	assert cache.stats()['entries'] >= 1 and subset_bytes > 0
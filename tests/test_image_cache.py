@@ -0,0 +1,111 @@
+# Image URL cache (AtkImageCache / atkFetchImage) against the stand-in image host from conftest.py.
+import threading
+
+import pytest
+
+import app as atkapp
+
+
+def _cache(monkeypatch, ttl=300, disk_dir=None):
+	cache = atkapp.AtkImageCache(8 * 1024 * 1024, ttl, str(disk_dir) if disk_dir else None, 64 * 1024 * 1024)
+	monkeypatch.setattr(atkapp, 'atkImageCache', cache)
+	return cache
+
+
+def test_hit_serves_from_memory(image_host, form_png, monkeypatch):
+	cache = _cache(monkeypatch)
+	url = f'{image_host.url}/img/1.png'
+	first = atkapp.atkFetchImage(url, 1 << 20)
+	second = atkapp.atkFetchImage(url, 1 << 20)
+	assert first == second == form_png(1)
+	assert image_host.requests == [('/img/1.png', 200)]
+	assert (cache.hits, cache.misses) == (1, 1)
+
+
+@pytest.mark.parametrize('validators', ['etag', 'modified'])
+def test_stale_entry_is_revalidated(image_host, monkeypatch, validators):
+	cache = _cache(monkeypatch, ttl=0)
+	url = f'{image_host.url}/img/2.png?validators={validators}'
+	body = atkapp.atkFetchImage(url, 1 << 20)
+	assert atkapp.atkFetchImage(url, 1 << 20) == body
+	assert [status for _, status in image_host.requests] == [200, 304]
+	assert cache.revalidated == 1 and cache.refreshed == 0
+
+
+def test_ttl_expiry_refetches(image_host, form_png, monkeypatch):
+	cache = _cache(monkeypatch, ttl=60)
+	url = f'{image_host.url}/img/3.png?validators=none'
+	atkapp.atkFetchImage(url, 1 << 20)
+	atkapp.atkFetchImage(url, 1 << 20)
+	assert len(image_host.requests) == 1
+	cache.get(atkapp.pxNormalizeUrl(url))['fetched'] -= 61
+	assert atkapp.atkFetchImage(url, 1 << 20) == form_png(3)
+	assert [status for _, status in image_host.requests] == [200, 200]
+	assert cache.refreshed == 1
+
+
+@pytest.mark.parametrize('status', [500, 503])
+def test_stale_entry_served_when_origin_fails(image_host, form_png, monkeypatch, status):
+	cache = _cache(monkeypatch, ttl=0)
+	url = f'{image_host.url}/img/8.png'
+	assert atkapp.atkFetchImage(url, 1 << 20) == form_png(8)
+	image_host.status = status
+	assert atkapp.atkFetchImage(url, 1 << 20) == form_png(8)
+	assert [s for _, s in image_host.requests] == [200, status]
+	assert cache.stats()['staleServed'] == 1
+
+
+def test_stale_entry_served_when_origin_unreachable(image_host, form_png, monkeypatch):
+	cache = _cache(monkeypatch, ttl=0)
+	url = f'{image_host.url}/img/9.png'
+	atkapp.atkFetchImage(url, 1 << 20)
+
+	def refuse(*args, **kwargs):
+		raise ConnectionError('refused')
+
+	monkeypatch.setattr(atkapp.atkDownloader.session(), 'get', refuse)
+	assert atkapp.atkFetchImage(url, 1 << 20) == form_png(9)
+	assert cache.stale_served == 1
+
+
+def test_client_error_drops_stale_entry(image_host, monkeypatch):
+	_cache(monkeypatch, ttl=0)
+	url = f'{image_host.url}/img/10.png'
+	atkapp.atkFetchImage(url, 1 << 20)
+	image_host.status = 404
+	assert atkapp.atkFetchImage(url, 1 << 20) is None
+
+
+def test_cache_control(image_host, monkeypatch):
+	cache = _cache(monkeypatch)
+	stored = f'{image_host.url}/img/4.png?cc=max-age%3D0'
+	atkapp.atkFetchImage(stored, 1 << 20)
+	atkapp.atkFetchImage(stored, 1 << 20)
+	assert [status for _, status in image_host.requests] == [200, 304]
+	no_store = f'{image_host.url}/img/5.png?cc=no-store'
+	atkapp.atkFetchImage(no_store, 1 << 20)
+	assert cache.get(atkapp.pxNormalizeUrl(no_store)) is None
+
+
+def test_disk_tier_is_shared(image_host, monkeypatch, tmp_path):
+	_cache(monkeypatch, disk_dir=tmp_path)
+	url = f'{image_host.url}/img/6.png'
+	body = atkapp.atkFetchImage(url, 1 << 20)
+	# a second process starts with an empty memory tier over the same directory
+	other = _cache(monkeypatch, disk_dir=tmp_path)
+	assert atkapp.atkFetchImage(url, 1 << 20) == body
+	assert len(image_host.requests) == 1
+	assert other.disk_hits == 1 and other.hits == 1
+
+
+def test_concurrent_misses_download_once(image_host, monkeypatch):
+	cache = _cache(monkeypatch)
+	image_host.latency = 0.05
+	url = f'{image_host.url}/img/7.png'
+	threads = [threading.Thread(target=atkapp.atkFetchImage, args=(url, 1 << 20)) for _ in range(4)]
+	for t in threads:
+		t.start()
+	for t in threads:
+		t.join()
+	assert len(image_host.requests) == 1
+	assert cache._inflight == {}
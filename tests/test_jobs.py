@@ -0,0 +1,141 @@
+# Asynchronous jobs (AtkJobManager, /api/jobs): lifecycle, cancellation through the marker file and the sweep.
+import json
+import os
+import threading
+import time
+
+import fitz
+import pytest
+
+import app as atkapp
+
+
+@pytest.fixture
+def jobs(monkeypatch, tmp_path):
+	monkeypatch.setenv('ATKPDF_JOB_DIR', str(tmp_path))
+	manager = atkapp.AtkJobManager(1, 4, 3600)
+	monkeypatch.setattr(atkapp, 'atkJobs', manager)
+	return manager
+
+
+@pytest.fixture
+def client():
+	return atkapp.app.test_client()
+
+
+def _wait(manager, job_id, timeout=10.0):
+	deadline = time.monotonic() + timeout
+	while time.monotonic() < deadline:
+		job = manager.status(job_id)
+		if job["state"] not in ("queued", "running"):
+			return job
+		time.sleep(0.02)
+	raise AssertionError(f"job {job_id} did not finish")
+
+
+def test_fill_job_lifecycle(jobs, client, form_pdf):
+	res = client.post('/api/jobs/fill?fields=' + json.dumps({"p0_f0": "queued fill"}), data=form_pdf(1, 2),
+		content_type='application/pdf')
+	assert res.status_code == 202
+	job_id = res.get_json()["job"]["id"]
+	assert res.headers["Location"] == f"/api/jobs/{job_id}"
+	assert _wait(jobs, job_id)["state"] == "succeeded"
+	view = client.get(f'/api/jobs/{job_id}').get_json()["job"]
+	assert view["progress"] == {"done": 1, "total": 1} and "pid" not in view
+	res = client.get(view["resultUrl"])
+	assert res.status_code == 200 and res.mimetype == 'application/pdf'
+	assert "queued fill" in fitz.open("pdf", res.data)[0].get_text()
+	assert client.delete(f'/api/jobs/{job_id}').status_code == 200
+	assert not os.listdir(jobs.job_dir())
+	assert client.get(f'/api/jobs/{job_id}').status_code == 404
+	assert jobs.stats()["succeeded"] == 1
+
+
+def test_result_of_unfinished_job_is_409(jobs, client, monkeypatch):
+	release = threading.Event()
+	monkeypatch.setattr(atkapp, 'atkFillPdfFromData', lambda obj: release.wait(10) and {"report": "success"})
+	job = jobs.submit('fill', {"pdf": b'%PDF'})
+	try:
+		assert client.get(f'/api/jobs/{job["id"]}/result').status_code == 409
+	finally:
+		release.set()
+	assert _wait(jobs, job["id"])["state"] == "succeeded"
+
+
+def test_cancel_from_another_worker_stops_a_running_batch(jobs, monkeypatch):
+	started = threading.Event()
+
+	def batch(obj, progress):
+		for n in range(1, 1001):
+			progress(n, 1000)
+			started.set()
+			time.sleep(0.01)
+		return {"report": "success"}
+
+	monkeypatch.setattr(atkapp, 'atkFillPdfBatch', batch)
+	job = jobs.submit('batch', {"pdf": b'%PDF', "records": [{}] * 1000})
+	assert started.wait(5)
+	# another worker has none of this process's state: it only sees the job files and writes the marker
+	other = atkapp.AtkJobManager(1, 4, 3600)
+	assert other.cancel(job["id"])["cancelRequested"] is True
+	done = _wait(jobs, job["id"])
+	assert done["state"] == "cancelled" and done["error"]["code"] == 'ATKPDF-12'
+	assert 0 < done["progress"]["done"] < 1000
+	assert sorted(os.listdir(jobs.job_dir())) == [job["id"] + '.json']
+
+
+def test_cancel_before_the_job_starts(jobs, monkeypatch):
+	release = threading.Event()
+	monkeypatch.setattr(atkapp, 'atkFillPdfFromData', lambda obj: release.wait(10) and {"report": "success"})
+	first = jobs.submit('fill', {"pdf": b'%PDF'})
+	second = jobs.submit('fill', {"pdf": b'%PDF'})
+	assert jobs.cancel(second["id"])["state"] == "queued"
+	release.set()
+	assert _wait(jobs, first["id"])["state"] == "succeeded"
+	job = _wait(jobs, second["id"])
+	assert job["state"] == "cancelled" and job["started"] is None
+	assert jobs.stats()["cancelled"] == 1
+
+
+def test_full_queue_is_rejected(jobs, client, monkeypatch, form_pdf):
+	release = threading.Event()
+	monkeypatch.setattr(atkapp, 'atkFillPdfFromData', lambda obj: release.wait(10) and {"report": "success"})
+	try:
+		# one job on the worker, four queued
+		ids = [jobs.submit('fill', {"pdf": b'%PDF'})["id"]]
+		while jobs.status(ids[0])["state"] == "queued":
+			time.sleep(0.01)
+		ids += [jobs.submit('fill', {"pdf": b'%PDF'})["id"] for _ in range(4)]
+		res = client.post('/api/jobs/fill', data=form_pdf(1, 1), content_type='application/pdf')
+		assert res.status_code == 503 and res.get_json()["code"] == 'ATKPDF-10'
+		assert res.headers["Retry-After"] == "5" and jobs.stats()["rejected"] == 1
+	finally:
+		release.set()
+	for job_id in ids:
+		assert _wait(jobs, job_id)["state"] == "succeeded"
+
+
+def test_sweep_removes_expired_jobs_only(jobs):
+	now = time.time()
+	dead = 2 ** 22 + 7  # above the default pid_max, so no such process
+	records = {
+		"old": {"finished": now - 7200, "pid": os.getpid(), "created": now - 7300},
+		"recent": {"finished": now - 60, "pid": os.getpid(), "created": now - 120},
+		"orphaned": {"finished": None, "pid": dead, "created": now - 7200},
+		"running": {"finished": None, "pid": os.getpid(), "created": now - 7200},
+	}
+	ids = {}
+	os.makedirs(jobs.job_dir(), exist_ok=True)
+	for name, fields in records.items():
+		ids[name] = '%032x' % len(ids)
+		jobs._save({"id": ids[name], "kind": "fill", "state": "succeeded" if fields["finished"] else "running", **fields})
+		with open(jobs._paths(ids[name])["result"], 'wb') as f:
+			f.write(b'result')
+	assert jobs.status(ids["orphaned"])["state"] == "failed"
+	assert jobs.sweep(force=True) == 2
+	left = {name for name, jid in ids.items() if jobs.status(jid)}
+	assert left == {"recent", "running"}
+	assert len(os.listdir(jobs.job_dir())) == 4
+	# throttled to once a minute unless forced
+	jobs.retention = 0
+	assert jobs.sweep() == 0 and jobs.sweep(force=True) == 1
@@ -0,0 +1,51 @@
+# Merged batch output (atkMergeRecords): template resources are stored once, not once per record.
+import os
+
+import fitz
+import pytest
+
+import app as atkapp
+
+
+@pytest.fixture(scope='module')
+def template(form_pdf):
+	src = fitz.open("pdf", form_pdf(2, 6, 'mixed'))
+	for page in src:
+		# incompressible, so a per-record copy would show up in the file size
+		pix = fitz.Pixmap(fitz.csRGB, 170, 170, os.urandom(170 * 170 * 3), False)
+		page.insert_image(fitz.Rect(300, 600, 500, 780), pixmap=pix)
+	pdf = src.tobytes(garbage=1)
+	return pdf, atkapp.atkLoadTemplate(pdf)[0]
+
+
+@pytest.fixture(scope='module')
+def record(form_values):
+	return lambda n: form_values(2, 6, 'mixed') | {'p0_f0': 'record %d' % n}
+
+
+def _merge(tpl, record, records, path, optimize='fast'):
+	jobs = [(i, record(i), {}) for i in range(records)]
+	errors, _ = atkapp.atkMergeRecords(tpl, jobs, str(path), optimize=optimize)
+	assert errors == []
+	return os.path.getsize(path), fitz.open(str(path))
+
+
+@pytest.mark.parametrize('optimize', ['fast', 'compact'])
+def test_records_do_not_copy_template_resources(template, record, tmp_path, optimize):
+	pdf, tpl = template
+	one, _ = _merge(tpl, record, 1, tmp_path / 'one.pdf', optimize)
+	size, doc = _merge(tpl, record, 10, tmp_path / 'ten.pdf', optimize)
+	assert (size - one) / 9 < len(pdf) / 20
+	images = [x for x in range(1, doc.xref_length()) if doc.xref_get_key(x, 'Subtype')[1] == '/Image']
+	assert len(images) == 2
+
+
+def test_merged_pages_match_single_fill(template, record, tmp_path):
+	pdf, tpl = template
+	_, doc = _merge(tpl, record, 3, tmp_path / 'three.pdf')
+	assert doc.page_count == 6
+	single = fitz.open("pdf", atkapp.atkRenderTemplate(tpl, record(2), {}, False, True)['pdf'])
+	for pno in range(2):
+		assert doc[4 + pno].get_text() == single[pno].get_text()
+		a, b = doc[4 + pno].get_pixmap(dpi=36), single[pno].get_pixmap(dpi=36)
+		assert sum(abs(x - y) > 40 for x, y in zip(a.samples, b.samples)) < len(a.samples) // 200
@@ -0,0 +1,55 @@
+# Cross-worker aggregation of AtkMetrics snapshots.
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+import app as atkapp
+
+
+@pytest.fixture
+def metrics(tmp_path):
+	m = atkapp.AtkMetrics()
+	# not through ATKPDF_METRICS_DIR, which the process-wide registry would follow
+	m.metrics_dir = lambda: str(tmp_path)
+	m.describe('t_total', 'counter', 'test counter')
+	return m
+
+
+def _write(directory, pid, parent, value):
+	snap = {"pid": pid, "parent": parent, "values": {"t_total": {"[]": value}}}
+	(directory / f'{pid}.json').write_text(json.dumps(snap))
+
+
+def _dead_pid():
+	proc = subprocess.Popen([sys.executable, '-c', 'pass'])
+	proc.wait()
+	return proc.pid
+
+
+def test_live_workers_are_summed(metrics, tmp_path):
+	metrics.inc('t_total', 2)
+	# a sibling worker: alive and started by the same master
+	_write(tmp_path, os.getppid(), os.getppid(), 5)
+	assert metrics.collect()['t_total'] == {"[]": 7}
+
+
+def test_dead_and_foreign_snapshots_are_dropped(metrics, tmp_path):
+	metrics.inc('t_total', 1)
+	dead = _dead_pid()
+	_write(tmp_path, dead, os.getppid(), 100)
+	# alive, but from another master (an earlier run sharing the directory)
+	_write(tmp_path, os.getppid(), os.getppid() + 1, 1000)
+	assert metrics.collect()['t_total'] == {"[]": 1}
+	assert sorted(os.listdir(tmp_path)) == []
+
+
+def test_retire_removes_own_snapshot(metrics, tmp_path):
+	metrics.inc('t_total', 3)
+	metrics.flush()
+	assert os.listdir(tmp_path) == [f'{os.getpid()}.json']
+	metrics.retire()
+	metrics.flush()
+	assert os.listdir(tmp_path) == []
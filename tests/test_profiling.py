@@ -0,0 +1,45 @@
+# Profiled fills (/api/fill with "profile") and /api/profiles: admin token required.
+import os
+
+import pytest
+
+import app as atkapp
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+	monkeypatch.setenv('ATKPDF_PROFILE_DIR', str(tmp_path))
+	monkeypatch.setenv('ATKPDF_ADMIN_TOKEN', 'secret-token')
+	return atkapp.app.test_client()
+
+
+def _fill(client, form_pdf, profile, token=None):
+	headers = {'X-Atkpdf-Admin-Token': token} if token is not None else {}
+	return client.post(f'/api/fill?profile={profile}', data=form_pdf(1, 2), content_type='application/pdf', headers=headers)
+
+
+@pytest.mark.parametrize('token', [None, '', 'wrong-token'])
+def test_profile_refused_without_the_admin_token(client, form_pdf, tmp_path, token):
+	res = _fill(client, form_pdf, '1', token)
+	assert res.status_code == 403 and res.get_json()['code'] == 'ATKPDF-13'
+	assert os.listdir(tmp_path) == []
+
+
+def test_profile_refused_when_no_token_is_configured(client, form_pdf, monkeypatch):
+	monkeypatch.delenv('ATKPDF_ADMIN_TOKEN')
+	res = _fill(client, form_pdf, 'return', '')
+	assert res.status_code == 403 and res.get_json()['code'] == 'ATKPDF-13'
+
+
+def test_profile_saved_and_served_to_the_admin_only(client, form_pdf):
+	res = _fill(client, form_pdf, '1', 'secret-token')
+	assert res.status_code == 200 and res.mimetype == 'application/pdf'
+	profile_id = res.headers['X-Atkpdf-Profile']
+	assert client.get(f'/api/profiles/{profile_id}').status_code == 403
+	report = client.get(f'/api/profiles/{profile_id}', headers={'X-Atkpdf-Admin-Token': 'secret-token'})
+	assert report.status_code == 200 and b'function calls' in report.data
+
+
+def test_unprofiled_fill_needs_no_token(client, form_pdf):
+	res = _fill(client, form_pdf, '0')
+	assert res.status_code == 200 and 'X-Atkpdf-Profile' not in res.headers
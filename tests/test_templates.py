@@ -0,0 +1,62 @@
+# Template registry (/api/templates) and template_id fills.
+import os
+
+import pytest
+
+import app as atkapp
+
+
+@pytest.fixture
+def client():
+	return atkapp.app.test_client()
+
+
+@pytest.fixture
+def registered(client, form_pdf):
+	res = client.post('/api/templates?name=form.pdf', data=form_pdf(1, 3), content_type='application/pdf')
+	assert res.status_code == 201
+	return res.get_json()['template_id']
+
+
+def test_template_id_fill_uses_cache(client, registered):
+	atkapp.atkTemplateCache.discard(registered)
+	assert atkapp.atkLoadRegisteredTemplate(registered)[1] is False
+	assert atkapp.atkLoadRegisteredTemplate(registered)[1] is True
+	res = client.post('/api/fill', json={"template_id": registered, "data": {"p0_f0": "x"}})
+	assert res.status_code == 200 and res.mimetype == 'application/pdf'
+
+
+def test_delete_by_another_worker_is_seen(client, registered):
+	assert atkapp.atkLoadRegisteredTemplate(registered) is not None
+	# another worker deletes the files; this worker still holds the template in its cache
+	for path in atkapp._atkTemplatePaths(registered) + (atkapp._atkFieldIndexPath(registered),):
+		os.remove(path)
+	assert atkapp.atkLoadRegisteredTemplate(registered) is None
+	res = client.post('/api/fill', json={"template_id": registered, "data": {"p0_f0": "x"}})
+	assert res.status_code == 404 and res.get_json()['code'] == 'ATKPDF-07'
+
+
+def test_delete_then_unknown(client, registered):
+	assert client.delete(f'/api/templates/{registered}').status_code == 200
+	assert client.get(f'/api/templates/{registered}').status_code == 404
+	assert client.delete(f'/api/templates/{registered}').status_code == 404
+
+
+def test_fields_of_a_registered_template_are_revalidated(client, registered):
+	url = f'/api/fields?template_id={registered}'
+	res = client.get(url)
+	etag = res.headers['ETag']
+	assert res.status_code == 200 and res.get_json()['template'] == registered
+	assert registered in etag and res.headers['Cache-Control'] == 'no-cache'
+	res = client.get(url, headers={'If-None-Match': etag})
+	assert res.status_code == 304 and res.headers['ETag'] == etag and not res.data
+	assert client.delete(f'/api/templates/{registered}').status_code == 200
+	for headers in ({}, {'If-None-Match': etag}):
+		res = client.get(url, headers=headers)
+		assert res.status_code == 404 and res.get_json()['code'] == 'ATKPDF-07'
+
+
+def test_fields_of_an_unknown_template_id(client):
+	for template_id in ('0' * 64, 'not-an-id'):
+		res = client.get(f'/api/fields?template_id={template_id}', headers={'If-None-Match': '"%s"' % atkapp.atkFieldIndexEtag(template_id)})
+		assert res.status_code == 404